@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from decouple import config
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'payments.middleware.MetricsMiddleware',
+    'payments.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -80,13 +83,90 @@ WSGI_APPLICATION = 'applepay_poc.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DB_ENGINE selects the backend: 'sqlite' (default, local development) or
+# 'postgresql' (production; concurrent writers do not share one file lock)
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+
+# Seconds a connection is kept open between requests (0 = close after each request)
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+
+# SQLite pragmas applied to every new connection:
+# WAL lets readers run alongside the single writer, synchronous=NORMAL is
+# durable in WAL mode without an fsync per commit
+SQLITE_INIT_COMMAND = ';'.join([
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',  # 20 MB page cache
+    'PRAGMA mmap_size=134217728',  # 128 MB memory-mapped reads
+])
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='applepay'),
+            'USER': config('DB_USER', default='applepay'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # QuerySet.iterator() streams through server-side cursors; disable
+            # only behind a transaction-pooling proxy such as PgBouncer
+            'DISABLE_SERVER_SIDE_CURSORS': config('DB_DISABLE_SERVER_SIDE_CURSORS', default=False, cast=bool),
+            'OPTIONS': {
+                'connect_timeout': config('DB_CONNECT_TIMEOUT', default=5, cast=int),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock (sqlite3 busy_timeout)
+                'timeout': config('DB_SQLITE_TIMEOUT', default=20, cast=int),
+                # Take the write lock when the transaction starts, so a
+                # read-then-write transaction never fails on lock upgrade
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': SQLITE_INIT_COMMAND,
+            },
+        }
+    }
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# CACHE_BACKEND: 'locmem' (default, per process), 'file' (CACHE_LOCATION is a
+# directory shared by the workers of one host), 'redis' (CACHE_LOCATION is a
+# redis:// URL, needs the redis package) or 'memcached' (needs pymemcache)
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': config('CACHE_LOCATION', default=''),
     }
 }
 
+# Shared tier of payments/cache.py TieredCache: a CACHES alias every worker can
+# reach ('' = each process keeps its own results). Set it to 'default' together
+# with a shared CACHE_BACKEND
+SHARED_CACHE_ALIAS = config('SHARED_CACHE_ALIAS', default='')
+# How long a worker waits for another worker computing the same value
+CACHE_LOCK_SECONDS = config('CACHE_LOCK_SECONDS', default=5.0, cast=float)
+# TTLs of the config status polled by the frontend and of parsed certificates
+CONFIG_STATUS_CACHE_SECONDS = config('CONFIG_STATUS_CACHE_SECONDS', default=30, cast=int)
+CERTIFICATE_CACHE_SECONDS = config('CERTIFICATE_CACHE_SECONDS', default=3600, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -141,6 +221,17 @@ REST_FRAMEWORK = {
 }
 
 # Logging configuration
+# Records are queued by the request thread and formatted/written by a background
+# listener (see payments/log.py), so logging never blocks a request on I/O.
+# LOG_FORMAT: 'text' (human-readable) or 'json' (one JSON object per line)
+# LOG_INFO_SAMPLE_RATE: fraction of INFO/DEBUG records kept per call site
+# LOG_QUEUE_SIZE: records beyond this backlog are dropped instead of blocking
+# LOG_FILE: also append the log to this file (e.g. logs/django.log)
+LOG_FORMAT = config('LOG_FORMAT', default='text')
+LOG_INFO_SAMPLE_RATE = config('LOG_INFO_SAMPLE_RATE', default=1.0, cast=float)
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+LOG_FILE = config('LOG_FILE', default='')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -149,16 +240,18 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'payments.log.JSONFormatter',
+        },
     },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
-        },
-        'file': {
-            'class': 'logging.FileHandler',
-            'filename': str(BASE_DIR / 'logs' / 'django.log'),
-            'formatter': 'verbose',
+            '()': 'payments.log.BackgroundHandler',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'verbose',
+            'stream': 'ext://sys.stderr',
+            'filename': str(BASE_DIR / LOG_FILE) if LOG_FILE else None,
+            'maxsize': LOG_QUEUE_SIZE,
+            'sample_rate': LOG_INFO_SAMPLE_RATE,
         },
     },
     'root': {
@@ -193,6 +286,9 @@ CORS_ALLOWED_ORIGINS = config(
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Allow clients to send Idempotency-Key on payment POSTs
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+
 # GMO Payment Gateway configuration
 # Note: Shop ID and Shop Pass are required for API authentication
 # Base URL: https://pt01.mul-pay.jp (test) or https://p01.mul-pay.jp (production)
@@ -201,6 +297,102 @@ GMO_SHOP_ID = config('GMO_SHOP_ID', default='')
 GMO_SHOP_PASS = config('GMO_SHOP_PASS', default='')
 GMO_API_ENDPOINT = config('GMO_API_ENDPOINT', default='https://pt01.mul-pay.jp')
 
+# GMO PG HTTP connection pool (shared keep-alive session, see payments/transport.py)
+# GMO_HTTP_POOL_CONNECTIONS: number of per-host pools kept alive
+# GMO_HTTP_POOL_MAXSIZE: max connections kept per host (size to worker threads)
+# GMO_HTTP_POOL_BLOCK: wait for a free connection instead of opening extra ones
+GMO_HTTP_POOL_CONNECTIONS = config('GMO_HTTP_POOL_CONNECTIONS', default=4, cast=int)
+GMO_HTTP_POOL_MAXSIZE = config('GMO_HTTP_POOL_MAXSIZE', default=20, cast=int)
+GMO_HTTP_POOL_BLOCK = config('GMO_HTTP_POOL_BLOCK', default=False, cast=bool)
+
+# Async GMO PG client pool (AsyncGMOClient under ASGI)
+# GMO_ASYNC_POOL_MAXSIZE: max concurrent connections per event loop
+# GMO_ASYNC_POOL_KEEPALIVE: idle connections kept alive per event loop
+GMO_ASYNC_POOL_MAXSIZE = config('GMO_ASYNC_POOL_MAXSIZE', default=200, cast=int)
+GMO_ASYNC_POOL_KEEPALIVE = config('GMO_ASYNC_POOL_KEEPALIVE', default=50, cast=int)
+
+# Idempotency-Key handling for payment endpoints (see payments/idempotency.py)
+# IDEMPOTENCY_STORE: 'memory' (per-process LRU), 'cache' (Django cache alias,
+#   shared between workers with a shared cache) or 'tiered' (memory in front of cache)
+IDEMPOTENCY_STORE = config('IDEMPOTENCY_STORE', default='memory')
+IDEMPOTENCY_TTL_SECONDS = config('IDEMPOTENCY_TTL_SECONDS', default=86400, cast=int)
+IDEMPOTENCY_MAX_ENTRIES = config('IDEMPOTENCY_MAX_ENTRIES', default=10000, cast=int)
+IDEMPOTENCY_CACHE_ALIAS = config('IDEMPOTENCY_CACHE_ALIAS', default='default')
+# How long a duplicate waits for the in-flight request holding the same key
+IDEMPOTENCY_LOCK_SECONDS = config('IDEMPOTENCY_LOCK_SECONDS', default=60, cast=int)
+
+# Gateway timeouts and circuit breakers (see payments/circuit_breaker.py)
+# Connect timeouts are fixed. Read timeouts adapt to recent latency:
+# ADAPTIVE_TIMEOUT_MULTIPLIER x the ADAPTIVE_TIMEOUT_PERCENTILE of the last 200 calls
+# per endpoint, kept between *_READ_TIMEOUT_MIN and *_READ_TIMEOUT (used until
+# ADAPTIVE_TIMEOUT_MIN_SAMPLES calls have been seen)
+GMO_CONNECT_TIMEOUT = config('GMO_CONNECT_TIMEOUT', default=3.0, cast=float)
+GMO_READ_TIMEOUT = config('GMO_READ_TIMEOUT', default=30.0, cast=float)
+GMO_READ_TIMEOUT_MIN = config('GMO_READ_TIMEOUT_MIN', default=5.0, cast=float)
+APPLE_CONNECT_TIMEOUT = config('APPLE_CONNECT_TIMEOUT', default=3.0, cast=float)
+APPLE_READ_TIMEOUT = config('APPLE_READ_TIMEOUT', default=15.0, cast=float)
+APPLE_READ_TIMEOUT_MIN = config('APPLE_READ_TIMEOUT_MIN', default=3.0, cast=float)
+ADAPTIVE_TIMEOUT_PERCENTILE = config('ADAPTIVE_TIMEOUT_PERCENTILE', default=99.0, cast=float)
+ADAPTIVE_TIMEOUT_MULTIPLIER = config('ADAPTIVE_TIMEOUT_MULTIPLIER', default=3.0, cast=float)
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = config('ADAPTIVE_TIMEOUT_MIN_SAMPLES', default=20, cast=int)
+# After this many consecutive timeouts / connection errors / 5xx an endpoint's
+# circuit opens: calls fail fast (error_code CIRCUIT_OPEN, HTTP 503) for
+# CIRCUIT_BREAKER_RESET_SECONDS, then a single probe call decides whether it closes
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = config('CIRCUIT_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+CIRCUIT_BREAKER_RESET_SECONDS = config('CIRCUIT_BREAKER_RESET_SECONDS', default=30.0, cast=float)
+
+# GMO PG retries (see payments/retry.py): only calls that cannot be applied twice
+# are retried; order operations are reconciled with SearchTrade first.
+# Backoff is full jitter, doubling from GMO_RETRY_BASE_DELAY up to GMO_RETRY_MAX_DELAY;
+# GMO_RETRY_DEADLINE bounds a call's attempts and backoff together (seconds)
+GMO_RETRY_MAX_ATTEMPTS = config('GMO_RETRY_MAX_ATTEMPTS', default=3, cast=int)
+GMO_RETRY_BASE_DELAY = config('GMO_RETRY_BASE_DELAY', default=0.05, cast=float)
+GMO_RETRY_MAX_DELAY = config('GMO_RETRY_MAX_DELAY', default=1.0, cast=float)
+GMO_RETRY_DEADLINE = config('GMO_RETRY_DEADLINE', default=30.0, cast=float)
+
+# Compensation queue (see payments/compensation.py): voids of failed checkouts are
+# retried by `manage.py process_compensations` with backoff doubling from
+# COMPENSATION_RETRY_BASE_SECONDS up to COMPENSATION_RETRY_MAX_SECONDS.
+# A claimed task is retried by another worker after COMPENSATION_LEASE_SECONDS
+COMPENSATION_RETRY_BASE_SECONDS = config('COMPENSATION_RETRY_BASE_SECONDS', default=5.0, cast=float)
+COMPENSATION_RETRY_MAX_SECONDS = config('COMPENSATION_RETRY_MAX_SECONDS', default=600.0, cast=float)
+COMPENSATION_LEASE_SECONDS = config('COMPENSATION_LEASE_SECONDS', default=120.0, cast=float)
+
+# Reconciliation (see payments/reconciliation.py): `manage.py reconcile_transactions`
+# settles one-time payments left in 'processing' (e.g. the worker died mid-checkout)
+# once they are RECONCILE_STALE_MINUTES old, using the order state at GMO PG
+RECONCILE_STALE_MINUTES = config('RECONCILE_STALE_MINUTES', default=15.0, cast=float)
+
+# Request pipeline (see payments/pipeline.py): threads shared by all requests for
+# gateway calls that overlap database work (e.g. SaveMember during recurring setup).
+# Per-stage durations are reported in a Server-Timing response header
+PIPELINE_WORKERS = config('PIPELINE_WORKERS', default=32, cast=int)
+SERVER_TIMING_ENABLED = config('SERVER_TIMING_ENABLED', default=True, cast=bool)
+
+# Metrics (see payments/metrics.py), scraped from /api/payments/metrics/
+# METRICS_DIR: directory shared by all worker processes; each writes its totals
+#   there every METRICS_FLUSH_SECONDS and a scrape merges them ('' = this process only)
+# METRICS_TOKEN: if set, scrapes must send 'Authorization: Bearer <token>'
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5.0, cast=float)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Streaming CSV/NDJSON exports (see payments/exports.py) at /api/payments/exports/
+# are open to staff users; EXPORT_TOKEN also lets scripts in with
+# 'Authorization: Bearer <token>' ('' = staff only)
+EXPORT_TOKEN = config('EXPORT_TOKEN', default='')
+
+# Tracing (see payments/tracing.py): spans of each payments request (view, DB
+# writes, GMO PG and Apple calls). Every request is recorded; a trace is exported
+# when sampled (TRACE_SAMPLE_RATE, or a sampled W3C traceparent header) or when the
+# request took TRACE_SLOW_MS or longer.
+# TRACE_EXPORTER: '' (off), 'file' (JSON lines appended to TRACE_FILE by a background
+#   thread), 'memory' (tests) or the dotted path of an exporter class
+TRACE_EXPORTER = config('TRACE_EXPORTER', default='')
+TRACE_FILE = config('TRACE_FILE', default='logs/traces.jsonl')
+TRACE_SAMPLE_RATE = config('TRACE_SAMPLE_RATE', default=0.01, cast=float)
+TRACE_SLOW_MS = config('TRACE_SLOW_MS', default=2000.0, cast=float)
+
 # Apple Pay configuration
 APPLE_MERCHANT_ID = config('APPLE_MERCHANT_ID', default='')
 
@@ -215,6 +407,15 @@ APPLE_MERCHANT_IDENTITY_KEY_PATH = config(
     default=str(BASE_DIR.parent / 'certs' / 'merchant-identity-key.pem')
 )
 
+# Apple merchant validation connection pool (mTLS session, see payments/transport.py)
+# The SSL context is built once and reloaded when the certificate files change
+APPLE_HTTP_POOL_CONNECTIONS = config('APPLE_HTTP_POOL_CONNECTIONS', default=4, cast=int)
+APPLE_HTTP_POOL_MAXSIZE = config('APPLE_HTTP_POOL_MAXSIZE', default=10, cast=int)
+
+# Apple Pay config validation is memoized per process; certificate files are
+# re-checked (os.stat only) at most this often
+CONFIG_VALIDATION_RECHECK_SECONDS = config('CONFIG_VALIDATION_RECHECK_SECONDS', default=5, cast=int)
+
 # Validate configuration on startup (import config_validator to trigger validation)
 try:
     from payments.config_validator import ConfigValidator
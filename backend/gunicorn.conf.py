@@ -0,0 +1,79 @@
+"""
+Gunicorn production server profile
+
+    gunicorn applepay_poc.wsgi:application -c gunicorn.conf.py
+
+Payment requests spend most of their wall time waiting on GMO PG and Apple,
+so each worker process runs a pool of threads (gthread) and the total
+concurrency is workers x threads. Keep GMO_HTTP_POOL_MAXSIZE >= threads so
+every thread gets a pooled keep-alive connection.
+
+For ASGI (async views with AsyncGMOClient), install uvicorn-worker and set
+GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker with applepay_poc.asgi:application.
+
+All settings can be overridden with GUNICORN_* environment variables (.env).
+"""
+import multiprocessing
+import os
+from decouple import config as _env  # 'config' is itself a gunicorn setting name
+
+bind = _env('GUNICORN_BIND', default='0.0.0.0:8000')
+
+# Workers: 2 x CPU + 1 processes, each with a pool of I/O-bound threads
+workers = _env('GUNICORN_WORKERS', default=multiprocessing.cpu_count() * 2 + 1, cast=int)
+worker_class = _env('GUNICORN_WORKER_CLASS', default='gthread')
+threads = _env('GUNICORN_THREADS', default=8, cast=int)
+backlog = _env('GUNICORN_BACKLOG', default=2048, cast=int)
+
+# Load the app once in the master and fork it (faster start, shared pages).
+# Reload (development) re-imports code per worker, so it replaces preload.
+reload = _env('GUNICORN_RELOAD', default=False, cast=bool)
+preload_app = _env('GUNICORN_PRELOAD', default=not reload, cast=bool)
+
+# Recycle workers after a bounded number of requests; the jitter keeps them
+# from restarting all at once
+max_requests = _env('GUNICORN_MAX_REQUESTS', default=2000, cast=int)
+max_requests_jitter = _env('GUNICORN_MAX_REQUESTS_JITTER', default=200, cast=int)
+
+# A checkout can take up to two 30s GMO PG calls plus a rollback
+timeout = _env('GUNICORN_TIMEOUT', default=90, cast=int)
+graceful_timeout = _env('GUNICORN_GRACEFUL_TIMEOUT', default=30, cast=int)
+
+# Client keep-alive; keep it above the idle timeout of a fronting load balancer
+keepalive = _env('GUNICORN_KEEPALIVE', default=5, cast=int)
+
+# Worker heartbeat files on tmpfs (a blocked disk must not look like a hung worker)
+worker_tmp_dir = _env('GUNICORN_WORKER_TMP_DIR', default='/dev/shm')
+
+# TLS, for serving HTTPS directly in development
+certfile = _env('GUNICORN_CERTFILE', default=None)
+keyfile = _env('GUNICORN_KEYFILE', default=None)
+
+accesslog = _env('GUNICORN_ACCESSLOG', default='-')
+errorlog = '-'
+loglevel = _env('GUNICORN_LOGLEVEL', default='info')
+
+
+def post_fork(server, worker):
+    """Drop connections inherited from the preloaded master"""
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+    from payments.transport import reset_apple_session, reset_gmo_session
+
+    connections.close_all()
+    reset_gmo_session()
+    reset_apple_session()
+
+
+def child_exit(server, worker):
+    """Delete the metrics file of an exited worker so scrapes stop counting it"""
+    directory = _env('METRICS_DIR', default='')
+    if not directory:
+        return
+    try:
+        os.remove(os.path.join(directory, f'metrics-{worker.pid}.json'))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        server.log.warning("Could not remove metrics file of worker %s: %s", worker.pid, e)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Transaction, Subscription
+from .models import Transaction, Subscription, CompensationTask, JobCheckpoint, PaymentRollup
 
 
 @admin.register(Transaction)
@@ -8,6 +8,8 @@ class TransactionAdmin(admin.ModelAdmin):
     list_filter = ['status', 'currency', 'created_at']
     search_fields = ['transaction_id', 'gmo_order_id']
     readonly_fields = ['transaction_id', 'created_at', 'updated_at']
+    # Skip the unfiltered COUNT(*) on large tables; the filtered count is still shown
+    show_full_result_count = False
 
 
 @admin.register(Subscription)
@@ -16,3 +18,28 @@ class SubscriptionAdmin(admin.ModelAdmin):
     list_filter = ['status', 'billing_cycle', 'created_at']
     search_fields = ['subscription_id', 'member_id', 'card_id']
     readonly_fields = ['subscription_id', 'created_at', 'updated_at']
+    show_full_result_count = False
+
+
+@admin.register(CompensationTask)
+class CompensationTaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'action', 'gmo_order_id', 'status', 'attempts', 'next_attempt_at', 'created_at']
+    list_filter = ['status', 'action', 'created_at']
+    search_fields = ['gmo_order_id']
+    readonly_fields = ['created_at', 'updated_at', 'completed_at']
+    raw_id_fields = ['transaction']
+    show_full_result_count = False
+
+
+@admin.register(JobCheckpoint)
+class JobCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['name', 'position', 'updated_at']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(PaymentRollup)
+class PaymentRollupAdmin(admin.ModelAdmin):
+    list_display = ['granularity', 'bucket_start', 'flow', 'currency', 'status', 'error_code', 'count', 'amount']
+    list_filter = ['granularity', 'flow', 'currency', 'status']
+    date_hierarchy = 'bucket_start'
+    show_full_result_count = False
@@ -0,0 +1,93 @@
+"""
+Apple Pay payment tokens
+
+The frontend posts the PKPaymentToken as a JSON string of several KB (mostly
+base64 ciphertext in paymentData). ApplePayToken parses it once, when the
+request is validated, and keeps the original string so the gateway client
+can forward it to GMO PG as-is instead of re-serializing it.
+
+orjson is used for parsing when it is installed; the standard library json
+module is the fallback.
+"""
+from typing import Any, Dict
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+if orjson is not None:
+    _loads = orjson.loads
+
+    def dumps(value: Any) -> str:
+        """Serialize to a compact JSON string"""
+        return orjson.dumps(value).decode()
+else:  # pragma: no cover
+    _loads = json.loads
+
+    def dumps(value: Any) -> str:
+        """Serialize to a compact JSON string"""
+        return json.dumps(value, separators=(',', ':'))
+
+
+class InvalidTokenError(ValueError):
+    """The payment token is not a JSON object"""
+
+
+class ApplePayToken:
+    """
+    Parsed Apple Pay payment token
+
+    Attributes:
+        raw: The token exactly as received (what GMO PG gets in the Token field)
+        data: The decoded token object
+    """
+    __slots__ = ('raw', 'data')
+
+    def __init__(self, raw: str, data: Dict[str, Any]):
+        self.raw = raw
+        self.data = data
+
+    @classmethod
+    def parse(cls, value: str) -> 'ApplePayToken':
+        """
+        Parse a token JSON string
+
+        Raises:
+            InvalidTokenError: value is not a JSON object
+        """
+        try:
+            data = _loads(value)
+        except (ValueError, TypeError) as e:
+            raise InvalidTokenError(str(e)) from None
+        if not isinstance(data, dict):
+            raise InvalidTokenError('Payment token must be a JSON object')
+        return cls(value, data)
+
+    @property
+    def payment_data(self) -> Dict[str, Any]:
+        return self.data.get('paymentData') or {}
+
+    @property
+    def payment_method(self) -> Dict[str, Any]:
+        return self.data.get('paymentMethod') or {}
+
+    @property
+    def transaction_identifier(self) -> str:
+        return self.data.get('transactionIdentifier', '')
+
+    def __str__(self):
+        return self.raw
+
+    def __eq__(self, other):
+        if isinstance(other, ApplePayToken):
+            return self.raw == other.raw
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __repr__(self):
+        # Never log the ciphertext
+        return f"ApplePayToken(network={self.payment_method.get('network')!r}, {len(self.raw)} chars)"
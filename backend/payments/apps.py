@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        from .metrics import install_db_timer
+        from .tracing import install_db_tracer
+        # Time database writes (payments_db_write_duration_seconds) on every connection
+        connection_created.connect(install_db_timer, dispatch_uid='payments.metrics.install_db_timer')
+        # Trace database writes (db.insert / db.update spans) made inside a traced request
+        connection_created.connect(install_db_tracer, dispatch_uid='payments.tracing.install_db_tracer')
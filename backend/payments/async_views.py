@@ -0,0 +1,406 @@
+"""
+Async payment views for ASGI deployments
+
+These mirror OneTimePaymentView and RecurringPaymentSetupView but await the
+gateway through AsyncGMOClient and use Django's async ORM, so a single ASGI
+worker can hold many in-flight GMO calls instead of blocking a thread on each.
+AsyncValidateMerchantView coalesces concurrent merchant validations of the
+same validation URL into one call to Apple.
+"""
+import asyncio
+import json
+import logging
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from .serializers import (
+    OneTimePaymentRequestSerializer,
+    RecurringPaymentSetupSerializer,
+)
+from .services import AsyncGMOClient, avalidate_merchant_with_apple
+from .config_validator import ConfigValidator
+from .persistence import PaymentRecorder, SubscriptionRecorder
+from .pipeline import StageTimer
+from .compensation import afail_with_compensation
+from .idempotency import idempotent, order_id_for, IDEMPOTENCY_HEADER
+from .views import gateway_failure
+
+logger = logging.getLogger(__name__)
+
+
+async def validate_gmo_credentials():
+    """ConfigValidator.validate_gmo_credentials() on a worker thread"""
+    return await sync_to_async(ConfigValidator.validate_gmo_credentials, thread_sensitive=False)()
+
+
+async def validate_apple_pay_config():
+    """ConfigValidator.validate_apple_pay_config() on a worker thread (it stats and may parse the certificate)"""
+    return await sync_to_async(ConfigValidator.validate_apple_pay_config, thread_sensitive=False)()
+
+
+def _parse_json_body(request):
+    """Decode a JSON request body, returning None if it is not a JSON object"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncOneTimePaymentView(View):
+    """
+    Process one-time Apple Pay payment (async, for ASGI)
+    """
+    http_method_names = ['post', 'options']
+
+    @idempotent
+    async def post(self, request):
+        payload = _parse_json_body(request)
+        if payload is None:
+            return JsonResponse(
+                {'error': 'Request body must be a JSON object'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = OneTimePaymentRequestSerializer(data=payload)
+
+        if not serializer.is_valid():
+            return JsonResponse(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        token = serializer.validated_data['token']
+        amount = serializer.validated_data['amount']
+        currency = serializer.validated_data['currency']
+
+        # Convert amount to integer (GMO PG expects integer, e.g., 1000 for 1000 JPY)
+        amount_int = int(float(amount) * 100) if currency in ['USD', 'EUR'] else int(amount)
+
+        # Transaction is held in memory and written only at checkpoints
+        recorder = PaymentRecorder.new(
+            amount=amount,
+            currency=currency,
+            status='processing'
+        )
+        transaction_id = recorder.transaction_id
+
+        # Validate GMO credentials before processing
+        gmo_config = await validate_gmo_credentials()
+        if not gmo_config['valid']:
+            await recorder.afinalize(
+                'failed',
+                error_code='CONFIG_ERROR',
+                error_message='GMO Payment Gateway not configured: ' + ', '.join(gmo_config['errors']),
+            )
+
+            return JsonResponse(
+                {
+                    'transaction_id': str(transaction_id),
+                    'status': 'failed',
+                    'error': 'Payment gateway not configured',
+                    'errors': gmo_config['errors'],
+                    'setup_guide': 'See GMO_PG_APPLEPAY_SETUP.md for setup instructions',
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
+        gmo_client = AsyncGMOClient()
+        order_id = f"ORDER_{transaction_id}"
+
+        # Checkpoint: persist with the order ID before calling the gateway
+        await recorder.set(gmo_order_id=order_id).ainsert()
+
+        # Step 1: Entry transaction
+        success, entry_response = await gmo_client.entry_tran_brandtoken(
+            order_id=order_id,
+            amount=amount_int,
+            currency=currency
+        )
+
+        if not success:
+            await recorder.afinalize(
+                'failed',
+                error_code=entry_response.get('error_code', 'ENTRY_ERROR'),
+                error_message=entry_response.get('error_info', 'Transaction entry failed'),
+            )
+
+            return gateway_failure({
+                'transaction_id': str(transaction_id),
+                'status': 'failed',
+                'error': entry_response.get('error_info', 'Transaction entry failed'),
+            }, entry_response, respond=JsonResponse)
+
+        access_id = entry_response.get('AccessID')
+        access_pass = entry_response.get('AccessPass')
+
+        if not access_id or not access_pass:
+            await recorder.afinalize('failed', error_message='Failed to get AccessID/AccessPass')
+
+            return JsonResponse({
+                'transaction_id': str(transaction_id),
+                'status': 'failed',
+                'error': 'Failed to initialize transaction',
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Keep GMO access data in memory; written with the final state
+        recorder.set(gmo_access_id=access_id, gmo_access_pass=access_pass)
+
+        # Step 2: Execute transaction with Apple Pay token
+        success, exec_response = await gmo_client.exec_tran_brandtoken(
+            access_id=access_id,
+            access_pass=access_pass,
+            order_id=order_id,
+            token=token
+        )
+
+        if success and 'Status' in exec_response:
+            await recorder.afinalize('completed')
+
+            return JsonResponse({
+                'transaction_id': str(transaction_id),
+                'status': 'completed',
+                'amount': str(amount),
+                'currency': currency,
+                'gmo_order_id': order_id,
+            }, status=status.HTTP_200_OK)
+
+        # ExecTran failed - queue the void for the compensation worker
+        await afail_with_compensation(
+            recorder,
+            'void',
+            error_code=exec_response.get('error_code', 'EXEC_ERROR'),
+            error_message=exec_response.get('error_info', 'Transaction execution failed'),
+        )
+
+        return JsonResponse({
+            'transaction_id': str(transaction_id),
+            'status': 'failed',
+            'error': exec_response.get('error_info', 'Transaction execution failed'),
+            'rolled_back': False,
+            'rollback': 'queued',
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncRecurringPaymentSetupView(View):
+    """
+    Setup recurring payment subscription using Apple Pay (async, for ASGI)
+    """
+    http_method_names = ['post', 'options']
+
+    @idempotent
+    async def post(self, request):
+        payload = _parse_json_body(request)
+        if payload is None:
+            return JsonResponse(
+                {'error': 'Request body must be a JSON object'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = RecurringPaymentSetupSerializer(data=payload)
+
+        if not serializer.is_valid():
+            return JsonResponse(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        token = serializer.validated_data['token']
+        amount = serializer.validated_data['amount']
+        currency = serializer.validated_data['currency']
+        billing_cycle = serializer.validated_data['billing_cycle']
+
+        # Convert amount to integer
+        amount_int = int(float(amount) * 100) if currency in ['USD', 'EUR'] else int(amount)
+
+        # Calculate next billing date based on cycle
+        next_billing = timezone.now()
+        if billing_cycle.lower() == 'monthly':
+            next_billing += timedelta(days=30)
+        elif billing_cycle.lower() == 'yearly':
+            next_billing += timedelta(days=365)
+
+        # Subscription is held in memory and written once per state change:
+        # one INSERT (alongside SaveMember) and one UPDATE with the outcome
+        timer = StageTimer()
+        recorder = SubscriptionRecorder.new(
+            amount=amount,
+            currency=currency,
+            billing_cycle=billing_cycle,
+            status='active',
+            next_billing_date=next_billing,
+        )
+        subscription_id = recorder.subscription_id
+
+        # Validate GMO credentials before processing
+        with timer.stage('config'):
+            gmo_config, apple_config = await asyncio.gather(validate_gmo_credentials(), validate_apple_pay_config())
+
+        if not gmo_config['valid']:
+            await recorder.afinalize('cancelled')
+
+            return timer.apply(JsonResponse(
+                {
+                    'error': 'GMO Payment Gateway not configured',
+                    'errors': gmo_config['errors'],
+                    'setup_guide': 'See GMO_PG_APPLEPAY_SETUP.md for setup instructions',
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            ))
+
+        if not apple_config['valid']:
+            await recorder.afinalize('cancelled')
+
+            return timer.apply(JsonResponse(
+                {
+                    'error': 'Apple Pay not configured',
+                    'errors': apple_config['errors'],
+                    'setup_guide': 'See GMO_PG_APPLEPAY_SETUP.md for setup instructions',
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            ))
+
+        gmo_client = AsyncGMOClient()
+        member_id = f"MEMBER_{subscription_id}"
+        order_id = order_id_for(subscription_id.hex, request.headers.get(IDEMPOTENCY_HEADER))
+
+        async def save_member():
+            with timer.stage('member'):
+                return await gmo_client.save_member(
+                    member_id=member_id,
+                    member_name=f"Subscription {subscription_id}"
+                )
+
+        async def insert():
+            with timer.stage('db_insert'):
+                await recorder.set(member_id=member_id).ainsert()
+
+        # Step 1: Save member while the subscription row is inserted
+        (success, member_response), _ = await asyncio.gather(save_member(), insert())
+
+        if not success:
+            with timer.stage('db_final'):
+                await recorder.afinalize('cancelled')
+
+            return timer.apply(gateway_failure({
+                'error': member_response.get('error_info', 'Failed to register member'),
+            }, member_response, respond=JsonResponse))
+
+        # Step 2: Save card (payment method)
+        with timer.stage('card'):
+            success, card_response = await gmo_client.save_card(
+                member_id=member_id,
+                token=token,
+                seq_mode='1'  # 1 for recurring
+            )
+
+        if not success:
+            with timer.stage('db_final'):
+                await recorder.afinalize('cancelled')
+
+            return timer.apply(JsonResponse({
+                'error': card_response.get('error_info', 'Failed to save payment method'),
+            }, status=status.HTTP_400_BAD_REQUEST))
+
+        card_id = card_response.get('CardID')
+        if not card_id:
+            with timer.stage('db_final'):
+                await recorder.afinalize('cancelled')
+
+            return timer.apply(JsonResponse({
+                'error': 'Failed to get Card ID',
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR))
+
+        # Step 3: Process initial charge
+        with timer.stage('charge'):
+            success, charge_response = await gmo_client.exec_tran_recurring(
+                order_id=order_id,
+                member_id=member_id,
+                card_id=card_id,
+                amount=amount_int,
+                currency=currency
+            )
+
+        if success and 'Status' in charge_response:
+            with timer.stage('db_final'):
+                await recorder.afinalize('active', card_id=card_id, last_billing_date=timezone.now())
+
+            return timer.apply(JsonResponse({
+                'subscription_id': str(subscription_id),
+                'status': 'active',
+                'member_id': member_id,
+                'card_id': card_id,
+                'amount': str(amount),
+                'currency': currency,
+                'billing_cycle': billing_cycle,
+                'next_billing_date': next_billing.isoformat(),
+            }, status=status.HTTP_200_OK))
+
+        with timer.stage('db_final'):
+            await recorder.afinalize('cancelled', card_id=card_id)
+
+        return timer.apply(JsonResponse({
+            'error': charge_response.get('error_info', 'Failed to process initial charge'),
+        }, status=status.HTTP_400_BAD_REQUEST))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncValidateMerchantView(View):
+    """
+    Validate merchant session for Apple Pay (async, for ASGI)
+
+    Same request and response as ValidateMerchantView. Under ASGI the sync view
+    runs on Django's single sync thread, so a burst of validations (reloads,
+    several tabs) queues up; here identical validations in flight share one
+    call to Apple instead.
+    """
+    http_method_names = ['post', 'options']
+
+    async def post(self, request):
+        payload = _parse_json_body(request)
+        validation_url = payload.get('validation_url') if payload else None
+        if not validation_url:
+            return JsonResponse(
+                {'error': 'validation_url is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        apple_config = await validate_apple_pay_config()
+        if not apple_config['valid']:
+            return JsonResponse(
+                {
+                    'error': 'Apple Pay not configured',
+                    'errors': apple_config['errors'],
+                    'setup_guide': 'See GMO_PG_APPLEPAY_SETUP.md for setup instructions',
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
+        success, result = await avalidate_merchant_with_apple(validation_url)
+        if success:
+            return JsonResponse({
+                'merchantSession': result,
+                'merchant_id': settings.APPLE_MERCHANT_ID,
+            })
+
+        error_code = result.get('error_code', 'VALIDATION_ERROR')
+        logger.error("Merchant validation failed: %s - %s", error_code, result.get('error', 'Unknown error'))
+        return gateway_failure(
+            {
+                'error': result.get('error', 'Unknown error'),
+                'error_code': error_code,
+                'merchant_id': settings.APPLE_MERCHANT_ID,
+                'details': result.get('response', ''),
+            },
+            result,
+            default_status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            respond=JsonResponse,
+        )
@@ -0,0 +1,245 @@
+"""
+End-to-end load benchmark for the payment endpoints
+
+Drives onetime/process/, recurring/setup/ and recurring/charge/ at a fixed
+concurrency and reports throughput and latency percentiles. Requests go
+either to a running backend over HTTP or, in-process, through Django's
+test client against a throwaway database and a local GMO PG simulator
+(see the `loadtest` management command).
+"""
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+import requests
+from django.conf import settings
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from .config_validator import ConfigValidator
+from .gmo_simulator import GMOSimulator
+
+ONETIME_PATH = '/api/payments/onetime/process/'
+RECURRING_SETUP_PATH = '/api/payments/recurring/setup/'
+RECURRING_CHARGE_PATH = '/api/payments/recurring/charge/'
+
+SCENARIOS = ('onetime', 'recurring-setup', 'recurring-charge')
+
+# Shaped like a real Apple Pay token (several KB of base64 ciphertext)
+SAMPLE_TOKEN = json.dumps({
+    'paymentData': {'data': 'A' * 2048, 'signature': 'B' * 512, 'header': {}, 'version': 'EC_v1'},
+    'paymentMethod': {'displayName': 'Visa 0224', 'network': 'Visa', 'type': 'debit'},
+    'transactionIdentifier': 'C' * 64,
+})
+
+# send(path, payload) -> (status code or exception name, decoded JSON body or None)
+Sender = Callable[[str, dict], Tuple[object, Optional[dict]]]
+
+
+def http_sender(base_url: str, verify: bool = True) -> Callable[[], Sender]:
+    """Sender factory for a running backend; one keep-alive session per client thread"""
+    base_url = base_url.rstrip('/')
+
+    def make() -> Sender:
+        session = requests.Session()
+
+        def send(path, payload):
+            response = session.post(base_url + path, json=payload, verify=verify, timeout=60)
+            try:
+                return response.status_code, response.json()
+            except ValueError:
+                return response.status_code, None
+        return send
+    return make
+
+
+def client_sender() -> Callable[[], Sender]:
+    """Sender factory for in-process requests through Django's test client"""
+    def make() -> Sender:
+        client = Client()
+
+        def send(path, payload):
+            response = client.post(path, payload, content_type='application/json')
+            if response.get('Content-Type', '').startswith('application/json'):
+                return response.status_code, response.json()
+            return response.status_code, None
+        return send
+    return make
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_load(
+    make_sender: Callable[[], Sender],
+    build_request: Callable[[int], Tuple[str, dict]],
+    total: int,
+    concurrency: int,
+    collect: bool = False,
+) -> Dict:
+    """
+    Send `total` requests from `concurrency` client threads
+
+    Args:
+        make_sender: Called once per client thread to build its sender
+        build_request: Maps the request number to (path, JSON payload)
+        total: Number of requests
+        concurrency: Number of client threads
+        collect: Keep the JSON bodies of 2xx responses in the result
+
+    Returns:
+        dict with requests, elapsed, throughput, p50/p95/p99/max latency (ms),
+        status counts and (with collect) the response bodies
+    """
+    counter = iter(range(total))
+    lock = threading.Lock()
+    latencies: List[float] = []
+    statuses = Counter()
+    bodies: List[dict] = []
+
+    def client():
+        send = make_sender()
+        local_latencies, local_statuses, local_bodies = [], Counter(), []
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                break
+            path, payload = build_request(n)
+            started = time.perf_counter()
+            try:
+                code, body = send(path, payload)
+            except Exception as e:
+                local_statuses[type(e).__name__] += 1
+                continue
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[code] += 1
+            if collect and isinstance(code, int) and code < 300 and body is not None:
+                local_bodies.append(body)
+        connections.close_all()
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+            bodies.extend(local_bodies)
+
+    threads = [threading.Thread(target=client) for _ in range(max(1, concurrency))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'requests': total,
+        'concurrency': concurrency,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else 0.0,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        'statuses': {str(code): count for code, count in sorted(statuses.items(), key=str)},
+    }
+    if collect:
+        result['bodies'] = bodies
+    return result
+
+
+def onetime_request(n: int) -> Tuple[str, dict]:
+    return ONETIME_PATH, {'token': SAMPLE_TOKEN, 'amount': '1000', 'currency': 'JPY'}
+
+
+def recurring_setup_request(n: int) -> Tuple[str, dict]:
+    return RECURRING_SETUP_PATH, {
+        'token': SAMPLE_TOKEN, 'amount': '1000', 'currency': 'JPY', 'billing_cycle': 'monthly',
+    }
+
+
+def recurring_charge_builder(subscription_ids: List[str]) -> Callable[[int], Tuple[str, dict]]:
+    """Charge the given subscriptions round-robin"""
+    def build(n):
+        return RECURRING_CHARGE_PATH, {'subscription_id': subscription_ids[n % len(subscription_ids)], 'amount': '1000'}
+    return build
+
+
+def _write_self_signed_cert(directory: str) -> Tuple[str, str]:
+    """Write a throwaway merchant identity certificate and key (passes config validation)"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'merchant.com.loadtest')])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1)).not_valid_after(now + timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, 'merchant-identity-cert.pem')
+    key_path = os.path.join(directory, 'merchant-identity-key.pem')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+@contextmanager
+def in_process_backend(simulator: GMOSimulator) -> Iterator[Callable[[], Sender]]:
+    """
+    Run the backend in this process against the simulator
+
+    Creates a throwaway database (a temporary file for SQLite, so concurrent
+    connections lock like production), a throwaway Apple merchant certificate,
+    and points the GMO settings at the simulator. Gateway logs (including injected
+    errors) are suppressed so the report stays readable.
+    """
+    db_settings = settings.DATABASES['default']
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if connection.vendor == 'sqlite':
+            db_settings.setdefault('TEST', {})['NAME'] = os.path.join(temp_dir, 'loadtest.sqlite3')
+        cert_path, key_path = _write_self_signed_cert(temp_dir)
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        setup_test_environment()
+        logging.disable(logging.ERROR)
+        simulator.start()
+        try:
+            with override_settings(
+                GMO_SHOP_ID='tshop00000001',
+                GMO_SHOP_PASS='loadtest',
+                GMO_API_ENDPOINT=simulator.url,
+                APPLE_MERCHANT_ID='merchant.com.loadtest',
+                APPLE_MERCHANT_IDENTITY_CERT_PATH=cert_path,
+                APPLE_MERCHANT_IDENTITY_KEY_PATH=key_path,
+            ):
+                ConfigValidator.clear_cache()
+                yield client_sender()
+        finally:
+            simulator.stop()
+            logging.disable(logging.NOTSET)
+            teardown_test_environment()
+            ConfigValidator.clear_cache()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,156 @@
+"""
+Two-tier cache for results every worker computes the same way
+
+TieredCache keeps values in a per-process dict (the local tier) in front of
+an optional Django cache alias shared by all workers (SHARED_CACHE_ALIAS,
+e.g. a file-based or Redis cache). A lookup tries the local tier, then the
+shared tier, and only then recomputes. Recomputation is single-flight:
+    - within one process, concurrent callers of a key share one computation
+      (SingleFlight)
+    - across processes, the worker that wins a short lock in the shared cache
+      computes; the others wait up to CACHE_LOCK_SECONDS for its result
+      before computing themselves
+
+Every lookup is counted in payments_cache_requests_total{cache, result} with
+result local_hit, shared_hit, coalesced (waited on another caller in this
+process) or miss (computed).
+
+Cached values are shared between callers and must not be mutated.
+"""
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import hashlib
+import threading
+import time
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import Counter
+from .singleflight import SingleFlight
+
+cache_requests = Counter(
+    'payments_cache_requests_total',
+    'TieredCache lookups, by cache and result (local_hit, shared_hit, coalesced, miss)',
+    ('cache', 'result'),
+)
+
+_MISSING = object()
+
+# Polling interval while another worker holds the recomputation lock
+_LOCK_POLL_SECONDS = 0.05
+
+
+class TieredCache:
+    """
+    Local dict in front of the shared cache, with single-flight recomputation
+
+    Args:
+        name: Cache name (metrics label and shared key prefix)
+        ttl: Seconds a computed value is kept in both tiers
+        local_ttl: Cap on the seconds a value is kept in the local tier (default:
+            the value's TTL); shorter values make invalidate() reach other
+            workers sooner
+    """
+
+    def __init__(self, name: str, ttl: float, local_ttl: Optional[float] = None):
+        self.name = name
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self._local: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    @property
+    def shared(self):
+        """The shared tier (None when SHARED_CACHE_ALIAS is unset)"""
+        alias = getattr(settings, 'SHARED_CACHE_ALIAS', '')
+        # Not before the app registry is ready (the startup check run from settings.py)
+        return caches[alias] if alias and apps.ready else None
+
+    def _shared_key(self, key: Hashable) -> str:
+        # Any hashable key; hashed so it is valid for every cache backend
+        return f'tiered:{self.name}:{hashlib.sha1(repr(key).encode()).hexdigest()}'
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """
+        Cached value for key, calling compute() once on a miss
+
+        Args:
+            key: Hashable key; include everything the value depends on
+            compute: Builds the value (must be picklable for the shared tier)
+            ttl: Override the cache's TTL for this value
+        """
+        value = self._get_local(key)
+        if value is not _MISSING:
+            cache_requests.inc(self.name, 'local_hit')
+            return value
+        value, coalesced = self._flight.do(key, lambda: self._load(key, compute, ttl or self.ttl))
+        if coalesced:
+            cache_requests.inc(self.name, 'coalesced')
+        return value
+
+    def _get_local(self, key: Hashable) -> Any:
+        entry = self._local.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            with self._lock:
+                if self._local.get(key) is entry:
+                    del self._local[key]
+            return _MISSING
+        return value
+
+    def _set_local(self, key: Hashable, value: Any, ttl: float):
+        with self._lock:
+            self._local[key] = (time.monotonic() + (ttl if self.local_ttl is None else min(ttl, self.local_ttl)), value)
+
+    def _load(self, key: Hashable, compute: Callable[[], Any], ttl: float) -> Any:
+        shared = self.shared
+        if shared is None:
+            return self._compute(key, compute, ttl)
+
+        shared_key = self._shared_key(key)
+        value = shared.get(shared_key, _MISSING)
+        if value is not _MISSING:
+            cache_requests.inc(self.name, 'shared_hit')
+            self._set_local(key, value, ttl)
+            return value
+
+        lock_seconds = getattr(settings, 'CACHE_LOCK_SECONDS', 5)
+        lock_key = f'{shared_key}:lock'
+        if not shared.add(lock_key, 1, lock_seconds):
+            # Another worker is computing it: wait for its result
+            deadline = time.monotonic() + lock_seconds
+            while time.monotonic() < deadline:
+                time.sleep(_LOCK_POLL_SECONDS)
+                value = shared.get(shared_key, _MISSING)
+                if value is not _MISSING:
+                    cache_requests.inc(self.name, 'shared_hit')
+                    self._set_local(key, value, ttl)
+                    return value
+            return self._compute(key, compute, ttl)
+        try:
+            value = self._compute(key, compute, ttl)
+            shared.set(shared_key, value, ttl)
+            return value
+        finally:
+            shared.delete(lock_key)
+
+    def _compute(self, key: Hashable, compute: Callable[[], Any], ttl: float) -> Any:
+        cache_requests.inc(self.name, 'miss')
+        value = compute()
+        self._set_local(key, value, ttl)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop key from this process and the shared tier (other workers keep theirs up to local_ttl)"""
+        with self._lock:
+            self._local.pop(key, None)
+        shared = self.shared
+        if shared is not None:
+            shared.delete(self._shared_key(key))
+
+    def clear_local(self) -> None:
+        """Drop every value from this process's tier"""
+        with self._lock:
+            self._local.clear()
@@ -0,0 +1,249 @@
+"""
+Circuit breakers and adaptive timeouts for outbound gateway calls
+
+Every GMO PG endpoint (and Apple merchant validation) gets a Circuit holding:
+
+- a CircuitBreaker: after CIRCUIT_BREAKER_FAILURE_THRESHOLD consecutive
+  transport failures (timeouts, connection errors, HTTP 5xx) the circuit
+  opens and calls fail immediately with error_code CIRCUIT_OPEN for
+  CIRCUIT_BREAKER_RESET_SECONDS. Then one probe call is let through
+  (half-open); its outcome closes or re-opens the circuit.
+- an AdaptiveTimeout: a fixed connect timeout plus a read timeout of
+  ADAPTIVE_TIMEOUT_MULTIPLIER x the ADAPTIVE_TIMEOUT_PERCENTILE of recent
+  latencies, clamped to [<SERVICE>_READ_TIMEOUT_MIN, <SERVICE>_READ_TIMEOUT].
+
+Gateway business errors (ErrCode/ErrInfo, HTTP 4xx) mean the gateway is up
+and count as successes. State is per process.
+"""
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_OPEN = 'CIRCUIT_OPEN'
+
+# error_code values (without a service prefix such as VALIDATION_) that mean
+# the gateway could not be reached or failed server-side
+_TRANSPORT_ERROR_CODES = frozenset({
+    'TIMEOUT', 'CONNECT_TIMEOUT', 'CONNECTION_ERROR', 'CONNECT_ERROR', 'REQUEST_ERROR', 'HTTP_429',
+})
+
+# Default timeouts (seconds) per service: (connect, read min, read max)
+_DEFAULT_TIMEOUTS = {
+    'GMO': (3.0, 5.0, 30.0),
+    'APPLE': (3.0, 3.0, 15.0),
+}
+
+
+def is_transport_failure(error: Dict, prefix: str = '') -> bool:
+    """True if an error dict returned by a gateway client should trip the breaker"""
+    code = error.get('error_code') or ''
+    if prefix and code.startswith(prefix):
+        code = code[len(prefix):]
+    return code in _TRANSPORT_ERROR_CODES or code.startswith('HTTP_5')
+
+
+def is_circuit_open(error: Dict) -> bool:
+    """True if a gateway call was refused because its circuit is open"""
+    return (error.get('error_code') or '').endswith(CIRCUIT_OPEN)
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker counting consecutive failures"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        Ask to make a call
+
+        Returns:
+            True if the call may go ahead; it must then be reported with
+            record_success() or record_failure()
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_seconds:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+            # Half-open: a single probe at a time
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit %s closed", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.error("Circuit %s opened after %s consecutive failures", self.name, self._failures)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+    def retry_after(self) -> int:
+        """Seconds until the next probe is allowed (at least 1)"""
+        with self._lock:
+            remaining = self.reset_seconds - (self._clock() - self._opened_at)
+        return max(1, math.ceil(remaining))
+
+
+class AdaptiveTimeout:
+    """Connect/read timeouts derived from a sliding window of observed latencies"""
+
+    def __init__(
+        self,
+        connect: float,
+        read_min: float,
+        read_max: float,
+        percentile: float = 99.0,
+        multiplier: float = 3.0,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        self.connect = connect
+        self.read_min = read_min
+        self.read_max = max(read_min, read_max)
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self._read: Optional[float] = None
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self._read = None
+
+    @property
+    def read(self) -> float:
+        with self._lock:
+            if self._read is None:
+                if len(self._samples) < self.min_samples:
+                    # Not enough data yet: allow the full budget
+                    self._read = self.read_max
+                else:
+                    ordered = sorted(self._samples)
+                    index = min(len(ordered) - 1, math.ceil(self.percentile / 100 * len(ordered)) - 1)
+                    self._read = min(self.read_max, max(self.read_min, ordered[index] * self.multiplier))
+            return self._read
+
+    def timeout(self) -> Tuple[float, float]:
+        """(connect, read) timeout pair, as accepted by requests"""
+        return self.connect, self.read
+
+
+class Circuit:
+    """Breaker and timeouts of one gateway endpoint"""
+
+    def __init__(self, breaker: CircuitBreaker, timeouts: AdaptiveTimeout):
+        self.breaker = breaker
+        self.timeouts = timeouts
+
+    def allow(self) -> bool:
+        """Ask to make a call (see CircuitBreaker.allow)"""
+        return self.breaker.allow()
+
+    def record(self, elapsed: float, failed: bool):
+        """Report the outcome of an allowed call"""
+        self.timeouts.observe(elapsed)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def open_error(self, error: str, prefix: str = '') -> Dict:
+        """Error dict returned instead of calling an endpoint whose circuit is open"""
+        return {
+            'error': error,
+            'error_code': f'{prefix}{CIRCUIT_OPEN}',
+            'retry_after': self.breaker.retry_after(),
+        }
+
+
+_circuits: Dict[str, Circuit] = {}
+_circuits_lock = threading.Lock()
+
+
+def get_circuit(name: str, service: str = 'GMO') -> Circuit:
+    """
+    Get (or create from settings) the circuit for an endpoint
+
+    Args:
+        name: Endpoint name, e.g. 'ExecTranBrandtoken.idPass'
+        service: Settings prefix for the timeouts ('GMO' or 'APPLE')
+    """
+    circuit = _circuits.get(name)
+    if circuit is not None:
+        return circuit
+    with _circuits_lock:
+        circuit = _circuits.get(name)
+        if circuit is None:
+            connect, read_min, read_max = _DEFAULT_TIMEOUTS[service]
+            circuit = Circuit(
+                CircuitBreaker(
+                    name,
+                    failure_threshold=getattr(settings, 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5),
+                    reset_seconds=getattr(settings, 'CIRCUIT_BREAKER_RESET_SECONDS', 30.0),
+                ),
+                AdaptiveTimeout(
+                    connect=getattr(settings, f'{service}_CONNECT_TIMEOUT', connect),
+                    read_min=getattr(settings, f'{service}_READ_TIMEOUT_MIN', read_min),
+                    read_max=getattr(settings, f'{service}_READ_TIMEOUT', read_max),
+                    percentile=getattr(settings, 'ADAPTIVE_TIMEOUT_PERCENTILE', 99.0),
+                    multiplier=getattr(settings, 'ADAPTIVE_TIMEOUT_MULTIPLIER', 3.0),
+                    min_samples=getattr(settings, 'ADAPTIVE_TIMEOUT_MIN_SAMPLES', 20),
+                ),
+            )
+            _circuits[name] = circuit
+    return circuit
+
+
+def reset_circuits():
+    """Forget all breaker state and latency samples (tests, settings changes)"""
+    with _circuits_lock:
+        _circuits.clear()
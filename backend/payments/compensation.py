@@ -0,0 +1,255 @@
+"""
+Compensation queue for payments that failed after GMO PG accepted part of them
+
+When ExecTran fails after EntryTran succeeded, the order has to be voided at
+GMO PG. Instead of calling AlterTran in the request (and giving up if that
+fails too), the view records a CompensationTask in the same request and
+answers immediately. The process_compensations worker then:
+
+    1. claims due tasks (a lease moves next_attempt_at forward, so a crashed
+       worker's tasks are picked up again after COMPENSATION_LEASE_SECONDS)
+    2. calls AlterTran with the task's JobCd (VOID / RETURN)
+    3. if that fails, looks the order up with SearchTrade: an order already
+       voided/returned, or never charged, needs nothing more
+    4. otherwise retries later with capped exponential backoff and jitter,
+       until GMO PG confirms
+
+A confirmed void marks the transaction 'cancelled'.
+"""
+from datetime import timedelta
+from typing import Dict, List, Optional
+import logging
+import random
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction as db_transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from .metrics import GaugeCallback, payment_outcomes
+from .models import CompensationTask, Transaction
+from .rollups import RollupDelta
+from .services import GMOClient
+
+logger = logging.getLogger(__name__)
+
+# GMO PG JobCd per compensation action
+JOB_CODES = {
+    'void': 'VOID',
+    'refund': 'RETURN',
+}
+
+# Trade statuses (SearchTrade) meaning the compensation already happened
+COMPENSATED_STATUSES = {
+    'void': frozenset({'VOID', 'CANCEL'}),
+    'refund': frozenset({'RETURN', 'RETURNX', 'CANCEL'}),
+}
+
+# Trade statuses meaning nothing was charged, so there is nothing to undo
+UNCHARGED_STATUSES = frozenset({'UNPROCESSED', 'AUTHENTICATED'})
+
+
+def _void_fields(transaction: Transaction, action: str) -> Dict:
+    return {
+        'transaction': transaction,
+        'action': action,
+        'gmo_order_id': transaction.gmo_order_id or '',
+        'gmo_access_id': transaction.gmo_access_id or '',
+        'gmo_access_pass': transaction.gmo_access_pass or '',
+    }
+
+
+def enqueue_compensation(transaction: Transaction, action: str = 'void') -> CompensationTask:
+    """
+    Record a void/refund for the worker (one INSERT)
+
+    Args:
+        transaction: Saved transaction with its GMO order ID and access credentials set
+        action: 'void' or 'refund'
+    """
+    task = CompensationTask.objects.create(**_void_fields(transaction, action))
+    logger.info("Queued %s of %s (compensation task %s)", action, transaction.gmo_order_id, task.pk)
+    return task
+
+
+def fail_with_compensation(recorder, action: str = 'void', **fields) -> CompensationTask:
+    """
+    Finalize a payment as failed and queue its compensation atomically
+
+    The failed status and the task are committed together, so a crash can
+    never leave a failed payment without its pending void.
+
+    Args:
+        recorder: PaymentRecorder of the payment (already inserted)
+        action: 'void' or 'refund'
+        **fields: Extra fields for the final write (error_code, error_message)
+    """
+    with db_transaction.atomic():
+        recorder.finalize('failed', **fields)
+        return enqueue_compensation(recorder.transaction, action)
+
+
+# Async version of fail_with_compensation(); the ORM transaction runs on the
+# thread Django uses for sync code
+afail_with_compensation = sync_to_async(fail_with_compensation)
+
+
+def queue_stats(now=None) -> Dict:
+    """
+    Depth and age of the pending compensation queue
+
+    Returns:
+        dict with depth (pending tasks), oldest_age_seconds (age of the oldest
+        pending task, 0 if none) and max_attempts (most attempts of a pending task)
+    """
+    now = now or timezone.now()
+    stats = CompensationTask.objects.filter(status='pending').aggregate(
+        depth=Count('id'), oldest=Min('created_at'), max_attempts=Max('attempts'),
+    )
+    return {
+        'depth': stats['depth'],
+        'oldest_age_seconds': round((now - stats['oldest']).total_seconds(), 1) if stats['oldest'] else 0.0,
+        'max_attempts': stats['max_attempts'] or 0,
+    }
+
+
+# Scrape-time gauges (one query each), alongside the JSON status endpoint
+for _stat, _metric, _documentation in (
+    ('depth', 'payments_compensation_queue_depth', 'Pending void/refund tasks'),
+    ('oldest_age_seconds', 'payments_compensation_oldest_age_seconds', 'Age of the oldest pending compensation task'),
+    ('max_attempts', 'payments_compensation_max_attempts', 'Most attempts made on a pending compensation task'),
+):
+    GaugeCallback(_metric, _documentation, lambda stat=_stat: {(): queue_stats()[stat]})
+
+
+class CompensationWorker:
+    """
+    Perform pending voids/refunds until GMO PG confirms them
+
+    Args:
+        client: GMO client (a new GMOClient by default)
+        batch_size: Tasks claimed per run_once()
+        lease_seconds: How long a claimed task is hidden from other workers
+        base_delay: Backoff after the first failed attempt (seconds)
+        max_delay: Cap on the backoff (seconds)
+    """
+
+    def __init__(
+        self,
+        client: Optional[GMOClient] = None,
+        batch_size: int = 50,
+        lease_seconds: Optional[float] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+    ):
+        self.client = client or GMOClient()
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds if lease_seconds is not None else getattr(
+            settings, 'COMPENSATION_LEASE_SECONDS', 120)
+        self.base_delay = base_delay if base_delay is not None else getattr(
+            settings, 'COMPENSATION_RETRY_BASE_SECONDS', 5)
+        self.max_delay = max_delay if max_delay is not None else getattr(
+            settings, 'COMPENSATION_RETRY_MAX_SECONDS', 600)
+
+    def claim(self) -> List[CompensationTask]:
+        """Lease up to batch_size due tasks to this worker"""
+        now = timezone.now()
+        with db_transaction.atomic():
+            due = CompensationTask.objects.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at')
+            if connection.features.has_select_for_update_skip_locked:
+                # PostgreSQL: concurrent workers skip each other's rows; SQLite
+                # serializes claims through the IMMEDIATE write transaction
+                due = due.select_for_update(skip_locked=True)
+            tasks = list(due[:self.batch_size])
+            if tasks:
+                CompensationTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+                    next_attempt_at=now + timedelta(seconds=self.lease_seconds)
+                )
+        return tasks
+
+    def run_once(self) -> Dict[str, int]:
+        """Claim and process one batch; returns counts of claimed/confirmed/retrying tasks"""
+        tasks = self.claim()
+        stats = {'claimed': len(tasks), 'confirmed': 0, 'retrying': 0}
+        for task in tasks:
+            if self.process(task):
+                stats['confirmed'] += 1
+            else:
+                stats['retrying'] += 1
+        return stats
+
+    def process(self, task: CompensationTask) -> bool:
+        """Attempt one task; returns True once GMO PG confirmed it"""
+        job_cd = JOB_CODES[task.action]
+        success, response = self.client.alter_tran(
+            access_id=task.gmo_access_id,
+            access_pass=task.gmo_access_pass,
+            job_cd=job_cd,
+        )
+        if success:
+            self._confirm(task, cancelled=True)
+            return True
+
+        error = f"{response.get('error_code', 'UNKNOWN_ERROR')}: {response.get('error_info') or response.get('error', '')}"
+        if task.gmo_order_id:
+            found, trade = self.client.search_trade(task.gmo_order_id)
+            trade_status = trade.get('Status') if found else None
+            if trade_status in COMPENSATED_STATUSES[task.action]:
+                self._confirm(task, cancelled=True)
+                return True
+            if trade_status in UNCHARGED_STATUSES:
+                logger.info("Order %s was never charged; nothing to %s", task.gmo_order_id, task.action)
+                self._confirm(task, cancelled=False)
+                return True
+
+        self._retry_later(task, error)
+        return False
+
+    def _confirm(self, task: CompensationTask, cancelled: bool):
+        now = timezone.now()
+        with db_transaction.atomic():
+            CompensationTask.objects.filter(pk=task.pk).update(
+                status='done', attempts=task.attempts + 1, last_error='', completed_at=now, updated_at=now,
+            )
+            if cancelled and task.transaction_id:
+                payment = Transaction.objects.filter(pk=task.transaction_id).exclude(status='cancelled').only(
+                    'status', 'currency', 'amount', 'error_code', 'created_at',
+                ).first()
+                if payment is not None:
+                    Transaction.objects.filter(pk=payment.pk).update(status='cancelled', updated_at=now)
+                    RollupDelta().move_payment(payment, 'cancelled').apply()
+        if cancelled:
+            payment_outcomes.inc('onetime', 'rolled_back')
+        logger.info("Compensation task %s (%s %s) confirmed", task.pk, task.action, task.gmo_order_id)
+
+    def _retry_later(self, task: CompensationTask, error: str):
+        attempts = task.attempts + 1
+        delay = self.retry_delay(attempts)
+        CompensationTask.objects.filter(pk=task.pk).update(
+            attempts=attempts,
+            last_error=error[:1000],
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+            updated_at=timezone.now(),
+        )
+        logger.warning(
+            "Compensation task %s (%s %s) failed (attempt %s), retrying in %.0fs: %s",
+            task.pk, task.action, task.gmo_order_id, attempts, delay, error,
+        )
+
+    def retry_delay(self, attempts: int) -> float:
+        """Capped exponential backoff with jitter (50-100% of the step)"""
+        step = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return step * random.uniform(0.5, 1.0)
+
+    def run_forever(self, interval: float = 2.0, stop=None):
+        """
+        Poll for due tasks until stop() returns True
+
+        Sleeps `interval` seconds only when a poll found nothing to do.
+        """
+        while not (stop and stop()):
+            stats = self.run_once()
+            if stats['claimed']:
+                logger.info("Compensations: %s | queue %s", stats, queue_stats())
+            else:
+                time.sleep(interval)
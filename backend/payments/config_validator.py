@@ -1,16 +1,104 @@
 """
 Configuration validator for GMO PG and Apple Pay credentials
+
+Parsed certificate metadata and the config status served to the frontend are
+kept in TieredCaches (see payments/cache.py), so with a shared cache the
+workers parse a certificate and build the status once between them.
 """
 from django.conf import settings
+import functools
 import logging
 import os
+import threading
+import time
 from pathlib import Path
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
+from .cache import TieredCache
 
 logger = logging.getLogger(__name__)
 
+# Certificates expiring within this window produce an "expires soon" warning
+CERT_EXPIRY_WARNING_DAYS = 30
+
+# Parsed certificates, keyed by path and file signature (CERTIFICATE_CACHE_SECONDS)
+certificate_cache = TieredCache('certificate', ttl=3600)
+
+# validate_all() results served by ConfigStatusView (CONFIG_STATUS_CACHE_SECONDS)
+config_status_cache = TieredCache('config-status', ttl=30)
+
+# Settings validate_all() depends on (the shop password only by presence)
+_STATUS_SETTINGS = (
+    'GMO_SHOP_ID', 'GMO_API_ENDPOINT', 'APPLE_MERCHANT_ID',
+    'APPLE_MERCHANT_IDENTITY_CERT_PATH', 'APPLE_MERCHANT_IDENTITY_KEY_PATH',
+)
+
+# Memoized validate_apple_pay_config() result, see ConfigValidator.validate_apple_pay_config
+_apple_config_cache: Optional[dict] = None
+_apple_config_cache_lock = threading.Lock()
+
+
+def _file_signature(path: str) -> Optional[Tuple]:
+    """Cheap identity of a file on disk: (inode, mtime, size), or None if missing"""
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _next_expiry_boundary(cert_info: dict) -> float:
+    """
+    Wall-clock timestamp at which a cached certificate result goes stale
+
+    The validation outcome changes when the certificate becomes valid
+    (not_before), enters the expiry warning window and expires (not_after).
+    """
+    from datetime import timezone
+    now = datetime.now(timezone.utc)
+    boundaries = []
+
+    if cert_info.get('not_before'):
+        boundaries.append(datetime.fromisoformat(cert_info['not_before']))
+    if cert_info.get('not_after'):
+        not_after = datetime.fromisoformat(cert_info['not_after'])
+        boundaries.append(not_after - timedelta(days=CERT_EXPIRY_WARNING_DAYS))
+        boundaries.append(not_after)
+
+    upcoming = [b for b in boundaries if b > now]
+    return min(upcoming).timestamp() if upcoming else float('inf')
+
+
+def _parse_certificate(cert_path: str) -> dict:
+    """Validity period, subject and issuer of a PEM certificate, or {'parse_error': message}"""
+    from datetime import timezone
+    try:
+        with open(cert_path, 'rb') as f:
+            cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+
+        # Handle both offset-aware and offset-naive datetime objects
+        not_after = cert.not_valid_after_utc if hasattr(cert, 'not_valid_after_utc') else cert.not_valid_after
+        not_before = cert.not_valid_before_utc if hasattr(cert, 'not_valid_before_utc') else cert.not_valid_before
+
+        # Make offset-naive datetimes timezone-aware for comparison
+        if not_after.tzinfo is None:
+            not_after = not_after.replace(tzinfo=timezone.utc)
+        if not_before.tzinfo is None:
+            not_before = not_before.replace(tzinfo=timezone.utc)
+
+        return {
+            'not_before': not_before.isoformat(),
+            'not_after': not_after.isoformat(),
+            'subject': cert.subject.rfc4514_string(),
+            'issuer': cert.issuer.rfc4514_string(),
+        }
+    except Exception as e:
+        return {'parse_error': str(e)}
+
 
 class ConfigValidator:
     """Validates configuration for GMO PG and Apple Pay"""
@@ -55,13 +143,15 @@ class ConfigValidator:
         }
     
     @staticmethod
-    def validate_certificate(cert_path: str, cert_name: str) -> dict:
+    def validate_certificate(cert_path: str, cert_name: str, parse_certificate: bool = True) -> dict:
         """
         Validate a certificate file exists, is readable, and check expiry
 
         Args:
             cert_path: Path to certificate file
             cert_name: Human-readable name for error messages
+            parse_certificate: Parse the file as an X.509 certificate and check
+                its validity period (disable for private key files)
 
         Returns:
             dict with validation results
@@ -89,43 +179,31 @@ class ConfigValidator:
         info['file_exists'] = True
         info['file_size'] = cert_file.stat().st_size
 
-        # Try to read and parse certificate (only for .pem/.crt files)
-        if cert_path.endswith(('.pem', '.crt', '.cer')):
-            try:
-                with open(cert_path, 'rb') as f:
-                    cert_data = f.read()
-                    cert = x509.load_pem_x509_certificate(cert_data, default_backend())
-
-                    # Check expiry
-                    from datetime import timezone
-                    now = datetime.now(timezone.utc)
-
-                    # Handle both offset-aware and offset-naive datetime objects
-                    not_after = cert.not_valid_after_utc if hasattr(cert, 'not_valid_after_utc') else cert.not_valid_after
-                    not_before = cert.not_valid_before_utc if hasattr(cert, 'not_valid_before_utc') else cert.not_valid_before
-
-                    # Make offset-naive datetimes timezone-aware for comparison
-                    if not_after.tzinfo is None:
-                        not_after = not_after.replace(tzinfo=timezone.utc)
-                    if not_before.tzinfo is None:
-                        not_before = not_before.replace(tzinfo=timezone.utc)
-
-                    info['not_before'] = not_before.isoformat()
-                    info['not_after'] = not_after.isoformat()
-                    info['subject'] = cert.subject.rfc4514_string()
-                    info['issuer'] = cert.issuer.rfc4514_string()
-
-                    if now < not_before:
-                        errors.append(f'{cert_name} is not yet valid (valid from {not_before})')
-                    elif now > not_after:
-                        errors.append(f'{cert_name} has expired (expired on {not_after})')
-                    elif now > not_after - timedelta(days=30):
-                        warnings.append(f'{cert_name} expires soon (on {not_after})')
-
-                    info['valid_certificate'] = True
-            except Exception as e:
-                warnings.append(f'Could not parse {cert_name}: {str(e)}')
+        # Read and parse the certificate (only for .pem/.crt files), once per file version
+        if parse_certificate and cert_path.endswith(('.pem', '.crt', '.cer')):
+            metadata = certificate_cache.get_or_compute(
+                (cert_path, _file_signature(cert_path)),
+                functools.partial(_parse_certificate, cert_path),
+                ttl=getattr(settings, 'CERTIFICATE_CACHE_SECONDS', 3600),
+            )
+            if 'parse_error' in metadata:
+                warnings.append(f'Could not parse {cert_name}: {metadata["parse_error"]}')
                 info['valid_certificate'] = False
+            else:
+                from datetime import timezone
+                now = datetime.now(timezone.utc)
+                not_before = datetime.fromisoformat(metadata['not_before'])
+                not_after = datetime.fromisoformat(metadata['not_after'])
+                info.update(metadata)
+
+                if now < not_before:
+                    errors.append(f'{cert_name} is not yet valid (valid from {not_before})')
+                elif now > not_after:
+                    errors.append(f'{cert_name} has expired (expired on {not_after})')
+                elif now > not_after - timedelta(days=CERT_EXPIRY_WARNING_DAYS):
+                    warnings.append(f'{cert_name} expires soon (on {not_after})')
+
+                info['valid_certificate'] = True
 
         return {
             'valid': len(errors) == 0,
@@ -135,13 +213,67 @@ class ConfigValidator:
         }
 
     @staticmethod
-    def validate_apple_pay_config() -> dict:
+    def validate_apple_pay_config(use_cache: bool = True) -> dict:
         """
         Validate Apple Pay configuration
 
+        The result is memoized per process because it is checked on every
+        checkout request and otherwise reads and parses the certificate each
+        time. The cached result is reused while:
+            - the merchant ID and certificate/key paths in settings are unchanged
+            - the certificate and key files keep the same inode, mtime and size
+              (re-checked with os.stat at most every
+              CONFIG_VALIDATION_RECHECK_SECONDS)
+            - the certificate has not crossed not_before, the expiry warning
+              window or not_after since it was parsed
+
+        Args:
+            use_cache: Set to False to force a full re-validation
+
         Returns:
-            dict with 'valid' (bool) and 'errors' (list) keys
+            dict with 'valid' (bool) and 'errors' (list) keys. The dict may be
+            shared between callers and must not be mutated.
         """
+        global _apple_config_cache
+
+        merchant_id = getattr(settings, 'APPLE_MERCHANT_ID', '')
+        cert_path = getattr(settings, 'APPLE_MERCHANT_IDENTITY_CERT_PATH', '')
+        key_path = getattr(settings, 'APPLE_MERCHANT_IDENTITY_KEY_PATH', '')
+        settings_key = (merchant_id, cert_path, key_path)
+
+        entry = _apple_config_cache
+        if use_cache and entry is not None and entry['settings_key'] == settings_key and time.time() < entry['expires_at']:
+            recheck_seconds = getattr(settings, 'CONFIG_VALIDATION_RECHECK_SECONDS', 5)
+            if time.monotonic() - entry['checked_at'] < recheck_seconds:
+                return entry['result']
+            if (_file_signature(cert_path), _file_signature(key_path)) == entry['file_signatures']:
+                entry['checked_at'] = time.monotonic()
+                return entry['result']
+
+        with _apple_config_cache_lock:
+            file_signatures = (_file_signature(cert_path), _file_signature(key_path))
+            result = ConfigValidator._validate_apple_pay_config_uncached()
+            _apple_config_cache = {
+                'settings_key': settings_key,
+                'file_signatures': file_signatures,
+                'result': result,
+                'checked_at': time.monotonic(),
+                'expires_at': _next_expiry_boundary(result['configured']['cert_info']),
+            }
+        return result
+
+    @staticmethod
+    def clear_cache() -> None:
+        """Drop the memoized Apple Pay validation result and this process's cached status and certificates"""
+        global _apple_config_cache
+        with _apple_config_cache_lock:
+            _apple_config_cache = None
+        certificate_cache.clear_local()
+        config_status_cache.clear_local()
+
+    @staticmethod
+    def _validate_apple_pay_config_uncached() -> dict:
+        """Validate Apple Pay configuration, reading the certificate files from disk"""
         errors = []
         warnings = []
 
@@ -157,7 +289,9 @@ class ConfigValidator:
         key_path = getattr(settings, 'APPLE_MERCHANT_IDENTITY_KEY_PATH', '')
 
         cert_result = ConfigValidator.validate_certificate(cert_path, 'Merchant Identity Certificate')
-        key_result = ConfigValidator.validate_certificate(key_path, 'Merchant Identity Private Key')
+        key_result = ConfigValidator.validate_certificate(
+            key_path, 'Merchant Identity Private Key', parse_certificate=False
+        )
 
         errors.extend(cert_result['errors'])
         errors.extend(key_result['errors'])
@@ -202,14 +336,30 @@ class ConfigValidator:
             }
         }
 
+    @staticmethod
+    def cached_status() -> dict:
+        """
+        validate_all() through the config-status cache
+
+        Shared between workers when SHARED_CACHE_ALIAS is set; a changed
+        setting gives a new key, a changed certificate file shows up within
+        CONFIG_STATUS_CACHE_SECONDS. The dict must not be mutated.
+        """
+        key = tuple(getattr(settings, name, '') for name in _STATUS_SETTINGS) + (
+            bool(getattr(settings, 'GMO_SHOP_PASS', '')),
+        )
+        return config_status_cache.get_or_compute(
+            key, ConfigValidator.validate_all, ttl=getattr(settings, 'CONFIG_STATUS_CACHE_SECONDS', 30),
+        )
+
 
 # Validate on module import (warn only, don't fail)
 validation_result = ConfigValidator.validate_all()
 if not validation_result['all_valid']:
     logger.warning("⚠️  Configuration validation failed:")
     for error in validation_result['gmo_pg']['errors']:
-        logger.warning(f"  GMO PG: {error}")
+        logger.warning("  GMO PG: %s", error)
     for error in validation_result['apple_pay']['errors']:
-        logger.warning(f"  Apple Pay: {error}")
+        logger.warning("  Apple Pay: %s", error)
     logger.warning("  See GMO_PG_APPLEPAY_SETUP.md for setup instructions")
 
@@ -0,0 +1,264 @@
+"""
+Streaming CSV / NDJSON exports of transactions and subscriptions
+
+ExportStream encodes every row matching a set of filters without holding
+more than one fetch in memory, however many rows match:
+
+    - rows are read in keyset-paginated pages ordered by (created_at, primary
+      key): each page is one indexed range query, with no COUNT(*) and no OFFSET
+    - each page is fetched with .values_list().iterator(chunk_size=...), so no
+      model instances are built and the rows come from the database cursor in
+      batches
+    - columns are selected as the database driver returns them and formatted
+      by one function per column (ISO 8601 datetimes, hyphenated UUIDs,
+      amounts with their decimal places). Django's per-value converters
+      (time zone, UUID and Decimal objects) cost more than reading and
+      encoding the row on SQLite
+    - rows are encoded a fetch at a time into one bytes chunk for the response
+      (or file)
+
+Exported columns are those of the API serializers; GMO access credentials and
+card IDs are never exported.
+
+Filters (query parameters of the export endpoints, options of the
+export_payments command):
+
+    status        one or more statuses (comma-separated)
+    currency      one or more currency codes (comma-separated)
+    created_from  ISO 8601 date or datetime, inclusive
+    created_to    ISO 8601 date or datetime, exclusive
+"""
+from datetime import datetime, time as datetime_time, timezone as dt_timezone
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import csv
+import io
+import json
+from django.db import models
+from django.db.models import ExpressionWrapper, F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Subscription, Transaction
+from .serializers import SubscriptionSerializer, TransactionSerializer
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Rows per keyset page (one query each) and per cursor fetch within a page
+PAGE_SIZE = 10000
+CHUNK_SIZE = 2000
+
+
+def _format_datetime(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value.tzinfo is None:
+        # SQLite returns the stored UTC value without its time zone
+        return value.isoformat() + '+00:00'
+    return value.isoformat()
+
+
+def _format_uuid(value) -> Optional[str]:
+    if isinstance(value, str) and len(value) == 32:
+        # SQLite stores UUIDs as 32 hex digits
+        return f'{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}'
+    return None if value is None else str(value)
+
+
+def _decimal_formatter(places: int) -> Callable:
+    def format_decimal(value) -> Optional[str]:
+        return None if value is None else f'{value:.{places}f}'
+    return format_decimal
+
+
+def _formatter(field: models.Field) -> Optional[Callable]:
+    """Format a raw database value of field as exported text (None: export as-is)"""
+    if isinstance(field, models.DateTimeField):
+        return _format_datetime
+    if isinstance(field, models.UUIDField):
+        return _format_uuid
+    if isinstance(field, models.DecimalField):
+        return _decimal_formatter(field.decimal_places)
+    return None
+
+
+class Export:
+    """
+    Exportable model: its columns and keyset order
+
+    Args:
+        model: Model class (must have a created_at field)
+        fields: Exported columns, in order
+    """
+
+    def __init__(self, model, fields: Sequence[str]):
+        self.model = model
+        self.pk = model._meta.pk.name
+        self.fields = list(fields)
+        # The keyset columns are always fetched; they are cut off again if not exported
+        self.columns = self.fields + [name for name in ('created_at', self.pk) if name not in self.fields]
+        self.created_index = self.columns.index('created_at')
+        self.pk_index = self.columns.index(self.pk)
+        # Raw driver values: an output field without database converters
+        self.selects = [ExpressionWrapper(F(name), output_field=models.Field()) for name in self.columns]
+        self.formatters = [
+            (index, formatter) for index, formatter in enumerate(
+                _formatter(model._meta.get_field(name)) for name in self.fields
+            ) if formatter is not None
+        ]
+
+    def cursor_of(self, row: Tuple) -> Tuple:
+        """Keyset position after a raw row"""
+        created_at = row[self.created_index]
+        if isinstance(created_at, str):
+            created_at = parse_datetime(created_at)
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at, dt_timezone.utc)
+        return created_at, row[self.pk_index]
+
+
+EXPORTS = {
+    'transactions': Export(Transaction, TransactionSerializer.Meta.fields),
+    'subscriptions': Export(Subscription, SubscriptionSerializer.Meta.fields),
+}
+
+
+def _values(raw: Optional[str]) -> List[str]:
+    return [value.strip() for value in (raw or '').split(',') if value.strip()]
+
+
+def parse_moment(name: str, raw: str) -> datetime:
+    """ISO 8601 datetime, or a date meaning its midnight (current time zone if naive)"""
+    moment = parse_datetime(raw)
+    if moment is None:
+        day = parse_date(raw)
+        if day is None:
+            raise ValueError(f'{name} must be an ISO 8601 date or datetime')
+        moment = datetime.combine(day, datetime_time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_filters(params) -> Dict:
+    """
+    ORM lookups for the export filters in params (a QueryDict or dict)
+
+    Raises:
+        ValueError: A filter value is invalid
+    """
+    lookups = {}
+    statuses = _values(params.get('status'))
+    if statuses:
+        lookups['status__in'] = statuses
+    currencies = _values(params.get('currency'))
+    if currencies:
+        lookups['currency__in'] = [currency.upper() for currency in currencies]
+    for name, lookup in (('created_from', 'created_at__gte'), ('created_to', 'created_at__lt')):
+        raw = params.get(name)
+        if raw:
+            lookups[lookup] = parse_moment(name, raw)
+    return lookups
+
+
+def export_rows(
+    export: Export,
+    lookups: Dict,
+    page_size: int = PAGE_SIZE,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple]:
+    """Matching rows as tuples of raw export.columns values, in (created_at, pk) order"""
+    queryset = export.model.objects.filter(**lookups).order_by('created_at', export.pk).values_list(*export.selects)
+    cursor = None
+    while True:
+        page = queryset
+        if cursor is not None:
+            page = page.filter(Q(created_at__gt=cursor[0]) | Q(created_at=cursor[0], **{f'{export.pk}__gt': cursor[1]}))
+        count = 0
+        row = None
+        for row in page[:page_size].iterator(chunk_size=chunk_size):
+            count += 1
+            yield row
+        if count < page_size:
+            return
+        cursor = export.cursor_of(row)
+
+
+def _encode_csv(export: Export, records: Iterator[list], batch_size: int) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export.fields)
+    while True:
+        batch = list(islice(records, batch_size))
+        if batch:
+            writer.writerows(batch)
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if len(batch) < batch_size:
+            return
+
+
+def _encode_ndjson(export: Export, records: Iterator[list], batch_size: int) -> Iterator[bytes]:
+    fields = export.fields
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    while True:
+        batch = list(islice(records, batch_size))
+        if batch:
+            yield ''.join([encode(dict(zip(fields, record))) + '\n' for record in batch]).encode()
+        if len(batch) < batch_size:
+            return
+
+
+ENCODERS = {'csv': _encode_csv, 'ndjson': _encode_ndjson}
+
+
+class ExportStream:
+    """
+    Encoded export, one bytes chunk per cursor fetch
+
+    Iterate it once (e.g. as the content of a StreamingHttpResponse); `rows`
+    counts the rows encoded so far.
+
+    Args:
+        name: 'transactions' or 'subscriptions'
+        fmt: 'csv' or 'ndjson'
+        lookups: Filters from export_filters()
+        page_size: Rows per keyset page
+        chunk_size: Rows per cursor fetch and per yielded chunk
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fmt: str,
+        lookups: Dict,
+        page_size: int = PAGE_SIZE,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        self.export = EXPORTS[name]
+        self.encoder = ENCODERS[fmt]
+        self.lookups = lookups
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.rows = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        rows = export_rows(self.export, self.lookups, self.page_size, self.chunk_size)
+        return self.encoder(self.export, self._records(rows), self.chunk_size)
+
+    def _records(self, rows: Iterable[Tuple]) -> Iterator[list]:
+        """Exported values of each row, formatted as text"""
+        width = len(self.export.fields)
+        formatters = self.export.formatters
+        for row in rows:
+            record = list(row[:width])
+            for index, formatter in formatters:
+                record[index] = formatter(record[index])
+            self.rows += 1
+            yield record
@@ -0,0 +1,140 @@
+"""
+Decoding of GMO PG API responses
+
+GMO PG answers with form-encoded key=value pairs, separated by '&' (or one
+pair per line), in Shift_JIS. Several fields can carry multiple values joined
+by '|', most importantly the error fields:
+
+    ErrCode=E01|E01&ErrInfo=E01010001|E01020001
+
+decode_response() parses the raw response bytes in one pass with the charset
+from the Content-Type header (Windows-31J by default), without charset
+detection, and returns a GMOResponse with the error lists already split.
+"""
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+# GMO PG responds in Shift_JIS; Windows-31J (cp932) is the superset it actually uses
+GMO_DEFAULT_CHARSET = 'cp932'
+
+# Charset labels Python's codec registry does not know (or that should map to cp932)
+_CHARSET_ALIASES = {
+    'windows-31j': 'cp932',
+    'shift_jis': 'cp932',
+    'shift-jis': 'cp932',
+    'sjis': 'cp932',
+    'x-sjis': 'cp932',
+}
+
+SUCCESS_STATUSES = frozenset({'CAPTURE', 'AUTH', 'SUCCESS'})
+
+# Field names GMO PG (and our own error dicts) use for error codes / details,
+# in lookup order
+ERROR_CODE_FIELDS = ('ErrCode', 'ErrorCode', 'error_code')
+ERROR_INFO_FIELDS = ('ErrInfo', 'ErrorInfo', 'error_info')
+
+
+class GMOResponse:
+    """
+    Parsed GMO PG response
+
+    Attributes:
+        fields: All key=value pairs of the response
+        error_codes: ErrCode values, split on '|' (empty if none)
+        error_infos: ErrInfo values, split on '|' (empty if none)
+    """
+    __slots__ = ('fields', 'error_codes', 'error_infos')
+
+    def __init__(self, fields: Dict[str, str], error_codes: List[str], error_infos: List[str]):
+        self.fields = fields
+        self.error_codes = error_codes
+        self.error_infos = error_infos
+
+    @property
+    def error_code(self) -> str:
+        """ErrCode as sent by GMO PG ('|'-joined when there are several)"""
+        return '|'.join(self.error_codes)
+
+    @property
+    def error_info(self) -> str:
+        """ErrInfo as sent by GMO PG ('|'-joined when there are several)"""
+        return '|'.join(self.error_infos)
+
+    @property
+    def is_error(self) -> bool:
+        return bool(self.error_codes or self.error_infos) or self.fields.get('Status') == 'FAILURE'
+
+    @property
+    def is_success(self) -> bool:
+        fields = self.fields
+        return 'AccessID' in fields or 'CardID' in fields or fields.get('Status') in SUCCESS_STATUSES
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self.fields.get(key, default)
+
+    def __repr__(self):
+        return f"GMOResponse({self.fields!r})"
+
+
+@lru_cache(maxsize=32)
+def charset_from_content_type(content_type: Optional[str]) -> str:
+    """Return the Python codec for a Content-Type header's charset, or the GMO PG default"""
+    if content_type:
+        for param in content_type.split(';')[1:]:
+            name, _, value = param.partition('=')
+            value = value.strip().strip('"').lower()
+            if name.strip().lower() == 'charset' and value:
+                return _CHARSET_ALIASES.get(value, value)
+    return GMO_DEFAULT_CHARSET
+
+
+def _first(fields: Dict[str, str], names) -> Optional[str]:
+    for name in names:
+        value = fields.get(name)
+        if value:
+            return value
+    return None
+
+
+def decode_response(body: bytes, charset: str = GMO_DEFAULT_CHARSET) -> GMOResponse:
+    """
+    Parse a GMO PG response body
+
+    Args:
+        body: Raw response bytes
+        charset: Response charset (see charset_from_content_type)
+
+    Returns:
+        GMOResponse; pairs without '=' are ignored, later duplicates win
+    """
+    if body.isascii():
+        # Almost every GMO PG response is plain ASCII, which all its charsets share
+        text = body.decode('ascii')
+    else:
+        try:
+            text = body.decode(charset, errors='replace')
+        except LookupError:
+            text = body.decode(GMO_DEFAULT_CHARSET, errors='replace')
+
+    fields = {}
+    if '\n' in text:
+        pairs = [line.strip() for line in text.splitlines()]
+    else:
+        # GMO PG's own format: one line of '&'-separated pairs
+        pairs = text.strip().split('&')
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if sep:
+            fields[key] = value
+
+    error_codes = error_infos = None
+    # Every error field name contains 'rr'; success responses skip the lookups
+    if 'rr' in text:
+        error_codes = _first(fields, ERROR_CODE_FIELDS)
+        error_infos = _first(fields, ERROR_INFO_FIELDS)
+
+    return GMOResponse(
+        fields,
+        error_codes.split('|') if error_codes else [],
+        error_infos.split('|') if error_infos else [],
+    )
@@ -0,0 +1,301 @@
+"""
+Local GMO PG simulator for tests and load benchmarks
+
+Serves the GMO PG `*.idPass` endpoints used by GMOClient over plain HTTP,
+reading form-encoded requests and answering with '&'-separated key=value
+pairs in Shift_JIS like the real gateway. Point GMO_API_ENDPOINT at it (with any non-empty
+GMO_SHOP_ID/GMO_SHOP_PASS):
+
+    python manage.py run_gmo_simulator --port 8900 --latency-ms 50
+    GMO_API_ENDPOINT=http://127.0.0.1:8900 gunicorn applepay_poc.wsgi -c gunicorn.conf.py
+
+Supported operations: EntryTranBrandtoken, ExecTranBrandtoken, SaveMember,
+SaveCard, ExecTran, AlterTran and SearchTrade. Orders, members and cards are
+kept in memory, so duplicate order IDs, unknown members/cards and mismatched
+access credentials fail the way GMO PG does. Failures can also be injected:
+    - error_rate: fraction of calls answered with a random gateway error
+    - drop_rate:  fraction of calls whose connection is closed without an
+                  answer (half before, half after the call is processed)
+    - inject():   queue specific ErrCode/ErrInfo answers for an operation
+    - drop():     queue dropped connections for an operation
+"""
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+import random
+import threading
+import time
+import uuid
+
+# (ErrCode, ErrInfo) pairs returned by the simulator
+SHOP_AUTH_ERROR = ('E01', 'E01010001')
+ORDER_ID_MISSING = ('E01', 'E01040001')
+DUPLICATE_ORDER = ('E01', 'E01040010')
+ACCESS_MISMATCH = ('E01', 'E01110002')
+ORDER_NOT_FOUND = ('E01', 'E01110002')
+MEMBER_NOT_FOUND = ('E01', 'E01390002')
+DUPLICATE_MEMBER = ('E01', 'E01390010')
+CARD_DECLINED = ('G02', '42G020000')
+GATEWAY_BUSY = ('E92', 'E92000001')
+INVALID_STATUS = ('E01', 'E01050004')
+
+# Fault queue marker for a dropped connection
+_DROP = object()
+
+# Error used for each operation when error_rate triggers
+RANDOM_ERRORS = {
+    'ExecTranBrandtoken.idPass': CARD_DECLINED,
+    'ExecTran.idPass': CARD_DECLINED,
+}
+
+
+class GMOSimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits for the client's delayed ACK (~40 ms per call)
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = dict(parse_qsl(self.rfile.read(length).decode('shift_jis', errors='replace')))
+        code, fields = self.server.simulator.handle(self.path.lstrip('/'), params)
+        if code is None:
+            # Dropped: close without answering, like a lost packet or reset connection
+            self.close_connection = True
+            return
+        self._send(code, fields)
+
+    def _send(self, code: int, fields: Dict[str, str]) -> None:
+        body = '&'.join(f"{key}={value}" for key, value in fields.items()).encode('shift_jis')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=Shift_JIS')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GMOSimulator:
+    """
+    Threaded GMO PG simulator server
+
+    Args:
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+        latency: Seconds to wait before answering each call
+        jitter: Extra random delay of up to this many seconds per call
+        error_rate: Fraction (0-1) of calls answered with a gateway error
+        drop_rate: Fraction (0-1) of calls whose connection is dropped
+        seed: Seed for the jitter/error random generator
+    """
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._faults: Dict[str, deque] = defaultdict(deque)
+        self._orders: Dict[str, Dict[str, str]] = {}
+        self._access: Dict[str, Dict[str, str]] = {}
+        self._members: Dict[str, list] = {}
+
+        self.server = ThreadingHTTPServer((host, port), GMOSimulatorHandler)
+        self.server.daemon_threads = True
+        self.server.simulator = self
+        self._thread = None
+
+        self._operations = {
+            'EntryTranBrandtoken.idPass': self._entry_tran_brandtoken,
+            'ExecTranBrandtoken.idPass': self._exec_tran_brandtoken,
+            'SaveMember.idPass': self._save_member,
+            'SaveCard.idPass': self._save_card,
+            'ExecTran.idPass': self._exec_tran,
+            'AlterTran.idPass': self._alter_tran,
+            'SearchTrade.idPass': self._search_trade,
+        }
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.server.server_address[:2]
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'GMOSimulator':
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def inject(self, operation: str, err_code: str, err_info: str, times: int = 1) -> None:
+        """
+        Answer the next `times` calls to an operation with the given error
+
+        Args:
+            operation: Endpoint name, e.g. 'ExecTran.idPass'
+            err_code: ErrCode value (may hold several codes separated by '|')
+            err_info: ErrInfo value (may hold several codes separated by '|')
+            times: Number of calls to fail
+        """
+        with self._lock:
+            self._faults[operation].extend([(err_code, err_info)] * times)
+
+    def drop(self, operation: str, times: int = 1, processed: bool = True) -> None:
+        """
+        Close the connection of the next `times` calls to an operation without answering
+
+        Args:
+            operation: Endpoint name, e.g. 'ExecTran.idPass'
+            times: Number of calls to drop
+            processed: Apply the call before dropping (lost response) instead of
+                discarding it (lost request)
+        """
+        with self._lock:
+            self._faults[operation].extend([(_DROP, processed)] * times)
+
+    def handle(self, operation: str, params: Dict[str, str]) -> Tuple[Optional[int], Dict[str, str]]:
+        """Answer one gateway call; returns (HTTP status, response fields), status None to drop"""
+        handler = self._operations.get(operation)
+        if handler is None:
+            return 404, self._error(('E00', 'E00000000'))
+
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+        with self._lock:
+            self.calls[operation] += 1
+            if not params.get('ShopID') or not params.get('ShopPass'):
+                return 200, self._error(SHOP_AUTH_ERROR)
+            if self._faults[operation]:
+                fault = self._faults[operation].popleft()
+                if fault[0] is _DROP:
+                    return self._dropped(handler, params, processed=fault[1])
+                return 200, self._error(fault)
+            if self.drop_rate and self._rng.random() < self.drop_rate:
+                return self._dropped(handler, params, processed=self._rng.random() < 0.5)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return 200, self._error(RANDOM_ERRORS.get(operation, GATEWAY_BUSY))
+            return 200, handler(params)
+
+    @staticmethod
+    def _dropped(handler, params: Dict[str, str], processed: bool) -> Tuple[None, Dict[str, str]]:
+        if processed:
+            handler(params)
+        return None, {}
+
+    @staticmethod
+    def _error(error: Tuple[str, str]) -> Dict[str, str]:
+        return {'ErrCode': error[0], 'ErrInfo': error[1]}
+
+    @staticmethod
+    def _approval_of(order: Dict[str, str]) -> Dict[str, str]:
+        return {key: order[key] for key in ('Forward', 'Approve', 'TranID', 'TranDate')}
+
+    def _approval(self) -> Dict[str, str]:
+        return {
+            'Forward': '2a99663',
+            'Approve': f"{self._rng.randint(0, 9999999):07d}",
+            'TranID': uuid.uuid4().hex[:28],
+            'TranDate': datetime.now().strftime('%Y%m%d%H%M%S'),
+        }
+
+    # Operations (called with self._lock held)
+
+    def _entry_tran_brandtoken(self, params: Dict[str, str]) -> Dict[str, str]:
+        order_id = params.get('OrderID')
+        if not order_id:
+            return self._error(ORDER_ID_MISSING)
+        if order_id in self._orders:
+            return self._error(DUPLICATE_ORDER)
+        order = self._new_order(order_id, 'UNPROCESSED')
+        return {'AccessID': order['AccessID'], 'AccessPass': order['AccessPass']}
+
+    def _new_order(self, order_id: str, status: str) -> Dict[str, str]:
+        order = {'OrderID': order_id, 'AccessID': uuid.uuid4().hex, 'AccessPass': uuid.uuid4().hex, 'Status': status}
+        self._orders[order_id] = order
+        self._access[order['AccessID']] = order
+        return order
+
+    def _order_for_access(self, params: Dict[str, str]) -> Optional[Dict[str, str]]:
+        order = self._access.get(params.get('AccessID', ''))
+        if order is None or order['AccessPass'] != params.get('AccessPass'):
+            return None
+        return order
+
+    def _exec_tran_brandtoken(self, params: Dict[str, str]) -> Dict[str, str]:
+        order = self._order_for_access(params)
+        if order is None:
+            return self._error(ACCESS_MISMATCH)
+        if order['Status'] != 'UNPROCESSED':
+            return self._error(INVALID_STATUS)
+        order['Status'] = 'CAPTURE'
+        order.update(self._approval())
+        return {'Status': 'CAPTURE', 'OrderID': params['OrderID'], **self._approval_of(order)}
+
+    def _save_member(self, params: Dict[str, str]) -> Dict[str, str]:
+        member_id = params.get('MemberID', '')
+        if member_id in self._members:
+            return self._error(DUPLICATE_MEMBER)
+        self._members[member_id] = []
+        return {'MemberID': member_id}
+
+    def _save_card(self, params: Dict[str, str]) -> Dict[str, str]:
+        cards = self._members.get(params.get('MemberID', ''))
+        if cards is None:
+            return self._error(MEMBER_NOT_FOUND)
+        card_seq = str(len(cards))
+        cards.append(card_seq)
+        # GMO PG answers with CardSeq; GMOClient callers read CardID
+        return {'CardSeq': card_seq, 'CardID': card_seq, 'CardNo': '*************111', 'Forward': '2a99663'}
+
+    def _exec_tran(self, params: Dict[str, str]) -> Dict[str, str]:
+        cards = self._members.get(params.get('MemberID', ''))
+        if cards is None or params.get('CardID') not in cards:
+            return self._error(MEMBER_NOT_FOUND)
+        order_id = params.get('OrderID')
+        if not order_id:
+            return self._error(ORDER_ID_MISSING)
+        if order_id in self._orders:
+            return self._error(DUPLICATE_ORDER)
+        order = self._new_order(order_id, 'CAPTURE')
+        order.update(self._approval())
+        return {'Status': 'CAPTURE', 'OrderID': order_id, 'AccessID': order['AccessID'], **self._approval_of(order)}
+
+    def _alter_tran(self, params: Dict[str, str]) -> Dict[str, str]:
+        order = self._order_for_access(params)
+        if order is None:
+            return self._error(ACCESS_MISMATCH)
+        order['Status'] = params.get('JobCd', 'VOID')
+        return {'AccessID': order['AccessID'], 'AccessPass': order['AccessPass'], **self._approval()}
+
+    def _search_trade(self, params: Dict[str, str]) -> Dict[str, str]:
+        order = self._orders.get(params.get('OrderID', ''))
+        if order is None:
+            return self._error(ORDER_NOT_FOUND)
+        return dict(order)
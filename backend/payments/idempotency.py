@@ -0,0 +1,357 @@
+"""
+Idempotency-Key support for payment endpoints
+
+A client that retries a payment POST with the same Idempotency-Key header gets
+the stored response of the first attempt instead of a second charge. While the
+first attempt is still running, duplicates wait for its result:
+    - within one process, through a SingleFlight keyed on the idempotency key
+    - across processes, through a short-lived lock in the store
+
+The same decorator works on async view handlers (the ASGI views): duplicates
+in one event loop share one execution through an AsyncSingleFlight, and store
+calls run on worker threads so a cache backend never blocks the loop.
+
+Stores are pluggable (IDEMPOTENCY_STORE setting):
+    'memory' - per-process LRU with TTL (O(1) get/set)
+    'cache'  - Django cache backend (shared between workers with a shared cache)
+    'tiered' - memory LRU in front of the cache backend
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.response import Response
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class MemoryIdempotencyStore:
+    """
+    Per-process LRU store with TTL expiry
+
+    Args:
+        max_entries: Entries kept before the least recently used is evicted
+        ttl: Seconds a stored response stays replayable
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: int = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._locks: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, record = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return record
+
+    def set(self, key: str, record: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def acquire(self, key: str, timeout: int) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            held_until = self._locks.get(key)
+            if held_until is not None and held_until > now:
+                return False
+            self._locks[key] = now + timeout
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._locks.pop(key, None)
+
+
+class CacheIdempotencyStore:
+    """
+    Store backed by a Django cache alias
+
+    With a shared cache (e.g. Redis) stored responses and in-flight locks are
+    visible to every worker process.
+    """
+
+    def __init__(self, alias: str = 'default', ttl: int = 86400):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.cache.get(f"idempotency:{key}")
+
+    def set(self, key: str, record: dict) -> None:
+        self.cache.set(f"idempotency:{key}", record, self.ttl)
+
+    def acquire(self, key: str, timeout: int) -> bool:
+        return self.cache.add(f"idempotency-lock:{key}", 1, timeout)
+
+    def release(self, key: str) -> None:
+        self.cache.delete(f"idempotency-lock:{key}")
+
+
+class TieredIdempotencyStore:
+    """Memory LRU in front of a shared store; locks go to the shared store"""
+
+    def __init__(self, local: MemoryIdempotencyStore, shared: CacheIdempotencyStore):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key: str) -> Optional[dict]:
+        record = self.local.get(key)
+        if record is None:
+            record = self.shared.get(key)
+            if record is not None:
+                self.local.set(key, record)
+        return record
+
+    def set(self, key: str, record: dict) -> None:
+        self.local.set(key, record)
+        self.shared.set(key, record)
+
+    def acquire(self, key: str, timeout: int) -> bool:
+        return self.shared.acquire(key, timeout)
+
+    def release(self, key: str) -> None:
+        self.shared.release(key)
+
+
+_store = None
+_store_lock = threading.Lock()
+_flight = SingleFlight()
+_aflight = AsyncSingleFlight()
+
+# Polling interval while another worker process holds the key's lock
+_LOCK_POLL_SECONDS = 0.05
+
+
+def get_idempotency_store():
+    """Get the process-wide idempotency store configured by IDEMPOTENCY_STORE"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = getattr(settings, 'IDEMPOTENCY_STORE', 'memory')
+                ttl = getattr(settings, 'IDEMPOTENCY_TTL_SECONDS', 86400)
+                alias = getattr(settings, 'IDEMPOTENCY_CACHE_ALIAS', 'default')
+                local = MemoryIdempotencyStore(
+                    max_entries=getattr(settings, 'IDEMPOTENCY_MAX_ENTRIES', 10000),
+                    ttl=ttl,
+                )
+                if backend == 'cache':
+                    _store = CacheIdempotencyStore(alias=alias, ttl=ttl)
+                elif backend == 'tiered':
+                    _store = TieredIdempotencyStore(local, CacheIdempotencyStore(alias=alias, ttl=ttl))
+                else:
+                    _store = local
+    return _store
+
+
+def reset_idempotency_store() -> None:
+    """Drop the configured store (the next request rebuilds it from settings)"""
+    global _store
+    with _store_lock:
+        _store = None
+
+
+def order_id_for(base: str, idempotency_key: Optional[str] = None) -> str:
+    """
+    Build a unique GMO order ID for a charge
+
+    With an idempotency key the suffix is derived from the key, so a retried
+    request reuses the same order ID and GMO PG itself rejects a second charge
+    even if the stored response was lost. Without a key the suffix is random,
+    so two charges in the same second never collide.
+    """
+    if idempotency_key:
+        suffix = hashlib.sha256(idempotency_key.encode()).hexdigest()[:10]
+    else:
+        suffix = uuid.uuid4().hex[:10]
+    return f"ORDER_{base}_{suffix}"
+
+
+def _json_response(data, status: int) -> JsonResponse:
+    return JsonResponse(data, status=status, safe=False)
+
+
+KEY_TOO_LONG = {'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'}
+IN_PROGRESS = {
+    'error': f'A request with this {IDEMPOTENCY_HEADER} is still in progress',
+    'error_code': 'IDEMPOTENCY_IN_PROGRESS',
+}
+
+
+def _replay(record: dict, fingerprint: str, respond: Callable = Response):
+    if record['fingerprint'] != fingerprint:
+        return respond(
+            {
+                'error': f'{IDEMPOTENCY_HEADER} was already used with a different request body',
+                'error_code': 'IDEMPOTENCY_KEY_REUSED',
+            },
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = respond(record['data'], status=record['status_code'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(method):
+    """
+    Make a view handler replay its response for a repeated Idempotency-Key
+
+    Wraps sync APIView handlers (DRF Response) and async View handlers
+    (JsonResponse). Requests without the header are processed normally.
+    Responses with a 5xx status are not stored, so the client may retry them.
+    """
+    if asyncio.iscoroutinefunction(method):
+        return _aidempotent(method)
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return method(self, request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(KEY_TOO_LONG, status=status.HTTP_400_BAD_REQUEST)
+
+        scoped_key = f"{request.path}:{key}"
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        store = get_idempotency_store()
+
+        record = store.get(scoped_key)
+        if record is not None:
+            return _replay(record, fingerprint)
+
+        def execute():
+            """Run the handler once; returns (record, response or None)"""
+            lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60)
+            deadline = time.monotonic() + lock_timeout
+            while not store.acquire(scoped_key, lock_timeout):
+                # Another worker process is handling this key; wait for its result,
+                # or take the lock over if it is released without one (a 5xx)
+                if time.monotonic() >= deadline:
+                    return None, None
+                time.sleep(_LOCK_POLL_SECONDS)
+                stored = store.get(scoped_key)
+                if stored is not None:
+                    return stored, None
+
+            try:
+                stored = store.get(scoped_key)
+                if stored is not None:
+                    return stored, None
+
+                response = method(self, request, *args, **kwargs)
+                stored = {
+                    'fingerprint': fingerprint,
+                    'status_code': response.status_code,
+                    'data': response.data,
+                }
+                if response.status_code < 500:
+                    store.set(scoped_key, stored)
+                return stored, response
+            finally:
+                store.release(scoped_key)
+
+        (stored, response), shared = _flight.do(scoped_key, execute)
+
+        if stored is None:
+            return Response(IN_PROGRESS, status=status.HTTP_409_CONFLICT)
+        if response is not None and not shared:
+            return response
+        return _replay(stored, fingerprint)
+
+    return wrapper
+
+
+def _aidempotent(method):
+    """idempotent() for async handlers returning JsonResponse"""
+    @functools.wraps(method)
+    async def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await method(self, request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return _json_response(KEY_TOO_LONG, status=status.HTTP_400_BAD_REQUEST)
+
+        scoped_key = f"{request.path}:{key}"
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        store = get_idempotency_store()
+        # Cache-backed stores do network I/O: keep it off the event loop
+        get = sync_to_async(store.get, thread_sensitive=False)
+
+        record = await get(scoped_key)
+        if record is not None:
+            return _replay(record, fingerprint, _json_response)
+
+        async def execute():
+            """Run the handler once; returns (record, response or None)"""
+            lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60)
+            acquire = sync_to_async(store.acquire, thread_sensitive=False)
+            deadline = time.monotonic() + lock_timeout
+            while not await acquire(scoped_key, lock_timeout):
+                # Another worker process is handling this key; wait for its result,
+                # or take the lock over if it is released without one (a 5xx)
+                if time.monotonic() >= deadline:
+                    return None, None
+                await asyncio.sleep(_LOCK_POLL_SECONDS)
+                stored = await get(scoped_key)
+                if stored is not None:
+                    return stored, None
+
+            try:
+                stored = await get(scoped_key)
+                if stored is not None:
+                    return stored, None
+
+                response = await method(self, request, *args, **kwargs)
+                stored = {
+                    'fingerprint': fingerprint,
+                    'status_code': response.status_code,
+                    'data': json.loads(response.content),
+                }
+                if response.status_code < 500:
+                    await sync_to_async(store.set, thread_sensitive=False)(scoped_key, stored)
+                return stored, response
+            finally:
+                await sync_to_async(store.release, thread_sensitive=False)(scoped_key)
+
+        (stored, response), shared = await _aflight.do(scoped_key, execute)
+
+        if stored is None:
+            return _json_response(IN_PROGRESS, status=status.HTTP_409_CONFLICT)
+        if response is not None and not shared:
+            return response
+        return _replay(stored, fingerprint, _json_response)
+
+    return wrapper
@@ -0,0 +1,208 @@
+"""
+Non-blocking, structured logging
+
+Request threads never format or write log records. BackgroundHandler puts each
+record on a bounded in-memory queue, and a listener thread formats it and
+writes it to the real handlers (console, file). When the queue is full, the
+record is dropped and counted instead of blocking the request. The last
+records are flushed at interpreter exit.
+
+Threads do not survive fork(): a process forked from the one that created the
+handler (a gunicorn worker of a preloaded master) gets its own queue and
+listener when it logs its first record.
+
+JSONFormatter writes one JSON object per line:
+
+    {"ts": "2026-10-17T01:33:34.791Z", "level": "INFO", "logger": "payments.services",
+     "message": "GMO PG API Success: EntryTranBrandtoken.idPass", "endpoint": "EntryTranBrandtoken.idPass"}
+
+Fields passed with `extra=` become top-level keys. Because %-style arguments and
+Lazy(...) field values are evaluated on the listener thread, and only for records
+that pass the level and sampling checks, arguments must not change after the call.
+Lazy callables must be cheap and pure; in particular they must not use the ORM.
+
+SampleFilter keeps 1 in N records of INFO and below per call site
+(LOG_INFO_SAMPLE_RATE). Pass extra={'sample': False} to always keep a record.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Optional
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+
+# LogRecord attributes that are not user fields
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+
+class Lazy:
+    """A log field (or %-style argument) computed only when the record is written"""
+    __slots__ = ('fn', 'args')
+
+    def __init__(self, fn: Callable[..., Any], *args):
+        self.fn = fn
+        self.args = args
+
+    def __call__(self):
+        return self.fn(*self.args)
+
+    def __str__(self):
+        return str(self())
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as single-line JSON objects"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')[:-6] + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value() if isinstance(value, Lazy) else value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keep one in every round(1 / rate) records at INFO and below, per call site
+
+    Args:
+        rate: Fraction of low-level records to keep (1.0 keeps everything)
+        level: Records above this level are always kept
+    """
+
+    def __init__(self, rate: float = 1.0, level: int = logging.INFO):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.level = level
+        self._seen = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or record.levelno > self.level or not getattr(record, 'sample', True):
+            return True
+        if not self.every:
+            return False
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            self._seen[key] += 1
+            return (self._seen[key] - 1) % self.every == 0
+
+
+class _Listener(QueueListener):
+    # Seconds stop() waits for room in a full queue, and for the listener to finish
+    stop_timeout = 5.0
+
+    def enqueue_sentinel(self):
+        # The queue may be full when the handler is closed: wait for room, then
+        # make room, so a blocked target cannot hang process exit
+        try:
+            self.queue.put(self._sentinel, timeout=self.stop_timeout)
+            return
+        except queue.Full:
+            pass
+        while True:
+            try:
+                self.queue.put_nowait(self._sentinel)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                except queue.Empty:
+                    pass
+
+    def stop(self):
+        if self._thread is not None:
+            self.enqueue_sentinel()
+            self._thread.join(self.stop_timeout)
+            self._thread = None
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hand records to a listener thread that writes them to the real handlers
+
+    Args:
+        stream: Write to this stream (default sys.stderr); None to skip
+        filename: Also append to this file
+        maxsize: Queue capacity; records beyond it are dropped (see `dropped`)
+        sample_rate: Keep this fraction of INFO/DEBUG records (SampleFilter)
+    """
+
+    def __init__(
+        self,
+        stream: Optional[Any] = sys.stderr,
+        filename: Optional[str] = None,
+        maxsize: int = 10000,
+        sample_rate: float = 1.0,
+    ):
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.targets = []
+        if stream is not None:
+            self.targets.append(logging.StreamHandler(stream))
+        if filename:
+            self.targets.append(logging.FileHandler(filename, delay=True))
+        self.dropped = 0
+        if sample_rate < 1.0:
+            self.addFilter(SampleFilter(sample_rate))
+        self._start_listener()
+        atexit.register(self.close)
+
+    def _start_listener(self):
+        self.listener = _Listener(self.queue, *self.targets, respect_handler_level=True)
+        self.listener.start()
+        self.pid = os.getpid()
+
+    def _owns_listener(self) -> bool:
+        """True if the listener thread runs in this process (not in the one this was forked from)"""
+        return self.listener._thread is not None and self.pid == os.getpid()
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]):
+        # Formatting happens on the listener thread, in the target handlers
+        for target in self.targets:
+            target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Same process: pass the record as-is, so the message is built by the listener
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.pid != os.getpid():
+            # Forked: the parent's listener thread does not exist here, and records
+            # still queued in the copied queue are the parent's to write.
+            # Serialized by the handler lock, which logging resets after fork
+            self.queue = queue.Queue(self.maxsize)
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Wait until the listener has written every queued record"""
+        if self._owns_listener():
+            self.queue.join()
+        for target in self.targets:
+            target.flush()
+
+    def close(self):
+        if self._owns_listener():
+            self.listener.stop()
+        for target in self.targets:
+            target.close()
+        super().close()
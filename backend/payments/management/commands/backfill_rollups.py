@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from payments.models import Transaction
+from payments.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly and daily rollups of one-time payments from the transactions table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', default=None,
+                            help='First day to rebuild, YYYY-MM-DD (default: day of the oldest transaction)')
+        parser.add_argument('--end', default=None, help='Last day to rebuild, YYYY-MM-DD (default: today)')
+
+    def handle(self, *args, **options):
+        first_day = self._day(options['start'], '--start')
+        last_day = self._day(options['end'], '--end') or timezone.localdate()
+        if first_day is None:
+            oldest = Transaction.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if oldest is None:
+                self.stdout.write('No transactions to roll up')
+                return
+            first_day = timezone.localdate(oldest)
+        if last_day < first_day:
+            raise CommandError('--end must not be before --start')
+
+        started = timezone.now()
+        stats = backfill(first_day, last_day)
+        elapsed = (timezone.now() - started).total_seconds()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {stats['payments']} payments over {stats['days']} days "
+            f"into {stats['buckets']} buckets in {elapsed:.1f}s"
+        ))
+
+    def _day(self, raw, option):
+        if not raw:
+            return None
+        day = parse_date(raw)
+        if day is None:
+            raise CommandError(f'{option} must be a date (YYYY-MM-DD)')
+        return day
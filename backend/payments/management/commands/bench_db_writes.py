@@ -0,0 +1,109 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, OperationalError
+from payments.models import Transaction
+from payments.persistence import PaymentRecorder
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent checkout writes (INSERT + read + UPDATE) against a throwaway '
+        'database and report throughput, latency and "database is locked" errors'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent writer threads')
+        parser.add_argument('--checkouts', type=int, default=200, help='Checkouts per thread')
+        parser.add_argument('--baseline', action='store_true',
+                            help="Use Django's default SQLite options (rollback journal, deferred "
+                                 "transactions, 5s timeout) instead of the configured ones")
+
+    def handle(self, *args, **options):
+        db_settings = settings.DATABASES['default']
+        original_options = db_settings.get('OPTIONS', {})
+        temp_dir = None
+
+        if connection.vendor == 'sqlite':
+            # The default SQLite test database is in-memory; locking only
+            # shows up with a real file shared by several connections
+            temp_dir = tempfile.TemporaryDirectory()
+            db_settings.setdefault('TEST', {})['NAME'] = os.path.join(temp_dir.name, 'bench.sqlite3')
+            if options['baseline']:
+                db_settings['OPTIONS'] = {}
+        elif options['baseline']:
+            raise CommandError('--baseline only applies to SQLite')
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.report(connection.vendor, self.run(options['threads'], options['checkouts']), options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            db_settings['OPTIONS'] = original_options
+            if temp_dir is not None:
+                temp_dir.cleanup()
+
+    def checkout(self, n):
+        """One checkout's write plan: INSERT, a recent-transactions read, final UPDATE"""
+        recorder = PaymentRecorder.new(amount=Decimal('1000'), currency='JPY', status='processing')
+        recorder.set(gmo_order_id=f"ORDER_{recorder.transaction_id}").insert()
+        list(Transaction.objects.filter(status='processing').order_by('-created_at')[:20])
+        recorder.finalize('completed', gmo_access_id=f"aid{n}", gmo_access_pass=f"apass{n}")
+
+    def run(self, threads, checkouts):
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker():
+            local_latencies = []
+            local_errors = []
+            barrier.wait()
+            for n in range(checkouts):
+                started = time.perf_counter()
+                try:
+                    self.checkout(n)
+                except OperationalError as e:
+                    local_errors.append(str(e))
+                    continue
+                local_latencies.append(time.perf_counter() - started)
+            connections.close_all()
+            with lock:
+                latencies.extend(local_latencies)
+                errors.extend(local_errors)
+
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return {
+            'elapsed': elapsed,
+            'latencies': sorted(latencies),
+            'errors': errors,
+            'rows': Transaction.objects.filter(status='completed').count(),
+        }
+
+    def report(self, vendor, result, options):
+        latencies = result['latencies']
+        attempted = options['threads'] * options['checkouts']
+        mode = 'baseline' if options['baseline'] else 'configured'
+        self.stdout.write(f"{vendor} ({mode}), {options['threads']} threads x {options['checkouts']} checkouts")
+        self.stdout.write(f"  completed: {result['rows']}/{attempted} in {result['elapsed']:.2f}s "
+                          f"({result['rows'] / result['elapsed']:.0f} checkouts/s)")
+        if latencies:
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            self.stdout.write(f"  latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+                              f"p99 {p99 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+        self.stdout.write(f"  errors: {len(result['errors'])}")
+        for message in sorted(set(result['errors'])):
+            self.stdout.write(f"    {message}")
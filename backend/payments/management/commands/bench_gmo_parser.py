@@ -0,0 +1,71 @@
+import timeit
+from django.core.management.base import BaseCommand
+from requests.models import Response
+from payments.gmo_response import charset_from_content_type, decode_response
+
+# Representative GMO PG response bodies (Shift_JIS, '&'-separated)
+SAMPLES = {
+    'entry': b'AccessID=a3f1c9e2b7d84c0f9e6a5b4c3d2e1f00&AccessPass=0f1e2d3c4b5a69788796a5b4c3d2e1f0',
+    'exec': (
+        b'ACS=0&OrderID=ORDER_5f0c2b9e8d7a4c1b9e0f6a2d3c4b5a69_a1b2c3d4e5&Forward=2a99663&Method=1'
+        b'&PayTimes=&Approve=4614261&TranID=2501011234567890123456789012&TranDate=20250101123456'
+        b'&CheckString=0123456789abcdef0123456789abcdef&ClientField1=&ClientField2=&ClientField3='
+    ),
+    'error': b'ErrCode=E01|E01|E01&ErrInfo=E01010001|E01020001|E01040010',
+}
+
+CONTENT_TYPE = 'text/plain;charset=Windows-31J'
+
+
+def legacy_parse(text):
+    """The per-line parsing loop GMOClient used before gmo_response (kept for comparison)"""
+    result = {}
+    if text:
+        for line in text.strip().split('\n'):
+            line = line.strip()
+            if '=' in line:
+                try:
+                    key, value = line.split('=', 1)
+                    result[key.strip()] = value.strip()
+                except ValueError:
+                    continue
+    error_code = result.get('ErrCode') or result.get('ErrorCode') or result.get('error_code')
+    error_info = result.get('ErrInfo') or result.get('ErrorInfo') or result.get('error_info')
+    return result, error_code, error_info
+
+
+def legacy_response_text(body, content_type):
+    """Decode like the old code did, through requests' Response.text"""
+    response = Response()
+    response._content = body
+    response.headers['Content-Type'] = content_type
+    return response.text
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark GMO PG response decoding: gmo_response.decode_response vs the previous parsing loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=100_000, help='Parses per measurement')
+        parser.add_argument('--repeat', type=int, default=5, help='Measurements (best is reported)')
+
+    def handle(self, *args, **options):
+        number, repeat = options['number'], options['repeat']
+
+        def best_ns(fn):
+            return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e9
+
+        self.stdout.write(f"{'response':<8} {'legacy loop':>14} {'legacy + .text':>16} "
+                          f"{'.text, no charset':>18} {'decode_response':>16} {'speedup':>8}")
+        for name, body in SAMPLES.items():
+            # The old parser split lines only; feed it the newline form so it sees every field
+            lines = body.replace(b'&', b'\n')
+            text = lines.decode('cp932')
+            legacy = best_ns(lambda: legacy_parse(text))
+            legacy_text = best_ns(lambda: legacy_parse(legacy_response_text(lines, CONTENT_TYPE)))
+            legacy_detect = best_ns(lambda: legacy_parse(legacy_response_text(lines, 'text/plain')))
+            fast = best_ns(lambda: decode_response(body, charset_from_content_type(CONTENT_TYPE)))
+            self.stdout.write(
+                f"{name:<8} {legacy:>11.0f} ns {legacy_text:>13.0f} ns {legacy_detect:>15.0f} ns "
+                f"{fast:>13.0f} ns {legacy_text / fast:>7.1f}x"
+            )
@@ -0,0 +1,167 @@
+import random
+import statistics
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from payments.models import Transaction, Subscription
+
+# Schema without the payments indexes, used as the "before" baseline
+BASELINE_MIGRATION = '0001_initial'
+
+TRANSACTION_STATUSES = ['completed'] * 85 + ['failed'] * 8 + ['cancelled'] * 4 + ['processing'] * 2 + ['pending']
+SUBSCRIPTION_STATUSES = ['active'] * 70 + ['cancelled'] * 20 + ['paused'] * 5 + ['expired'] * 5
+CURRENCIES = ['JPY'] * 70 + ['USD'] * 15 + ['EUR'] * 10 + ['GBP', 'AUD', 'CAD'] * 2 + ['JPY'] * 4
+
+
+@contextmanager
+def _explicit_timestamps(*models):
+    """Let bulk_create keep the generated created_at values instead of now()"""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark billing sweep and admin/reporting queries on a throwaway test '
+        'database, before and after the payments indexes (prints plans and timings)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000,
+                            help='Transactions to generate (use 10000000 for the 10M-row benchmark)')
+        parser.add_argument('--subscriptions', type=int, default=None,
+                            help='Subscriptions to generate (default: rows / 10)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query (median is reported)')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Rows per bulk insert')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        subscriptions = options['subscriptions'] or max(rows // 10, 1)
+        self.repeat = options['repeat']
+        self.batch_size = options['batch_size']
+        self.rng = random.Random(42)
+        self.now = timezone.now()
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            call_command('migrate', 'payments', BASELINE_MIGRATION, verbosity=0)
+
+            self.stdout.write(f"Seeding {rows} transactions and {subscriptions} subscriptions on {connection.vendor}...")
+            started = time.monotonic()
+            self.seed(rows, subscriptions)
+            self.stdout.write(f"Seeded in {time.monotonic() - started:.1f}s")
+
+            self.analyze()
+            before = self.measure()
+
+            started = time.monotonic()
+            call_command('migrate', 'payments', verbosity=0)
+            self.stdout.write(f"Built indexes in {time.monotonic() - started:.1f}s")
+
+            self.analyze()
+            after = self.measure()
+
+            self.report(before, after)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, rows, subscriptions):
+        rng = self.rng
+        year = 365 * 24 * 3600
+
+        with _explicit_timestamps(Transaction, Subscription):
+            for offset in range(0, rows, self.batch_size):
+                batch = []
+                for _ in range(min(self.batch_size, rows - offset)):
+                    transaction_id = uuid.uuid4()
+                    batch.append(Transaction(
+                        transaction_id=transaction_id,
+                        amount=rng.randint(100, 50_000),
+                        currency=rng.choice(CURRENCIES),
+                        status=rng.choice(TRANSACTION_STATUSES),
+                        gmo_order_id=f"ORDER_{transaction_id}",
+                        created_at=self.now - timedelta(seconds=rng.randint(0, year)),
+                    ))
+                Transaction.objects.bulk_create(batch)
+
+            for offset in range(0, subscriptions, self.batch_size):
+                batch = []
+                for _ in range(min(self.batch_size, subscriptions - offset)):
+                    subscription_id = uuid.uuid4()
+                    batch.append(Subscription(
+                        subscription_id=subscription_id,
+                        member_id=f"MEMBER_{subscription_id}",
+                        card_id='1',
+                        amount=rng.randint(100, 50_000),
+                        currency=rng.choice(CURRENCIES),
+                        status=rng.choice(SUBSCRIPTION_STATUSES),
+                        billing_cycle=rng.choice(['monthly', 'yearly']),
+                        # ~3% of subscriptions are due at any given time
+                        next_billing_date=self.now + timedelta(seconds=rng.randint(-year // 30, year)),
+                        created_at=self.now - timedelta(seconds=rng.randint(0, year)),
+                    ))
+                Subscription.objects.bulk_create(batch)
+
+        sample = Transaction.objects.order_by().values_list('gmo_order_id', flat=True)[:1]
+        self.sample_order_id = sample[0] if sample else 'ORDER_missing'
+        sample = Subscription.objects.order_by().values_list('member_id', flat=True)[:1]
+        self.sample_member_id = sample[0] if sample else 'MEMBER_missing'
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def queries(self):
+        now = self.now
+        return [
+            ('billing sweep (active & due, keyset order)',
+             Subscription.objects.filter(status='active', next_billing_date__lte=now)
+             .order_by('next_billing_date', 'subscription_id')[:500]),
+            ('admin changelist (default ordering)',
+             Transaction.objects.all()[:100]),
+            ('admin changelist filtered by status',
+             Transaction.objects.filter(status='failed')[:100]),
+            ('admin changelist filtered by currency',
+             Transaction.objects.filter(currency='USD')[:100]),
+            ('lookup by gmo_order_id',
+             Transaction.objects.filter(gmo_order_id=self.sample_order_id)),
+            ('lookup by member_id',
+             Subscription.objects.filter(member_id=self.sample_member_id)),
+            ('stale processing transactions',
+             Transaction.objects.filter(status='processing', created_at__lt=now - timedelta(minutes=15))
+             .order_by('created_at')[:1000]),
+        ]
+
+    def measure(self):
+        results = {}
+        for name, queryset in self.queries():
+            plan = queryset.explain()
+            timings = []
+            for _ in range(self.repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - started)
+            results[name] = {'plan': plan, 'median_ms': statistics.median(timings) * 1000}
+        return results
+
+    def report(self, before, after):
+        for name in before:
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"  before: {before[name]['median_ms']:9.2f} ms")
+            for line in before[name]['plan'].splitlines():
+                self.stdout.write(f"      {line}")
+            self.stdout.write(f"  after:  {after[name]['median_ms']:9.2f} ms")
+            for line in after[name]['plan'].splitlines():
+                self.stdout.write(f"      {line}")
@@ -0,0 +1,133 @@
+import logging
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from payments.log import BackgroundHandler, JSONFormatter
+
+FAILED_RESPONSE = {'ErrCode': 'G02', 'ErrInfo': '42G020000', 'AccessID': 'a' * 32, 'AccessPass': 'p' * 32}
+VERBOSE = '{levelname} {asctime} {module} {message}'
+
+
+def legacy_checkout(logger, endpoints, failed):
+    """Log calls of one checkout before the logging pipeline: f-strings, built even when filtered out"""
+    for endpoint in endpoints:
+        logger.info(f"GMO PG API Success: {endpoint}")
+    if failed:
+        logger.error(f"GMO PG API Error: G02 - 42G020000 | Full response: {FAILED_RESPONSE}")
+        logger.info(f"Queued void of ORDER_1 (compensation task {1})")
+
+
+def lazy_checkout(logger, endpoints, failed):
+    """The same calls with %-style arguments and structured fields"""
+    for endpoint in endpoints:
+        logger.info("GMO PG API Success: %s", endpoint, extra={'endpoint': endpoint})
+    if failed:
+        logger.error(
+            "GMO PG API Error: %s - %s | Full response: %s", 'G02', '42G020000', FAILED_RESPONSE,
+            extra={'endpoint': 'ExecTranBrandtoken.idPass', 'error_code': 'G02', 'error_info': '42G020000'},
+        )
+        logger.info("Queued %s of %s (compensation task %s)", 'void', 'ORDER_1', 1)
+
+
+class SlowStream:
+    """File stream whose writes take at least `latency` seconds (a full pipe, a slow disk)"""
+
+    def __init__(self, path, latency):
+        self.file = open(path, 'a')
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Command(BaseCommand):
+    help = 'Measure the request-thread cost of logging per checkout (synchronous file handler vs background queue)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=20_000, help='Checkouts per measurement')
+        parser.add_argument('--repeat', type=int, default=3, help='Measurements (best is reported)')
+        parser.add_argument('--sink-latency-ms', type=float, default=0.0,
+                            help='Delay of every write to the log file, to model a slow disk or blocked pipe')
+        parser.add_argument('--queue-size', type=int, default=10000, help='BackgroundHandler queue capacity')
+        parser.add_argument('--sample-rate', type=float, default=1.0,
+                            help='Fraction of INFO records the background handlers keep per call site')
+
+    def handle(self, *args, **options):
+        checkouts, repeat = options['checkouts'], options['repeat']
+        latency = options['sink_latency_ms'] / 1000
+        queue_size, sample_rate = options['queue_size'], options['sample_rate']
+        endpoints = ('EntryTranBrandtoken.idPass', 'ExecTranBrandtoken.idPass')
+        text = logging.Formatter(VERBOSE, style='{')
+
+        self.stdout.write(
+            f"{checkouts} checkouts per run, sink latency {options['sink_latency_ms']} ms per write, "
+            f"INFO sample rate {sample_rate}. "
+            f"'request' is the time spent in log calls, 'drained' includes writing out the queue"
+        )
+        self.stdout.write(f"{'handler':<24} {'level':<8} {'checkout':<8} {'request':>12} {'drained':>12} {'dropped':>8}")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'bench.log')
+
+            def sync(stream):
+                handler = logging.StreamHandler(stream)
+                handler.setFormatter(text)
+                return handler
+
+            def background(formatter):
+                def make(stream):
+                    handler = BackgroundHandler(stream=stream, maxsize=queue_size, sample_rate=sample_rate)
+                    handler.setFormatter(formatter)
+                    return handler
+                return make
+
+            for label, level, failed in (('INFO', logging.INFO, False), ('INFO', logging.INFO, True),
+                                         ('WARNING', logging.WARNING, False), ('WARNING', logging.WARNING, True)):
+                for name, make_handler, calls in (
+                    ('sync, f-strings', sync, legacy_checkout),
+                    ('background text, lazy', background(text), lazy_checkout),
+                    ('background json, lazy', background(JSONFormatter()), lazy_checkout),
+                ):
+                    request, drained, dropped = self._measure(
+                        lambda: make_handler(SlowStream(path, latency)), calls, level, endpoints, failed,
+                        checkouts, repeat,
+                    )
+                    self.stdout.write(
+                        f"{name:<24} {label:<8} {'failed' if failed else 'ok':<8} "
+                        f"{request:>9.2f} us {drained:>9.2f} us {dropped:>8}"
+                    )
+
+    @staticmethod
+    def _measure(make_handler, calls, level, endpoints, failed, checkouts, repeat):
+        best_request = best_drained = float('inf')
+        dropped = 0
+        for _ in range(repeat):
+            logger = logging.getLogger('payments.bench_logging')
+            logger.propagate = False
+            logger.setLevel(level)
+            handler = make_handler()
+            logger.handlers = [handler]
+            try:
+                start = time.perf_counter()
+                for _ in range(checkouts):
+                    calls(logger, endpoints, failed)
+                request = time.perf_counter() - start
+                handler.flush()
+                drained = time.perf_counter() - start
+            finally:
+                logger.handlers = []
+                handler.close()
+                for target in getattr(handler, 'targets', [handler]):
+                    target.stream.close()
+            best_request = min(best_request, request / checkouts * 1e6)
+            best_drained = min(best_drained, drained / checkouts * 1e6)
+            dropped = max(dropped, getattr(handler, 'dropped', 0))
+        return best_request, best_drained, dropped
@@ -0,0 +1,57 @@
+import json
+import timeit
+from django.core.management.base import BaseCommand
+from payments import apple_pay_token
+from payments.apple_pay_token import ApplePayToken
+from payments.benchmark import SAMPLE_TOKEN
+from payments.services import prepare_brand_token
+
+
+def legacy_onetime(token):
+    """Token work per one-time checkout before ApplePayToken: serializer check, then load + dump in GMOClient"""
+    json.loads(token)
+    return json.dumps(json.loads(token))
+
+
+def legacy_setup(token):
+    """Token work per recurring setup before ApplePayToken: serializer check only (SaveCard got the raw string)"""
+    json.loads(token)
+    return token
+
+
+def current(token):
+    """Parse once in the serializer, forward the original string"""
+    return prepare_brand_token(ApplePayToken.parse(token))
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark the Apple Pay token handling of one checkout (serializer to GMO PG request field)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=20_000, help='Checkouts per measurement')
+        parser.add_argument('--repeat', type=int, default=5, help='Measurements (best is reported)')
+
+    def handle(self, *args, **options):
+        number, repeat = options['number'], options['repeat']
+
+        def best_us(fn):
+            return min(timeit.repeat(lambda: fn(SAMPLE_TOKEN), number=number, repeat=repeat)) / number * 1e6
+
+        stdlib_loads = apple_pay_token._loads
+        apple_pay_token._loads = json.loads
+        try:
+            current_stdlib = best_us(current)
+        finally:
+            apple_pay_token._loads = stdlib_loads
+        backend = 'orjson' if apple_pay_token.orjson is not None else 'json'
+
+        self.stdout.write(f"Token: {len(SAMPLE_TOKEN)} bytes, JSON backend: {backend}")
+        self.stdout.write(f"{'checkout':<16} {'before':>10} {'parse once (json)':>18} "
+                          f"{f'parse once ({backend})':>20} {'saved':>10}")
+        now = best_us(current)
+        for name, legacy in (('onetime', legacy_onetime), ('recurring-setup', legacy_setup)):
+            before = best_us(legacy)
+            self.stdout.write(
+                f"{name:<16} {before:>7.2f} us {current_stdlib:>15.2f} us "
+                f"{now:>17.2f} us {before - now:>7.2f} us"
+            )
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from payments.billing import BillingEngine
+from payments.config_validator import ConfigValidator
+
+
+class Command(BaseCommand):
+    help = 'Charge all active subscriptions whose next billing date has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent GMO PG calls (default: 16)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Subscriptions per batch (default: 500)')
+        parser.add_argument('--limit', type=int, default=None, help='Charge at most this many subscriptions')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint of an interrupted run and start from the earliest due date')
+        parser.add_argument('--dry-run', action='store_true', help='Only count due subscriptions')
+
+    def handle(self, *args, **options):
+        gmo_config = ConfigValidator.validate_gmo_credentials()
+        if not gmo_config['valid'] and not options['dry_run']:
+            for error in gmo_config['errors']:
+                self.stderr.write(self.style.ERROR(error))
+            return
+
+        engine = BillingEngine(
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            limit=options['limit'],
+            dry_run=options['dry_run'],
+            restart=options['restart'],
+        )
+        stats = engine.run()
+
+        if options['dry_run']:
+            self.stdout.write(f"{stats['selected']} subscriptions due")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Billed {stats['selected']} subscriptions in {stats['elapsed_seconds']}s "
+            f"({stats['charges_per_second']} charges/sec): "
+            f"{stats['charged']} charged, {stats['already_charged']} already charged, "
+            f"{stats['failed']} failed"
+        ))
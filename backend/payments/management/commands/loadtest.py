@@ -0,0 +1,94 @@
+import json
+from contextlib import nullcontext
+from django.core.management.base import BaseCommand, CommandError
+from payments.benchmark import (
+    SCENARIOS,
+    http_sender,
+    in_process_backend,
+    onetime_request,
+    recurring_charge_builder,
+    recurring_setup_request,
+    run_load,
+)
+from payments.gmo_simulator import GMOSimulator
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive onetime/process/, recurring/setup/ and recurring/charge/ at fixed concurrency and '
+        'report throughput and p50/p95/p99 latency (against --url, or --in-process with a GMO PG simulator)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all', help='Endpoint to drive')
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Backend base URL')
+        parser.add_argument('--in-process', action='store_true',
+                            help='Serve the backend in this process with a throwaway database and a GMO PG simulator')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per scenario')
+        parser.add_argument('--warmup', type=int, default=50, help='Untimed requests sent first per scenario')
+        parser.add_argument('--subscriptions', type=int, default=200,
+                            help='Subscriptions created (untimed) for recurring-charge')
+        parser.add_argument('--gmo-latency-ms', type=float, default=50.0, help='Simulator latency (--in-process)')
+        parser.add_argument('--gmo-jitter-ms', type=float, default=0.0, help='Simulator jitter (--in-process)')
+        parser.add_argument('--gmo-error-rate', type=float, default=0.0, help='Simulator error rate (--in-process)')
+        parser.add_argument('--gmo-drop-rate', type=float, default=0.0,
+                            help='Simulator dropped-connection rate (--in-process)')
+        parser.add_argument('--insecure', action='store_true', help='Skip TLS verification (self-signed dev certs)')
+        parser.add_argument('--json', metavar='PATH', help='Also write the results as JSON (regression baseline)')
+
+    def handle(self, *args, **options):
+        scenarios = SCENARIOS if options['scenario'] == 'all' else (options['scenario'],)
+
+        if options['in_process']:
+            simulator = GMOSimulator(
+                latency=options['gmo_latency_ms'] / 1000,
+                jitter=options['gmo_jitter_ms'] / 1000,
+                error_rate=options['gmo_error_rate'],
+                drop_rate=options['gmo_drop_rate'],
+                seed=42,
+            )
+            backend = in_process_backend(simulator)
+            target = (f"in-process (GMO simulator {options['gmo_latency_ms']:g} ms, "
+                      f"error rate {options['gmo_error_rate']:g}, drop rate {options['gmo_drop_rate']:g})")
+        else:
+            backend = nullcontext(http_sender(options['url'], verify=not options['insecure']))
+            target = options['url']
+
+        results = {}
+        with backend as make_sender:
+            self.stdout.write(f"Target: {target}, concurrency {options['concurrency']}, "
+                              f"{options['requests']} requests per scenario")
+            for scenario in scenarios:
+                build = self.request_builder(scenario, make_sender, options)
+                if options['warmup']:
+                    run_load(make_sender, build, options['warmup'], options['concurrency'])
+                results[scenario] = run_load(make_sender, build, options['requests'], options['concurrency'])
+                self.report(scenario, results[scenario])
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({'target': target, 'options': {
+                    key: options[key] for key in ('concurrency', 'requests', 'gmo_latency_ms', 'gmo_error_rate', 'gmo_drop_rate')
+                }, 'results': results}, f, indent=2)
+            self.stdout.write(f"Results written to {options['json']}")
+
+    def request_builder(self, scenario, make_sender, options):
+        if scenario == 'onetime':
+            return onetime_request
+        if scenario == 'recurring-setup':
+            return recurring_setup_request
+
+        setup = run_load(make_sender, recurring_setup_request, options['subscriptions'],
+                         options['concurrency'], collect=True)
+        subscription_ids = [body['subscription_id'] for body in setup['bodies'] if 'subscription_id' in body]
+        if not subscription_ids:
+            raise CommandError(f"Could not create subscriptions for recurring-charge: {setup['statuses']}")
+        return recurring_charge_builder(subscription_ids)
+
+    def report(self, scenario, result):
+        self.stdout.write(
+            f"{scenario:<17} {result['throughput']:>8.1f} req/s  "
+            f"p50 {result['p50_ms']:>7.1f} ms  p95 {result['p95_ms']:>7.1f} ms  "
+            f"p99 {result['p99_ms']:>7.1f} ms  max {result['max_ms']:>7.1f} ms  {result['statuses']}"
+        )
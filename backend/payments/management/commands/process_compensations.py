@@ -0,0 +1,41 @@
+import json
+from django.core.management.base import BaseCommand
+from payments.compensation import CompensationWorker, queue_stats
+from payments.config_validator import ConfigValidator
+
+
+class Command(BaseCommand):
+    help = 'Void/refund payments that failed part-way, retrying until GMO PG confirms'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process one batch of due tasks and exit')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait when no task is due (default: 2)')
+        parser.add_argument('--batch-size', type=int, default=50, help='Tasks claimed per poll (default: 50)')
+        parser.add_argument('--stats', action='store_true', help='Print the queue metrics as JSON and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(queue_stats()))
+            return
+
+        gmo_config = ConfigValidator.validate_gmo_credentials()
+        if not gmo_config['valid']:
+            for error in gmo_config['errors']:
+                self.stderr.write(self.style.ERROR(error))
+            return
+
+        worker = CompensationWorker(batch_size=options['batch_size'])
+        if options['once']:
+            stats = worker.run_once()
+            self.stdout.write(self.style.SUCCESS(
+                f"Processed {stats['claimed']} compensations: {stats['confirmed']} confirmed, "
+                f"{stats['retrying']} retrying | queue {queue_stats()}"
+            ))
+            return
+
+        self.stdout.write(f"Processing compensations (queue {queue_stats()}), Ctrl+C to stop")
+        try:
+            worker.run_forever(interval=options['interval'])
+        except KeyboardInterrupt:
+            pass
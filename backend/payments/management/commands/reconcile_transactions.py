@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from payments.config_validator import ConfigValidator
+from payments.reconciliation import ReconciliationEngine
+
+
+class Command(BaseCommand):
+    help = "Settle one-time payments stuck in 'processing' with the state GMO PG has for them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent SearchTrade calls (default: 16)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Transactions per batch (default: 500)')
+        parser.add_argument('--stale-minutes', type=float, default=None,
+                            help='Only transactions at least this old (default: RECONCILE_STALE_MINUTES)')
+        parser.add_argument('--limit', type=int, default=None, help='Reconcile at most this many transactions')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint of an interrupted run and start from the oldest row')
+        parser.add_argument('--dry-run', action='store_true', help='Only count stale transactions')
+
+    def handle(self, *args, **options):
+        gmo_config = ConfigValidator.validate_gmo_credentials()
+        if not gmo_config['valid'] and not options['dry_run']:
+            for error in gmo_config['errors']:
+                self.stderr.write(self.style.ERROR(error))
+            return
+
+        engine = ReconciliationEngine(
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            stale_minutes=options['stale_minutes'],
+            limit=options['limit'],
+            dry_run=options['dry_run'],
+            restart=options['restart'],
+        )
+        stats = engine.run()
+
+        if options['dry_run']:
+            self.stdout.write(f"{stats['selected']} stale transactions")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {stats['selected']} transactions in {stats['elapsed_seconds']}s "
+            f"({stats['lookups_per_second']} lookups/sec): "
+            f"{stats['completed']} completed, {stats['cancelled']} cancelled, {stats['failed']} failed, "
+            f"{stats['unresolved']} unresolved, {stats['skipped']} finalized meanwhile"
+        ))
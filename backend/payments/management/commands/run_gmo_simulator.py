@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from payments.gmo_simulator import GMOSimulator
+
+
+class Command(BaseCommand):
+    help = 'Serve a local GMO PG simulator (point GMO_API_ENDPOINT at it for tests and load benchmarks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to bind (default: 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=8900, help='Port to bind (default: 8900)')
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Delay before every response')
+        parser.add_argument('--jitter-ms', type=float, default=0.0, help='Extra random delay of up to this much')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Fraction (0-1) of calls answered with a gateway error')
+        parser.add_argument('--drop-rate', type=float, default=0.0,
+                            help='Fraction (0-1) of calls whose connection is closed without an answer')
+        parser.add_argument('--fail', action='append', default=[], metavar='OPERATION=ERRCODE:ERRINFO[:TIMES]',
+                            help='Fail the next TIMES (default 1) calls, e.g. ExecTran.idPass=G02:42G020000:5')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for jitter and random errors')
+
+    def handle(self, *args, **options):
+        simulator = GMOSimulator(
+            options['host'],
+            options['port'],
+            latency=options['latency_ms'] / 1000,
+            jitter=options['jitter_ms'] / 1000,
+            error_rate=options['error_rate'],
+            drop_rate=options['drop_rate'],
+            seed=options['seed'],
+        )
+        for fault in options['fail']:
+            try:
+                operation, spec = fault.split('=', 1)
+                err_code, err_info, *times = spec.split(':')
+                simulator.inject(operation, err_code, err_info, int(times[0]) if times else 1)
+            except ValueError:
+                raise CommandError(f"Invalid --fail value: {fault}")
+
+        self.stdout.write(f"GMO PG simulator listening on {simulator.url}")
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.server.server_close()
+            self.stdout.write(f"Calls served: {dict(simulator.calls)}")
@@ -0,0 +1,440 @@
+"""
+Prometheus-style metrics
+
+Counters and histograms are recorded into per-thread shards: a thread only
+ever writes its own dict, so recording takes no lock. A scrape merges the
+shards; shards of finished threads are folded into a retired total so short-
+lived threads (e.g. runserver's thread per request) do not accumulate.
+
+With several worker processes (gunicorn, uvicorn --workers) set METRICS_DIR to
+a directory shared by the workers. Each process then writes its totals to
+METRICS_DIR/metrics-<pid>.json every METRICS_FLUSH_SECONDS (and at exit), and
+a scrape of any worker merges the files of the processes still running. The
+files of exited workers are skipped, and gunicorn's child_exit hook deletes
+them (see gunicorn.conf.py).
+
+A process forked from one that already recorded metrics (a gunicorn worker of
+a preloaded master) starts with empty shards and its own flusher thread.
+
+Gauges computed at scrape time (the compensation queue) are registered as
+GaugeCallback; they are read from the database, not summed per process.
+
+Exposed at /api/payments/metrics/ in the Prometheus text format 0.0.4.
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets (seconds) covering DB writes (ms) up to gateway timeouts (30 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Label value recorded for successful calls
+NO_ERROR = 'none'
+
+# Name of the view serving the current request (set by MetricsMiddleware);
+# copied into threads started with sync_to_async, so async ORM writes are labelled too
+current_view: ContextVar[str] = ContextVar('current_view', default='none')
+
+Key = Tuple[str, Tuple[str, ...]]
+
+
+class _Shard:
+    __slots__ = ('thread', 'values')
+
+    def __init__(self, thread: threading.Thread):
+        self.thread = thread
+        # (metric name, label values) -> float (counter) or list of bucket counts + [sum, count]
+        self.values: Dict[Key, object] = {}
+
+
+class Registry:
+    """Metric definitions plus the per-thread shards holding their values"""
+
+    def __init__(self):
+        self.metrics: Dict[str, 'Metric'] = {}
+        self.callbacks: List['GaugeCallback'] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[_Shard] = []
+        self._retired: Dict[Key, object] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._flush_at_exit = False
+        self._pid = os.getpid()
+        _registries.add(self)
+
+    def register(self, metric: 'Metric') -> 'Metric':
+        self.metrics[metric.name] = metric
+        return metric
+
+    def values(self) -> Dict[Key, object]:
+        """The calling thread's shard"""
+        try:
+            return self._local.shard.values
+        except AttributeError:
+            shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            self._start_flusher()
+            return shard.values
+
+    def snapshot(self) -> Dict[Key, object]:
+        """Totals of this process (all live shards plus retired ones)"""
+        with self._lock:
+            live = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    live.append(shard)
+                else:
+                    _merge(self._retired, shard.values)
+            self._shards = live
+            totals = _copy(self._retired)
+            for shard in live:
+                # list() copies the dict in one step under the GIL, even while its thread inserts
+                _merge(totals, dict(list(shard.values.items())))
+        return totals
+
+    def collect(self) -> Dict[Key, object]:
+        """Totals of all worker processes (this one if METRICS_DIR is not set)"""
+        totals = self.snapshot()
+        directory = getattr(settings, 'METRICS_DIR', '')
+        if directory:
+            for name in os.listdir(directory):
+                if name.endswith('.json') and name != _snapshot_name():
+                    if not _process_alive(name):
+                        continue  # an exited worker; its totals left with it
+                    try:
+                        with open(os.path.join(directory, name)) as f:
+                            _merge(totals, _decode(json.load(f)))
+                    except (OSError, ValueError):
+                        continue  # being replaced, or from an unreadable deploy
+        return totals
+
+    def write_snapshot(self):
+        """Write this process's totals to METRICS_DIR (atomic replace)"""
+        directory = getattr(settings, 'METRICS_DIR', '')
+        if not directory:
+            return
+        path = os.path.join(directory, _snapshot_name())
+        temp = f'{path}.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(_encode(self.snapshot()), f)
+            os.replace(temp, path)
+        except OSError as e:
+            logger.warning("Could not write metrics snapshot %s: %s", path, e)
+
+    def _after_fork(self):
+        """Drop the values and flusher inherited from the parent process"""
+        if self._pid == os.getpid():
+            return
+        # The parent's threads do not exist here, and its lock may have been held while forking
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._flusher = None
+        self._pid = os.getpid()
+
+    def _start_flusher(self):
+        if self._flusher is not None or not getattr(settings, 'METRICS_DIR', ''):
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            interval = getattr(settings, 'METRICS_FLUSH_SECONDS', 5.0)
+
+            def flush_forever():
+                while True:
+                    time.sleep(interval)
+                    self.write_snapshot()
+
+            self._flusher = threading.Thread(target=flush_forever, name='metrics-flush', daemon=True)
+            self._flusher.start()
+            if not self._flush_at_exit:
+                # Inherited by forked children, so registered once
+                atexit.register(self.write_snapshot)
+                self._flush_at_exit = True
+
+    def reset(self):
+        """Forget all recorded values (tests)"""
+        with self._lock:
+            for shard in self._shards:
+                shard.values.clear()
+            self._retired.clear()
+
+    def exposition(self) -> str:
+        """All metrics in the Prometheus text format"""
+        totals = self.collect()
+        by_metric: Dict[str, List[Tuple[Tuple[str, ...], object]]] = {}
+        for (name, labels), value in totals.items():
+            by_metric.setdefault(name, []).append((labels, value))
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose(sorted(by_metric.get(metric.name, ()))))
+        for callback in self.callbacks:
+            lines.extend(callback.expose())
+        return '\n'.join(lines) + '\n'
+
+
+# Every Registry, reset in the child after os.fork()
+_registries: "weakref.WeakSet[Registry]" = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for registry in list(_registries):
+        registry._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _snapshot_name() -> str:
+    return f'metrics-{os.getpid()}.json'
+
+
+def _process_alive(name: str) -> bool:
+    """Whether the process that wrote metrics-<pid>.json is still running"""
+    try:
+        pid = int(name[len('metrics-'):-len('.json')])
+    except ValueError:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # running as another user
+    return True
+
+
+def _copy(values: Dict[Key, object]) -> Dict[Key, object]:
+    return {key: list(value) if isinstance(value, list) else value for key, value in values.items()}
+
+
+def _merge(into: Dict[Key, object], values: Dict[Key, object]):
+    for key, value in values.items():
+        current = into.get(key)
+        if current is None:
+            into[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            for i, count in enumerate(value):
+                current[i] += count
+        else:
+            into[key] = current + value
+
+
+def _encode(values: Dict[Key, object]) -> list:
+    return [[name, list(labels), value] for (name, labels), value in values.items()]
+
+
+def _decode(entries: list) -> Dict[Key, object]:
+    return {(name, tuple(labels)): value for name, labels, value in entries}
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base for metrics whose values live in the registry shards"""
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: Optional[Registry] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+
+class Counter(Metric):
+    """Monotonic count, e.g. payments_outcomes_total"""
+    type = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        values = self.registry.values()
+        key = (self.name, labels)
+        values[key] = values.get(key, 0.0) + amount
+
+    def expose(self, series) -> List[str]:
+        lines = self.header()
+        for labels, value in series:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}')
+        return lines
+
+
+class Histogram(Metric):
+    """Distribution of observed values (seconds) in fixed buckets"""
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        values = self.registry.values()
+        key = (self.name, labels)
+        counts = values.get(key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then sum and count
+            counts = values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def time(self, *labels: str) -> '_Timer':
+        """Context manager observing the duration of the enclosed block"""
+        return _Timer(self, labels)
+
+    def expose(self, series) -> List[str]:
+        lines = self.header()
+        bounds = self.buckets + (math.inf,)
+        for labels, counts in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(counts[-2])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {counts[-1]}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class GaugeCallback:
+    """
+    Gauge (or counter) whose samples are computed at scrape time
+
+    Args:
+        name: Metric name
+        documentation: HELP text
+        fn: Returns {label values tuple: value}
+        labelnames: Label names
+        type: 'gauge' or 'counter'
+    """
+
+    def __init__(self, name: str, documentation: str, fn: Callable[[], Dict[Tuple[str, ...], float]],
+                 labelnames: Sequence[str] = (), type: str = 'gauge', registry: Optional[Registry] = None):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.type = type
+        (registry or REGISTRY).callbacks.append(self)
+
+    def expose(self) -> Iterable[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, value in sorted(self.fn().items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}')
+        return lines
+
+
+REGISTRY = Registry()
+
+gmo_request_duration = Histogram(
+    'gmo_request_duration_seconds',
+    'GMO PG API calls including retries, by endpoint and error_code',
+    ('endpoint', 'error_code'),
+)
+apple_validation_duration = Histogram(
+    'apple_merchant_validation_duration_seconds',
+    'Apple Pay merchant validation calls, by error_code',
+    ('error_code',),
+)
+apple_validations_coalesced = Counter(
+    'apple_merchant_validation_coalesced_total',
+    'Merchant validation requests answered by another in-flight call to Apple',
+)
+db_write_duration = Histogram(
+    'payments_db_write_duration_seconds',
+    'Database writes (INSERT/UPDATE/DELETE), by view and operation',
+    ('view', 'operation'),
+)
+request_duration = Histogram(
+    'payments_request_duration_seconds',
+    'End-to-end latency of payment API requests, by view and HTTP status',
+    ('view', 'status'),
+)
+gmo_retry_events = Counter(
+    'gmo_retry_events_total',
+    'GMO PG call attempts and retry outcomes (see payments.retry), by endpoint and event',
+    ('endpoint', 'event'),
+)
+payment_outcomes = Counter(
+    'payments_outcomes_total',
+    'Final states of payments: completed, failed, cancelled, rolled_back',
+    ('flow', 'outcome'),
+)
+
+
+def observe_gateway_call(histogram: Histogram, started: float, success: bool, result: Dict, *labels: str):
+    """Record a gateway call that began at perf_counter() value `started`"""
+    error_code = NO_ERROR if success else (result.get('error_code') or 'UNKNOWN_ERROR')
+    histogram.observe(time.perf_counter() - started, *labels, error_code)
+
+
+_WRITE_OPERATIONS = {'INSERT': 'insert', 'UPDATE': 'update', 'DELETE': 'delete'}
+
+
+def time_db_writes(execute, sql, params, many, context):
+    """connection.execute_wrappers entry timing INSERT/UPDATE/DELETE statements"""
+    operation = _WRITE_OPERATIONS.get(sql[:6].upper())
+    if operation is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        db_write_duration.observe(time.perf_counter() - started, current_view.get(), operation)
+
+
+def install_db_timer(sender, connection, **kwargs):
+    """connection_created receiver: time writes on every new database connection"""
+    if time_db_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_db_writes)
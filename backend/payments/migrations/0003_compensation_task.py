@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:31
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompensationTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('void', 'Void'), ('refund', 'Refund')], default='void', max_length=10)),
+                ('gmo_order_id', models.CharField(max_length=50)),
+                ('gmo_access_id', models.CharField(max_length=50)),
+                ('gmo_access_pass', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='compensations', to='payments.transaction')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='comp_pending_due_idx')],
+            },
+        ),
+    ]
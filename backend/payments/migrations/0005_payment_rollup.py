@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_job_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('flow', models.CharField(help_text='onetime or recurring_charge', max_length=20)),
+                ('currency', models.CharField(max_length=3)),
+                ('status', models.CharField(max_length=20)),
+                ('error_code', models.CharField(blank=True, default='', max_length=20)),
+                ('count', models.BigIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+            ],
+            options={
+                'ordering': ['granularity', 'bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket_start', 'flow', 'currency', 'status', 'error_code'), name='rollup_bucket_key')],
+            },
+        ),
+    ]
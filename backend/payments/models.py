@@ -28,6 +28,16 @@ class Transaction(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Default ordering / admin changelist
+            models.Index(fields=['-created_at'], name='txn_created_idx'),
+            # Admin status filter, reporting by outcome and sweeps for
+            # transactions stuck in 'processing' (status, created_at range)
+            models.Index(fields=['status', '-created_at'], name='txn_status_created_idx'),
+            models.Index(fields=['currency', '-created_at'], name='txn_currency_created_idx'),
+            # Gateway lookups by GMO order ID
+            models.Index(fields=['gmo_order_id'], name='txn_gmo_order_idx'),
+        ]
     
     def __str__(self):
         return f"Transaction {self.transaction_id} - {self.amount} {self.currency} - {self.status}"
@@ -57,6 +67,119 @@ class Subscription(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Default ordering / admin changelist
+            models.Index(fields=['-created_at'], name='sub_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='sub_status_created_idx'),
+            # Billing sweep: active subscriptions by due date (keyset order)
+            models.Index(
+                fields=['next_billing_date', 'subscription_id'],
+                condition=models.Q(status='active'),
+                name='sub_active_due_idx',
+            ),
+            # Gateway lookups by GMO member ID
+            models.Index(fields=['member_id'], name='sub_member_idx'),
+        ]
     
     def __str__(self):
         return f"Subscription {self.subscription_id} - {self.amount} {self.currency}/{self.billing_cycle} - {self.status}"
+
+
+class CompensationTask(models.Model):
+    """
+    A void or refund owed to GMO PG for a payment that failed part-way
+
+    Written in the request that detected the failure and carried out by the
+    process_compensations worker, which retries until GMO PG confirms.
+    """
+    
+    ACTION_CHOICES = [
+        ('void', 'Void'),
+        ('refund', 'Refund'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+    ]
+    
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, related_name='compensations', blank=True, null=True
+    )
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default='void')
+    gmo_order_id = models.CharField(max_length=50)
+    gmo_access_id = models.CharField(max_length=50)
+    gmo_access_pass = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # Worker poll: pending tasks by due time
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status='pending'),
+                name='comp_pending_due_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"CompensationTask {self.pk} - {self.action} {self.gmo_order_id} - {self.status}"
+
+
+class JobCheckpoint(models.Model):
+    """
+    Resume position of a long-running batch job
+
+    A job stores the keyset cursor of the last chunk it finished, so a run
+    interrupted part-way continues from there instead of starting over.
+    """
+    
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"JobCheckpoint {self.name} - {self.position}"
+
+
+class PaymentRollup(models.Model):
+    """
+    Number and amount of finalized payments in one hour or day bucket
+
+    Kept current by payments/rollups.py as payments are finalized, so
+    dashboards read a few rows per bucket instead of scanning transactions.
+    """
+    
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    flow = models.CharField(max_length=20, help_text="onetime or recurring_charge")
+    currency = models.CharField(max_length=3)
+    status = models.CharField(max_length=20)
+    error_code = models.CharField(max_length=20, blank=True, default='')
+    count = models.BigIntegerField(default=0)
+    amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['granularity', 'bucket_start']
+        constraints = [
+            # Upsert target; also serves dashboard reads by (granularity, bucket_start) range
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket_start', 'flow', 'currency', 'status', 'error_code'],
+                name='rollup_bucket_key',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"PaymentRollup {self.granularity} {self.bucket_start} {self.flow} {self.currency} {self.status} - {self.count}"
@@ -0,0 +1,161 @@
+"""
+Write plan for the payment flows
+
+PaymentRecorder (Transaction) and SubscriptionRecorder (Subscription) keep the
+row in memory between gateway steps and write to the database only at
+defined checkpoints, touching only the columns that changed since the last
+write:
+
+    1. insert()    - one INSERT before (or alongside) the first gateway call,
+                     with the GMO order or member ID already set so a stuck
+                     row can be reconciled
+    2. finalize()  - one UPDATE of the changed columns when the payment
+                     reaches a final state (completed / failed / cancelled,
+                     active / cancelled for a subscription)
+
+A checkout therefore costs one INSERT and one narrow UPDATE, instead of an
+INSERT followed by several full-row saves. Each final state is also counted in
+payments_outcomes_total, and a payment's final state is added to its
+PaymentRollup buckets with one upsert that commits together with the UPDATE.
+"""
+from typing import Dict, Optional, Set
+from asgiref.sync import sync_to_async
+from django.db import models, transaction as db_transaction
+from .metrics import payment_outcomes
+from .models import Subscription, Transaction
+from .rollups import RollupDelta
+
+
+class Recorder:
+    """
+    Track field changes on a model instance and persist them at checkpoints
+
+    Args:
+        instance: Model instance (saved or not yet saved)
+    """
+    model = models.Model
+    # payments_outcomes_total labels: flow, and outcome by final status
+    flow = ''
+    outcomes: Dict[str, str] = {}
+    # Add the final state to the PaymentRollup buckets (see payments.rollups)
+    rolls_up = False
+
+    def __init__(self, instance: models.Model):
+        self.instance = instance
+        self._dirty: Set[str] = set()
+        self._inserted = instance.pk is not None and not instance._state.adding
+
+    @classmethod
+    def new(cls, **fields) -> 'Recorder':
+        """Build a recorder around a new, unsaved instance"""
+        return cls(cls.model(**fields))
+
+    @property
+    def status(self) -> str:
+        return self.instance.status
+
+    def set(self, **fields) -> 'Recorder':
+        """Change fields in memory; they are written at the next checkpoint"""
+        for name, value in fields.items():
+            if getattr(self.instance, name) != value:
+                setattr(self.instance, name, value)
+                self._dirty.add(name)
+        return self
+
+    def _update_fields(self) -> Optional[list]:
+        if not self._dirty:
+            return None
+        return sorted(self._dirty | {'updated_at'})
+
+    def insert(self) -> 'Recorder':
+        """Checkpoint: INSERT the row with every field set so far"""
+        self.instance.save(force_insert=True)
+        self._inserted = True
+        self._dirty.clear()
+        return self
+
+    def checkpoint(self) -> 'Recorder':
+        """Checkpoint: UPDATE only the fields changed since the last write"""
+        if not self._inserted:
+            return self.insert()
+        update_fields = self._update_fields()
+        if update_fields:
+            self.instance.save(update_fields=update_fields)
+            self._dirty.clear()
+        return self
+
+    def finalize(self, status: str, **fields) -> 'Recorder':
+        """Set the final status (plus any other fields) and checkpoint"""
+        self.set(status=status, **fields)
+        if self.rolls_up:
+            # The rollup counts commit with the final state (no savepoint inside fail_with_compensation)
+            with db_transaction.atomic(savepoint=False):
+                self.checkpoint()
+                RollupDelta().add_payment(self.instance).apply()
+        else:
+            self.checkpoint()
+        self._count(status)
+        return self
+
+    def _count(self, status: str):
+        outcome = self.outcomes.get(status)
+        if outcome:
+            payment_outcomes.inc(self.flow, outcome)
+
+    async def ainsert(self) -> 'Recorder':
+        """Async version of insert()"""
+        await self.instance.asave(force_insert=True)
+        self._inserted = True
+        self._dirty.clear()
+        return self
+
+    async def acheckpoint(self) -> 'Recorder':
+        """Async version of checkpoint()"""
+        if not self._inserted:
+            return await self.ainsert()
+        update_fields = self._update_fields()
+        if update_fields:
+            await self.instance.asave(update_fields=update_fields)
+            self._dirty.clear()
+        return self
+
+    async def afinalize(self, status: str, **fields) -> 'Recorder':
+        """Async version of finalize()"""
+        if self.rolls_up:
+            # Database transactions need the thread Django uses for sync code
+            return await sync_to_async(self.finalize)(status, **fields)
+        self.set(status=status, **fields)
+        await self.acheckpoint()
+        self._count(status)
+        return self
+
+
+class PaymentRecorder(Recorder):
+    """Recorder for a Transaction (one-time checkout)"""
+    model = Transaction
+    flow = 'onetime'
+    outcomes = {'completed': 'completed', 'failed': 'failed', 'cancelled': 'cancelled'}
+    rolls_up = True
+
+    @property
+    def transaction(self) -> Transaction:
+        return self.instance
+
+    @property
+    def transaction_id(self):
+        return self.instance.transaction_id
+
+
+class SubscriptionRecorder(Recorder):
+    """Recorder for a Subscription (recurring setup)"""
+    model = Subscription
+    flow = 'recurring_setup'
+    outcomes = {'active': 'completed', 'cancelled': 'cancelled'}
+
+    @property
+    def subscription(self) -> Subscription:
+        return self.instance
+
+    @property
+    def subscription_id(self):
+        return self.instance.subscription_id
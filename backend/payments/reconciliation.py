@@ -0,0 +1,296 @@
+"""
+Reconciliation of one-time payments stuck in 'processing'
+
+OneTimePaymentView inserts the Transaction as 'processing', with its GMO order
+ID, before calling the gateway and writes the final state afterwards. If the
+worker dies in between, the row stays 'processing'. ReconciliationEngine looks
+every such row older than RECONCILE_STALE_MINUTES up with SearchTrade and
+records the state GMO PG has for the order:
+
+    CAPTURE / AUTH / SALES        completed (the customer was charged)
+    VOID / RETURN / CANCEL ...    cancelled
+    UNPROCESSED / AUTHENTICATED   failed (ExecTran never ran; nothing was charged)
+    order not found               failed (EntryTran never reached GMO PG)
+
+Rows whose lookup fails (timeout, open circuit) or whose trade status is not
+listed stay 'processing' and are looked at again by the next run.
+
+Rows are read in keyset-paginated chunks ordered by (created_at,
+transaction_id), with only the columns the job needs, so memory stays constant
+however many rows are stale. Each chunk is looked up on a bounded thread pool
+and written with one bulk_update and one rollup upsert. The cursor of the last
+finished chunk is kept in a JobCheckpoint: an interrupted run resumes after it,
+and a run that reaches the end clears it.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+import time
+import uuid
+from django.conf import settings
+from django.db import connection, reset_queries, transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+from .compensation import COMPENSATED_STATUSES, UNCHARGED_STATUSES
+from .metrics import payment_outcomes
+from .models import JobCheckpoint, Transaction
+from .rollups import RollupDelta
+from .services import GMOClient
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = 'reconcile_transactions'
+
+# Trade statuses (SearchTrade) meaning the order was charged
+CHARGED_STATUSES = frozenset({'CAPTURE', 'AUTH', 'SALES', 'SAUTH'})
+
+# Trade statuses meaning the charge was voided or refunded
+CANCELLED_STATUSES = frozenset().union(*COMPENSATED_STATUSES.values())
+
+# GMO PG ErrInfo codes meaning no trade exists for the OrderID
+ORDER_NOT_FOUND_ERROR_INFOS = {'E01110002'}
+
+# Error code recorded on transactions the job marks failed
+RECONCILED_ERROR_CODE = 'RECONCILED'
+
+# Columns read per stale row; the written ones must be loaded for bulk_update
+_ROW_FIELDS = (
+    'transaction_id', 'created_at', 'status', 'amount', 'currency', 'gmo_order_id',
+    'gmo_access_id', 'gmo_access_pass', 'error_code', 'error_message',
+)
+_WRITTEN_FIELDS = ['status', 'gmo_access_id', 'gmo_access_pass', 'error_code', 'error_message', 'updated_at']
+
+
+def _is_order_not_found(response: Dict) -> bool:
+    """True if SearchTrade failed because GMO PG has no trade for the order ID"""
+    error_info = response.get('error_info') or ''
+    return any(info in ORDER_NOT_FOUND_ERROR_INFOS for info in error_info.split('|'))
+
+
+class ReconciliationEngine:
+    """
+    Settle stale 'processing' transactions with the state GMO PG has for them
+
+    Args:
+        client: GMO client shared by the worker threads (a new GMOClient by default)
+        workers: Number of concurrent SearchTrade calls
+        chunk_size: Transactions fetched, looked up and bulk-updated per batch
+        stale_minutes: Only transactions created at least this long ago are
+            reconciled (default RECONCILE_STALE_MINUTES), so checkouts still in
+            flight are left alone
+        limit: Stop after this many transactions (None for all); the checkpoint
+            is kept, so the next run continues after them
+        dry_run: Count stale transactions without looking them up
+        restart: Ignore the saved checkpoint and start from the oldest row
+    """
+
+    def __init__(
+        self,
+        client: Optional[GMOClient] = None,
+        workers: int = 16,
+        chunk_size: int = 500,
+        stale_minutes: Optional[float] = None,
+        limit: Optional[int] = None,
+        dry_run: bool = False,
+        restart: bool = False,
+    ):
+        self.client = client or GMOClient()
+        self.workers = workers
+        self.chunk_size = chunk_size
+        if stale_minutes is None:
+            stale_minutes = getattr(settings, 'RECONCILE_STALE_MINUTES', 15)
+        self.cutoff = timezone.now() - timedelta(minutes=stale_minutes)
+        self.limit = limit
+        self.dry_run = dry_run
+        self.restart = restart
+
+    def stale(self):
+        """Stale 'processing' transactions in cursor order (served by txn_status_created_idx)"""
+        return Transaction.objects.filter(
+            status='processing',
+            created_at__lt=self.cutoff,
+        ).order_by('created_at', 'transaction_id')
+
+    def load_cursor(self) -> Optional[Tuple[datetime, uuid.UUID]]:
+        """(created_at, transaction_id) of the last reconciled chunk's last row, if a run was interrupted"""
+        checkpoint = JobCheckpoint.objects.filter(name=CHECKPOINT_NAME).first()
+        if checkpoint is None or not checkpoint.position:
+            return None
+        position = checkpoint.position
+        return datetime.fromisoformat(position['created_at']), uuid.UUID(position['transaction_id'])
+
+    def save_cursor(self, cursor: Tuple[datetime, uuid.UUID]) -> None:
+        JobCheckpoint.objects.update_or_create(
+            name=CHECKPOINT_NAME,
+            defaults={'position': {'created_at': cursor[0].isoformat(), 'transaction_id': str(cursor[1])}},
+        )
+
+    def clear_cursor(self) -> None:
+        JobCheckpoint.objects.filter(name=CHECKPOINT_NAME).delete()
+
+    def chunks(self, cursor: Optional[Tuple[datetime, uuid.UUID]] = None) -> Iterator[List[Transaction]]:
+        """
+        Yield stale transactions in keyset-paginated chunks, starting after cursor
+
+        Each page is one indexed range query; no OFFSET and no row is held
+        once its chunk has been processed.
+        """
+        queryset = self.stale().only(*_ROW_FIELDS)
+        remaining = self.limit
+        while remaining is None or remaining > 0:
+            page = queryset
+            if cursor is not None:
+                page = page.filter(
+                    Q(created_at__gt=cursor[0])
+                    | Q(created_at=cursor[0], transaction_id__gt=cursor[1])
+                )
+            size = self.chunk_size if remaining is None else min(self.chunk_size, remaining)
+            chunk = list(page[:size])
+            if not chunk:
+                return
+            cursor = (chunk[-1].created_at, chunk[-1].transaction_id)
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    def resolve(self, row: Transaction) -> Tuple[str, Dict]:
+        """
+        Look one transaction up at GMO PG
+
+        Returns:
+            Tuple of (outcome, fields) where outcome is 'completed', 'cancelled',
+            'failed' or 'unresolved', and fields are the columns to write (the
+            SearchTrade error for 'unresolved')
+        """
+        if not row.gmo_order_id:
+            # The order ID is written before the first gateway call
+            return 'failed', {
+                'error_code': RECONCILED_ERROR_CODE,
+                'error_message': 'Checkout stopped before reaching GMO PG',
+            }
+
+        found, trade = self.client.search_trade(row.gmo_order_id)
+        if not found:
+            if _is_order_not_found(trade):
+                return 'failed', {
+                    'error_code': RECONCILED_ERROR_CODE,
+                    'error_message': 'Order not found at GMO PG',
+                }
+            return 'unresolved', trade
+
+        fields = {
+            'gmo_access_id': trade.get('AccessID') or row.gmo_access_id,
+            'gmo_access_pass': trade.get('AccessPass') or row.gmo_access_pass,
+        }
+        trade_status = trade.get('Status')
+        if trade_status in CHARGED_STATUSES:
+            return 'completed', fields
+        if trade_status in CANCELLED_STATUSES:
+            return 'cancelled', fields
+        if trade_status in UNCHARGED_STATUSES:
+            return 'failed', {
+                **fields,
+                'error_code': RECONCILED_ERROR_CODE,
+                'error_message': f'Order was never executed at GMO PG (Status {trade_status})',
+            }
+        return 'unresolved', {'error_code': 'UNKNOWN_STATUS', 'error_info': trade_status}
+
+    def _apply(self, resolved: List[Tuple[Transaction, str]]) -> List[Tuple[Transaction, str]]:
+        """
+        Write final states in one bulk update, skipping rows finalized meanwhile
+
+        Returns:
+            The (transaction, outcome) pairs that were written
+        """
+        if not resolved:
+            return []
+        now = timezone.now()
+        with db_transaction.atomic():
+            still_processing = Transaction.objects.filter(
+                pk__in=[row.pk for row, _ in resolved], status='processing',
+            )
+            if connection.features.has_select_for_update:
+                still_processing = still_processing.select_for_update()
+            current = set(still_processing.values_list('pk', flat=True))
+            written = [(row, outcome) for row, outcome in resolved if row.pk in current]
+            for row, outcome in written:
+                row.status = outcome
+                row.updated_at = now
+            Transaction.objects.bulk_update([row for row, _ in written], _WRITTEN_FIELDS)
+            delta = RollupDelta()
+            for row, _ in written:
+                delta.add_payment(row)
+            delta.apply()
+        for _, outcome in written:
+            payment_outcomes.inc('onetime', outcome)
+        return written
+
+    def run(self) -> Dict:
+        """
+        Reconcile all stale 'processing' transactions
+
+        Returns:
+            dict with 'selected', 'completed', 'cancelled', 'failed',
+            'unresolved', 'skipped' (finalized by their request meanwhile),
+            'elapsed_seconds' and 'lookups_per_second'
+        """
+        stats = {'selected': 0, 'completed': 0, 'cancelled': 0, 'failed': 0, 'unresolved': 0, 'skipped': 0}
+        started = time.monotonic()
+
+        if self.dry_run:
+            stats['selected'] = self.stale().count()
+            return stats
+
+        if self.restart:
+            self.clear_cursor()
+        cursor = self.load_cursor()
+        if cursor is not None:
+            logger.info("Resuming reconciliation after %s (%s)", cursor[1], cursor[0].isoformat())
+
+        finished = True
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='reconcile') as executor:
+            for chunk in self.chunks(cursor):
+                stats['selected'] += len(chunk)
+                resolved = []
+                for row, (outcome, fields) in zip(chunk, executor.map(self.resolve, chunk)):
+                    if outcome == 'unresolved':
+                        stats['unresolved'] += 1
+                        logger.warning(
+                            "Could not reconcile transaction %s (%s): %s - %s",
+                            row.transaction_id, row.gmo_order_id,
+                            fields.get('error_code'), fields.get('error_info') or fields.get('error'),
+                        )
+                        continue
+                    for name, value in fields.items():
+                        setattr(row, name, value)
+                    resolved.append((row, outcome))
+
+                written = self._apply(resolved)
+                for _, outcome in written:
+                    stats[outcome] += 1
+                stats['skipped'] += len(resolved) - len(written)
+
+                # Checkpoint: a restarted run continues after this chunk
+                self.save_cursor((chunk[-1].created_at, chunk[-1].transaction_id))
+                # With DEBUG on, don't keep every chunk's SQL for the whole run
+                reset_queries()
+
+                elapsed = time.monotonic() - started
+                logger.info(
+                    "Reconciliation progress: %s selected, %s completed, %s cancelled, %s failed, "
+                    "%s unresolved (%.1f lookups/sec)",
+                    stats['selected'], stats['completed'], stats['cancelled'], stats['failed'],
+                    stats['unresolved'], stats['selected'] / elapsed if elapsed else 0.0,
+                )
+                if self.limit is not None and stats['selected'] >= self.limit:
+                    finished = False
+
+        if finished:
+            # Reached the end: the next run starts over from the oldest stale row
+            self.clear_cursor()
+
+        elapsed = time.monotonic() - started
+        stats['elapsed_seconds'] = round(elapsed, 3)
+        stats['lookups_per_second'] = round(stats['selected'] / elapsed, 1) if elapsed else 0.0
+        return stats
@@ -0,0 +1,203 @@
+"""
+Retry policy for GMO PG calls
+
+A failed call is retried only when repeating it cannot apply the operation
+twice:
+
+- The request never reached GMO PG (CONNECT_ERROR / CONNECT_TIMEOUT) or GMO PG
+  answered that it is busy (E92): every operation is retried.
+- The outcome is unknown (TIMEOUT / CONNECTION_ERROR / HTTP 5xx after the
+  request was sent):
+    * read-style and naturally idempotent operations (SaveMember,
+      SearchTrade) are retried;
+    * order operations (EntryTranBrandtoken, ExecTranBrandtoken, ExecTran)
+      are reconciled first: the order is looked up with SearchTrade by
+      OrderID. If it shows the operation applied, its state is returned as
+      the result; if not, the call is retried;
+    * anything else (SaveCard, AlterTran) is not retried.
+
+Retries use exponential backoff with full jitter, at most GMO_RETRY_MAX_ATTEMPTS
+attempts, and every attempt (and backoff) must fit in the GMO_RETRY_DEADLINE
+budget of the call. Per-endpoint counters are kept in `retry_stats` (and exported
+as gmo_retry_events_total).
+"""
+from collections import Counter
+from typing import Dict, Optional, Tuple
+import random
+import threading
+from django.conf import settings
+from .metrics import gmo_retry_events
+
+SEARCH_TRADE = 'SearchTrade.idPass'
+
+# Actions decided after a failed attempt
+STOP = 'stop'
+RETRY = 'retry'
+RECONCILE = 'reconcile'
+
+# The request never reached GMO PG
+NOT_SENT_CODES = frozenset({'CONNECT_ERROR', 'CONNECT_TIMEOUT'})
+# The request may or may not have been applied
+AMBIGUOUS_CODES = frozenset({'TIMEOUT', 'CONNECTION_ERROR'})
+# GMO PG ErrCode meaning "busy, nothing was processed, try again"
+BUSY_ERR_CODE = 'E92'
+
+# ErrInfo values the retry logic recognises
+DUPLICATE_ORDER_INFO = 'E01040010'
+DUPLICATE_MEMBER_INFO = 'E01390010'
+TRADE_NOT_FOUND_INFO = 'E01110002'
+
+RETRY_SAFE_OPERATIONS = frozenset({'SaveMember.idPass', SEARCH_TRADE})
+
+# Order operations reconciled through SearchTrade, with the trade statuses
+# showing that the operation was applied (None: the order existing is enough)
+RECONCILED_OPERATIONS = {
+    'EntryTranBrandtoken.idPass': None,
+    'ExecTranBrandtoken.idPass': frozenset({'CAPTURE', 'AUTH', 'SALES'}),
+    'ExecTran.idPass': frozenset({'CAPTURE', 'AUTH', 'SALES'}),
+}
+# Trade statuses showing an Exec has not been applied yet
+UNEXECUTED_STATUSES = frozenset({'UNPROCESSED', 'AUTHENTICATED'})
+
+
+def _is_ambiguous(code: str) -> bool:
+    return code in AMBIGUOUS_CODES or code.startswith('HTTP_5')
+
+
+class RetryPolicy:
+    """
+    Which failed GMO PG calls to retry, and when
+
+    Args:
+        max_attempts: Attempts per call, including the first
+        base_delay: Backoff before the first retry is drawn from [0, base_delay]
+        max_delay: Cap on the backoff window (doubles per retry up to this)
+        deadline: Seconds the whole call (attempts and backoff) may take
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.05,
+        max_delay: float = 1.0,
+        deadline: float = 30.0,
+        rng: Optional[random.Random] = None,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self._rng = rng or random.Random()
+
+    @classmethod
+    def from_settings(cls) -> 'RetryPolicy':
+        return cls(
+            max_attempts=getattr(settings, 'GMO_RETRY_MAX_ATTEMPTS', 3),
+            base_delay=getattr(settings, 'GMO_RETRY_BASE_DELAY', 0.05),
+            max_delay=getattr(settings, 'GMO_RETRY_MAX_DELAY', 1.0),
+            deadline=getattr(settings, 'GMO_RETRY_DEADLINE', 30.0),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter delay before attempt number `attempt + 1`"""
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def action(self, endpoint: str, error: Dict, retried: bool) -> str:
+        """
+        Decide what to do after a failed attempt
+
+        Args:
+            endpoint: API endpoint name
+            error: Error dict of the failed attempt
+            retried: Whether an earlier attempt of this call already failed
+
+        Returns:
+            STOP, RETRY or RECONCILE
+        """
+        code = error.get('error_code') or ''
+        # error_code joins several ErrCodes with '|'; error_codes holds them split
+        if code in NOT_SENT_CODES or BUSY_ERR_CODE in error.get('error_codes', code.split('|')):
+            return RETRY
+        if _is_ambiguous(code):
+            if endpoint in RETRY_SAFE_OPERATIONS:
+                return RETRY
+            if endpoint in RECONCILED_OPERATIONS:
+                return RECONCILE
+            return STOP
+        if retried and endpoint in RECONCILED_OPERATIONS and DUPLICATE_ORDER_INFO in error.get('error_infos', ()):
+            # An earlier attempt created the order after all
+            return RECONCILE
+        return STOP
+
+
+def already_applied(endpoint: str, error: Dict, data: Dict) -> Optional[Dict]:
+    """
+    Result to return when a retry failed only because an earlier attempt succeeded
+
+    SaveMember answers "member exists" when the first attempt's response was lost.
+    """
+    if endpoint == 'SaveMember.idPass' and DUPLICATE_MEMBER_INFO in error.get('error_infos', ()):
+        return {'MemberID': data.get('MemberID', '')}
+    return None
+
+
+def reconcile(endpoint: str, found: bool, trade: Dict) -> Tuple[str, Optional[Dict]]:
+    """
+    Interpret a SearchTrade lookup made after an ambiguous failure
+
+    Args:
+        endpoint: The operation whose outcome is unknown
+        found: SearchTrade success flag
+        trade: SearchTrade response (or error dict)
+
+    Returns:
+        (STOP, None) if the outcome is still unknown or the order is in an
+        unexpected state, (RETRY, None) if the operation was not applied, or
+        (RECONCILE, result) with the result to return as the call's response
+    """
+    if not found:
+        if TRADE_NOT_FOUND_INFO in trade.get('error_infos', ()):
+            # No order yet: nothing was applied
+            return RETRY, None
+        return STOP, None
+
+    applied_statuses = RECONCILED_OPERATIONS[endpoint]
+    if applied_statuses is None:
+        return RECONCILE, {'AccessID': trade.get('AccessID', ''), 'AccessPass': trade.get('AccessPass', '')}
+    status = trade.get('Status')
+    if status in applied_statuses:
+        return RECONCILE, trade
+    if status in UNEXECUTED_STATUSES:
+        return RETRY, None
+    return STOP, None
+
+
+class RetryStats:
+    """Thread-safe per-endpoint counters of calls, attempts and retry outcomes"""
+
+    EVENTS = ('calls', 'attempts', 'retries', 'reconciliations', 'recovered', 'failed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def add(self, endpoint: str, event: str, count: int = 1):
+        with self._lock:
+            self._counts[endpoint, event] += count
+        gmo_retry_events.inc(endpoint, event, amount=count)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """{endpoint: {event: count}}"""
+        with self._lock:
+            counts = dict(self._counts)
+        result: Dict[str, Dict[str, int]] = {}
+        for (endpoint, event), count in counts.items():
+            result.setdefault(endpoint, dict.fromkeys(self.EVENTS, 0))[event] = count
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+retry_stats = RetryStats()
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .apple_pay_token import ApplePayToken, InvalidTokenError
 from .models import Transaction, Subscription
 
 
@@ -47,15 +48,13 @@ class OneTimePaymentRequestSerializer(serializers.Serializer):
         return value.upper()
     
     def validate_token(self, value):
-        """Basic token validation"""
+        """Parse the token once; views and GMOClient use the ApplePayToken"""
         if not value or len(value) < 10:
             raise serializers.ValidationError("Invalid payment token format.")
         try:
-            import json
-            json.loads(value)  # Validate JSON format
-        except (json.JSONDecodeError, TypeError):
+            return ApplePayToken.parse(value)
+        except InvalidTokenError:
             raise serializers.ValidationError("Payment token must be valid JSON.")
-        return value
 
 
 class RecurringPaymentSetupSerializer(serializers.Serializer):
@@ -91,15 +90,13 @@ class RecurringPaymentSetupSerializer(serializers.Serializer):
         return value.lower()
     
     def validate_token(self, value):
-        """Basic token validation"""
+        """Parse the token once; views and GMOClient use the ApplePayToken"""
         if not value or len(value) < 10:
             raise serializers.ValidationError("Invalid payment token format.")
         try:
-            import json
-            json.loads(value)  # Validate JSON format
-        except (json.JSONDecodeError, TypeError):
+            return ApplePayToken.parse(value)
+        except InvalidTokenError:
             raise serializers.ValidationError("Payment token must be valid JSON.")
-        return value
 
 
 class RecurringPaymentChargeSerializer(serializers.Serializer):
@@ -1,15 +1,75 @@
+import asyncio
+import httpx
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from typing import Dict, Optional, Tuple
+from typing import Dict, Optional, Tuple, Union
 import logging
 import json
 import os
-from requests.exceptions import RequestException, Timeout, ConnectionError, HTTPError
+import time
+from requests.exceptions import ConnectTimeout, RequestException, Timeout, ConnectionError, HTTPError
+from urllib3.exceptions import NewConnectionError
 from pathlib import Path
+from .apple_pay_token import ApplePayToken, InvalidTokenError, dumps
+from .circuit_breaker import get_circuit, is_transport_failure
+from .gmo_response import GMO_DEFAULT_CHARSET, charset_from_content_type, decode_response
+from .metrics import apple_validation_duration, apple_validations_coalesced, gmo_request_duration, observe_gateway_call
+from .retry import RECONCILE, RETRY, SEARCH_TRADE, RetryPolicy, already_applied, reconcile, retry_stats
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .tracing import current_span, span
+from .transport import get_apple_session, get_async_gmo_client, get_gmo_session
 
 logger = logging.getLogger(__name__)
 
 
+# Returned (error_code CIRCUIT_OPEN) while an endpoint's circuit breaker is open
+GATEWAY_UNAVAILABLE_MESSAGE = 'Payment gateway temporarily unavailable'
+
+# Lower bound (seconds) for the read timeout of an attempt near the retry deadline
+MIN_ATTEMPT_TIMEOUT = 0.5
+
+# Circuit breaker name for Apple merchant validation (GMO circuits use the endpoint name)
+APPLE_VALIDATION_CIRCUIT = 'apple-merchant-validation'
+
+# In-flight merchant validations, keyed on (validation URL, initiativeContext)
+_validation_flight = SingleFlight()
+_async_validation_flight = AsyncSingleFlight()
+
+INVALID_TOKEN_ERROR = {
+    'error': 'Invalid payment token format',
+    'error_code': 'INVALID_TOKEN_FORMAT'
+}
+
+
+def _connection_refused(error: ConnectionError) -> bool:
+    """True if a requests ConnectionError happened before the request was sent"""
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def prepare_brand_token(token) -> Optional[str]:
+    """
+    Validate an Apple Pay token and return it for the Token request field
+
+    Args:
+        token: Apple Pay payment token (ApplePayToken, JSON string or already-decoded object)
+
+    Returns:
+        JSON string to send to GMO PG, or None if the token is not valid JSON
+    """
+    if isinstance(token, ApplePayToken):
+        # Parsed by the request serializer: forward the original string
+        return token.raw
+    try:
+        if isinstance(token, str):
+            return ApplePayToken.parse(token).raw
+        return dumps(token)
+    except (InvalidTokenError, TypeError) as e:
+        logger.error("Invalid token format: %s", e)
+        return None
+
+
 class GMOClient:
     """Client for interacting with GMO Payment Gateway API"""
     
@@ -20,21 +80,16 @@ class GMOClient:
         # API endpoints like EntryTranBrandtoken.idPass are appended
         self.api_endpoint = settings.GMO_API_ENDPOINT.rstrip('/')
         
-    def _make_request(self, method: str, endpoint: str, data: Dict) -> Tuple[bool, Dict]:
+    def _prepare_request(self, endpoint: str, data: Dict) -> Tuple[str, Optional[Dict]]:
         """
-        Make HTTP request to GMO PG API with comprehensive error handling
-        
+        Build the request URL and add authentication to the request data
+
         Args:
-            method: HTTP method (typically POST)
             endpoint: API endpoint name (e.g., 'EntryTranBrandtoken.idPass')
-            data: Request data dictionary
-        
+            data: Request data dictionary (ShopID/ShopPass are added in place)
+
         Returns:
-            Tuple of (success: bool, response_data: dict)
-        
-        Note:
-            Shop ID and Shop Pass are required for API authentication.
-            They are automatically added to the request data.
+            Tuple of (url, error_dict or None if the request can be sent)
         """
         # GMO PG API format: base_url/endpoint.idPass
         # Example: https://pt01.mul-pay.jp/EntryTranBrandtoken.idPass
@@ -43,77 +98,205 @@ class GMOClient:
         # Validate credentials
         if not self.shop_id or not self.shop_pass:
             logger.error("GMO PG credentials not configured")
-            return False, {'error': 'Payment gateway credentials not configured', 'error_code': 'CONFIG_ERROR'}
+            return url, {'error': 'Payment gateway credentials not configured', 'error_code': 'CONFIG_ERROR'}
         
         # Add authentication
         data['ShopID'] = self.shop_id
         data['ShopPass'] = self.shop_pass
+        return url, None
+
+    def _parse_response(self, endpoint: str, body: bytes, charset: str = GMO_DEFAULT_CHARSET) -> Tuple[bool, Dict]:
+        """
+        Parse a GMO PG response body and decide success or failure
+
+        Args:
+            endpoint: API endpoint name, for logging
+            body: Raw response body
+            charset: Response charset (from the Content-Type header)
+
+        Returns:
+            Tuple of (success: bool, response_data: dict)
+        """
+        result = decode_response(body, charset)
+
+        # Check for errors - GMO PG uses various error indicators
+        if result.is_error:
+            error_code = result.error_code or 'UNKNOWN_ERROR'
+            error_info = result.error_info or result.get('ErrorMessage') or 'Unknown error from payment gateway'
+            logger.error(
+                "GMO PG API Error: %s - %s | Full response: %s", error_code, error_info, result.fields,
+                extra={'endpoint': endpoint, 'error_code': error_code, 'error_info': error_info},
+            )
+            return False, {
+                'error_code': error_code,
+                'error_info': error_info,
+                'error_codes': result.error_codes,
+                'error_infos': result.error_infos,
+                'full_response': result.fields
+            }
+
+        # Success indicators
+        if result.is_success:
+            logger.info("GMO PG API Success: %s", endpoint, extra={'endpoint': endpoint})
+            return True, result.fields
+
+        # No clear success/error indicators and no error codes: assume success
+        logger.warning("GMO PG API ambiguous response: %s", result.fields)
+        return True, result.fields
+
+    def _make_request(self, method: str, endpoint: str, data: Dict) -> Tuple[bool, Dict]:
+        """
+        Make HTTP request to GMO PG API with comprehensive error handling
+        
+        Args:
+            method: HTTP method (typically POST)
+            endpoint: API endpoint name (e.g., 'EntryTranBrandtoken.idPass')
+            data: Request data dictionary
         
+        Returns:
+            Tuple of (success: bool, response_data: dict)
+        
+        Note:
+            Shop ID and Shop Pass are required for API authentication.
+            They are automatically added to the request data.
+            While the endpoint's circuit breaker is open the call is not
+            made and error_code is CIRCUIT_OPEN.
+            The call (all attempts) is recorded in gmo_request_duration_seconds
+            and traced as a gmo.request span.
+        """
+        started = time.perf_counter()
+        with span('gmo.request', endpoint=endpoint) as trace_span:
+            success, result = self._call_with_retries(endpoint, data)
+            if not success:
+                trace_span.set(error_code=result.get('error_code'))
+        observe_gateway_call(gmo_request_duration, started, success, result, endpoint)
+        return success, result
+
+    def _call_with_retries(self, endpoint: str, data: Dict) -> Tuple[bool, Dict]:
+        """Attempts of one call, retried and reconciled according to the RetryPolicy"""
+        url, error = self._prepare_request(endpoint, data)
+        if error:
+            return False, error
+
+        policy = RetryPolicy.from_settings()
+        deadline = time.monotonic() + policy.deadline
+        retry_stats.add(endpoint, 'calls')
+        attempt = 1
+        while True:
+            success, result = self._attempt(url, endpoint, data, deadline)
+            if success:
+                return True, self._recovered(endpoint, result, attempt)
+            applied = already_applied(endpoint, result, data) if attempt > 1 else None
+            if applied is not None:
+                return True, self._recovered(endpoint, applied, attempt)
+
+            action = policy.action(endpoint, result, retried=attempt > 1)
+            if action == RECONCILE:
+                retry_stats.add(endpoint, 'reconciliations')
+                action, reconciled = reconcile(endpoint, *self._lookup_trade(data['OrderID'], deadline))
+                if reconciled is not None:
+                    return True, self._recovered(endpoint, reconciled, attempt, reconciled=True)
+
+            delay = self._retry_delay(policy, endpoint, action, attempt, deadline, result)
+            if delay is None:
+                return False, result
+            time.sleep(delay)
+            attempt += 1
+
+    def _attempt(self, url: str, endpoint: str, data: Dict, deadline: float) -> Tuple[bool, Dict]:
+        """One call through the endpoint's circuit breaker, with its read timeout capped by the deadline"""
+        circuit = get_circuit(endpoint)
+        if not circuit.allow():
+            logger.warning("GMO PG circuit open, not calling %s", endpoint)
+            return False, circuit.open_error(GATEWAY_UNAVAILABLE_MESSAGE)
+        retry_stats.add(endpoint, 'attempts')
+        started = time.monotonic()
+        connect_timeout, read_timeout = circuit.timeouts.timeout()
+        timeout = (connect_timeout, max(MIN_ATTEMPT_TIMEOUT, min(read_timeout, deadline - started)))
+        success, result = self._send(url, endpoint, data, timeout)
+        circuit.record(time.monotonic() - started, failed=not success and is_transport_failure(result))
+        return success, result
+
+    def _lookup_trade(self, order_id: str, deadline: float) -> Tuple[bool, Dict]:
+        """Single SearchTrade attempt used to reconcile an ambiguous failure"""
+        data = {'OrderID': order_id}
+        url, error = self._prepare_request(SEARCH_TRADE, data)
+        if error:
+            return False, error
+        return self._attempt(url, SEARCH_TRADE, data, deadline)
+
+    @staticmethod
+    def _recovered(endpoint: str, result: Dict, attempt: int, reconciled: bool = False) -> Dict:
+        if attempt > 1 or reconciled:
+            retry_stats.add(endpoint, 'recovered')
+            logger.warning(
+                "GMO PG %s succeeded after %s attempt(s)%s",
+                endpoint, attempt, ' (reconciled with SearchTrade)' if reconciled else '',
+            )
+        return result
+
+    @staticmethod
+    def _retry_delay(
+        policy: RetryPolicy,
+        endpoint: str,
+        action: str,
+        attempt: int,
+        deadline: float,
+        error: Dict,
+    ) -> Optional[float]:
+        """Backoff before the next attempt, or None to give up with `error`"""
+        delay = policy.backoff(attempt)
+        if action != RETRY or attempt >= policy.max_attempts or time.monotonic() + delay >= deadline:
+            retry_stats.add(endpoint, 'failed')
+            return None
+        retry_stats.add(endpoint, 'retries')
+        logger.warning(
+            "Retrying GMO PG %s in %.0f ms (attempt %s/%s): %s",
+            endpoint, delay * 1000, attempt + 1, policy.max_attempts, error.get('error_code'),
+        )
+        return delay
+
+    def _send(self, url: str, endpoint: str, data: Dict, timeout: Tuple[float, float]) -> Tuple[bool, Dict]:
+        """POST to GMO PG with (connect, read) timeouts and parse the response"""
         try:
-            response = requests.post(
+            # Shared keep-alive session: reuses pooled connections to GMO PG
+            response = get_gmo_session().post(
                 url,
                 data=data,
-                timeout=30,
-                headers={'User-Agent': 'Django-ApplePay-POC/1.0'}
+                timeout=timeout,
             )
+            current_span().set(response_size=len(response.content))
             response.raise_for_status()
+            return self._parse_response(
+                endpoint,
+                response.content,
+                charset_from_content_type(response.headers.get('Content-Type')),
+            )
             
-            # GMO PG returns form-encoded data (key=value format, one per line)
-            result = {}
-            if response.text:
-                for line in response.text.strip().split('\n'):
-                    line = line.strip()
-                    if '=' in line:
-                        try:
-                            key, value = line.split('=', 1)
-                            result[key.strip()] = value.strip()
-                        except ValueError:
-                            logger.warning(f"Failed to parse line: {line}")
-                            continue
-            
-            # Check for errors - GMO PG uses various error indicators
-            error_code = result.get('ErrCode') or result.get('ErrorCode') or result.get('error_code')
-            error_info = result.get('ErrInfo') or result.get('ErrorInfo') or result.get('error_info')
-            
-            if error_code or error_info or result.get('Status') == 'FAILURE':
-                error_code = error_code or 'UNKNOWN_ERROR'
-                error_info = error_info or result.get('ErrorMessage') or 'Unknown error from payment gateway'
-                logger.error(f"GMO PG API Error: {error_code} - {error_info} | Full response: {result}")
-                return False, {
-                    'error_code': error_code,
-                    'error_info': error_info,
-                    'full_response': result
-                }
-            
-            # Success indicators
-            if 'AccessID' in result or 'CardID' in result or result.get('Status') in ['CAPTURE', 'AUTH', 'SUCCESS']:
-                logger.info(f"GMO PG API Success: {endpoint}")
-                return True, result
-            
-            # If no clear success/error indicators, assume success if no error codes
-            if not error_code:
-                logger.warning(f"GMO PG API ambiguous response: {result}")
-                return True, result
-            
-            return False, {'error_code': error_code, 'error_info': error_info, 'full_response': result}
-            
+        except ConnectTimeout:
+            logger.error("GMO PG API connect timeout: %s", url)
+            return False, {'error': 'Payment gateway connection timeout', 'error_code': 'CONNECT_TIMEOUT'}
         except Timeout:
-            logger.error(f"GMO PG API timeout: {url}")
+            logger.error("GMO PG API timeout: %s", url)
             return False, {'error': 'Payment gateway request timeout', 'error_code': 'TIMEOUT'}
         except ConnectionError as e:
-            logger.error(f"GMO PG API connection error: {str(e)}")
-            return False, {'error': 'Payment gateway connection failed', 'error_code': 'CONNECTION_ERROR'}
+            logger.error("GMO PG API connection error: %s", e)
+            return False, {
+                'error': 'Payment gateway connection failed',
+                # Refused/unresolvable: the request was never sent
+                'error_code': 'CONNECT_ERROR' if _connection_refused(e) else 'CONNECTION_ERROR',
+            }
         except HTTPError as e:
-            logger.error(f"GMO PG API HTTP error: {e.response.status_code} - {str(e)}")
+            logger.error("GMO PG API HTTP error: %s - %s", e.response.status_code, e)
             return False, {
                 'error': f'Payment gateway HTTP error: {e.response.status_code}',
                 'error_code': f'HTTP_{e.response.status_code}'
             }
         except RequestException as e:
-            logger.error(f"GMO PG API Request failed: {str(e)}")
+            logger.error("GMO PG API Request failed: %s", e)
             return False, {'error': f'Payment gateway request failed: {str(e)}', 'error_code': 'REQUEST_ERROR'}
         except Exception as e:
-            logger.exception(f"Unexpected error in GMO PG API call: {str(e)}")
+            logger.exception("Unexpected error in GMO PG API call: %s", e)
             return False, {'error': f'Unexpected error: {str(e)}', 'error_code': 'UNEXPECTED_ERROR'}
     
     def entry_tran_brandtoken(
@@ -146,7 +329,7 @@ class GMOClient:
         access_id: str,
         access_pass: str,
         order_id: str,
-        token: str
+        token: Union[ApplePayToken, str]
     ) -> Tuple[bool, Dict]:
         """
         Execute Apple Pay transaction using payment token
@@ -155,27 +338,14 @@ class GMOClient:
             access_id: Access ID from EntryTranBrandtoken
             access_pass: Access Pass from EntryTranBrandtoken
             order_id: Order ID
-            token: Apple Pay payment token (JSON string from frontend)
+            token: Apple Pay payment token (ApplePayToken or JSON string from frontend)
         
         Returns:
             Tuple of (success: bool, response_data with transaction status)
         """
-        # Validate token format
-        try:
-            if isinstance(token, str):
-                # Token should be JSON string, parse to validate
-                token_data = json.loads(token)
-                # GMO PG expects the token in specific format
-                # Some implementations may need the token as-is or in specific format
-                token_str = json.dumps(token_data)  # Re-serialize for consistency
-            else:
-                token_str = json.dumps(token)
-        except (json.JSONDecodeError, TypeError) as e:
-            logger.error(f"Invalid token format: {str(e)}")
-            return False, {
-                'error': 'Invalid payment token format',
-                'error_code': 'INVALID_TOKEN_FORMAT'
-            }
+        token_str = prepare_brand_token(token)
+        if token_str is None:
+            return False, dict(INVALID_TOKEN_ERROR)
         
         data = {
             'AccessID': access_id,
@@ -211,7 +381,7 @@ class GMOClient:
     def save_card(
         self,
         member_id: str,
-        token: str,
+        token: Union[ApplePayToken, str],
         seq_mode: str = '0'
     ) -> Tuple[bool, Dict]:
         """
@@ -219,15 +389,19 @@ class GMOClient:
         
         Args:
             member_id: Member ID from SaveMember
-            token: Apple Pay payment token
+            token: Apple Pay payment token (ApplePayToken or JSON string)
             seq_mode: Sequence mode (0: one-time, 1: recurring)
         
         Returns:
             Tuple of (success: bool, response_data with CardID)
         """
+        token_str = prepare_brand_token(token)
+        if token_str is None:
+            return False, dict(INVALID_TOKEN_ERROR)
+
         data = {
             'MemberID': member_id,
-            'Token': token,
+            'Token': token_str,
             'SeqMode': seq_mode,
         }
         
@@ -293,8 +467,336 @@ class GMOClient:
 
         return self._make_request('POST', 'AlterTran.idPass', data)
 
+    def search_trade(self, order_id: str) -> Tuple[bool, Dict]:
+        """
+        Look up a transaction by order ID
+
+        Args:
+            order_id: Order ID used for EntryTran/ExecTran
+
+        Returns:
+            Tuple of (success: bool, response_data with Status, AccessID, AccessPass, Amount, ...)
+        """
+        data = {
+            'OrderID': order_id,
+        }
+
+        return self._make_request('POST', SEARCH_TRADE, data)
+
+
+class AsyncGMOClient(GMOClient):
+    """
+    asyncio client for the GMO Payment Gateway API
+
+    Mirrors the GMOClient operations as coroutines on a pooled httpx
+    AsyncClient, so an ASGI worker can keep many gateway calls in flight
+    without holding a thread per call. Request building and response parsing
+    are shared with GMOClient.
+    """
+
+    async def _make_request(self, method: str, endpoint: str, data: Dict) -> Tuple[bool, Dict]:
+        """
+        Make HTTP request to GMO PG API without blocking the event loop
+
+        Returns the same (success, response_data) shapes and error codes as
+        GMOClient._make_request.
+        """
+        started = time.perf_counter()
+        with span('gmo.request', endpoint=endpoint) as trace_span:
+            success, result = await self._call_with_retries(endpoint, data)
+            if not success:
+                trace_span.set(error_code=result.get('error_code'))
+        observe_gateway_call(gmo_request_duration, started, success, result, endpoint)
+        return success, result
+
+    async def _call_with_retries(self, endpoint: str, data: Dict) -> Tuple[bool, Dict]:
+        """Async version of GMOClient._call_with_retries"""
+        url, error = self._prepare_request(endpoint, data)
+        if error:
+            return False, error
+
+        policy = RetryPolicy.from_settings()
+        deadline = time.monotonic() + policy.deadline
+        retry_stats.add(endpoint, 'calls')
+        attempt = 1
+        while True:
+            success, result = await self._attempt(url, endpoint, data, deadline)
+            if success:
+                return True, self._recovered(endpoint, result, attempt)
+            applied = already_applied(endpoint, result, data) if attempt > 1 else None
+            if applied is not None:
+                return True, self._recovered(endpoint, applied, attempt)
+
+            action = policy.action(endpoint, result, retried=attempt > 1)
+            if action == RECONCILE:
+                retry_stats.add(endpoint, 'reconciliations')
+                action, reconciled = reconcile(endpoint, *await self._lookup_trade(data['OrderID'], deadline))
+                if reconciled is not None:
+                    return True, self._recovered(endpoint, reconciled, attempt, reconciled=True)
+
+            delay = self._retry_delay(policy, endpoint, action, attempt, deadline, result)
+            if delay is None:
+                return False, result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _attempt(self, url: str, endpoint: str, data: Dict, deadline: float) -> Tuple[bool, Dict]:
+        """Async version of GMOClient._attempt"""
+        circuit = get_circuit(endpoint)
+        if not circuit.allow():
+            logger.warning("GMO PG circuit open, not calling %s", endpoint)
+            return False, circuit.open_error(GATEWAY_UNAVAILABLE_MESSAGE)
+        retry_stats.add(endpoint, 'attempts')
+        started = time.monotonic()
+        connect_timeout, read_timeout = circuit.timeouts.timeout()
+        timeout = (connect_timeout, max(MIN_ATTEMPT_TIMEOUT, min(read_timeout, deadline - started)))
+        success, result = await self._send(url, endpoint, data, timeout)
+        circuit.record(time.monotonic() - started, failed=not success and is_transport_failure(result))
+        return success, result
+
+    async def _lookup_trade(self, order_id: str, deadline: float) -> Tuple[bool, Dict]:
+        """Async version of GMOClient._lookup_trade"""
+        data = {'OrderID': order_id}
+        url, error = self._prepare_request(SEARCH_TRADE, data)
+        if error:
+            return False, error
+        return await self._attempt(url, SEARCH_TRADE, data, deadline)
+
+    async def _send(self, url: str, endpoint: str, data: Dict, timeout: Tuple[float, float]) -> Tuple[bool, Dict]:
+        """Async version of GMOClient._send"""
+        connect_timeout, read_timeout = timeout
+        try:
+            response = await get_async_gmo_client().post(
+                url,
+                data=data,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+            current_span().set(response_size=len(response.content))
+            response.raise_for_status()
+            return self._parse_response(
+                endpoint,
+                response.content,
+                charset_from_content_type(response.headers.get('Content-Type')),
+            )
+
+        except httpx.ConnectTimeout:
+            logger.error("GMO PG API connect timeout: %s", url)
+            return False, {'error': 'Payment gateway connection timeout', 'error_code': 'CONNECT_TIMEOUT'}
+        except httpx.TimeoutException:
+            logger.error("GMO PG API timeout: %s", url)
+            return False, {'error': 'Payment gateway request timeout', 'error_code': 'TIMEOUT'}
+        except httpx.ConnectError as e:
+            logger.error("GMO PG API connection error: %s", e)
+            return False, {'error': 'Payment gateway connection failed', 'error_code': 'CONNECT_ERROR'}
+        except httpx.TransportError as e:
+            logger.error("GMO PG API connection error: %s", e)
+            return False, {'error': 'Payment gateway connection failed', 'error_code': 'CONNECTION_ERROR'}
+        except httpx.HTTPStatusError as e:
+            logger.error("GMO PG API HTTP error: %s - %s", e.response.status_code, e)
+            return False, {
+                'error': f'Payment gateway HTTP error: {e.response.status_code}',
+                'error_code': f'HTTP_{e.response.status_code}'
+            }
+        except httpx.HTTPError as e:
+            logger.error("GMO PG API Request failed: %s", e)
+            return False, {'error': f'Payment gateway request failed: {str(e)}', 'error_code': 'REQUEST_ERROR'}
+        except Exception as e:
+            logger.exception("Unexpected error in GMO PG API call: %s", e)
+            return False, {'error': f'Unexpected error: {str(e)}', 'error_code': 'UNEXPECTED_ERROR'}
+
+    async def entry_tran_brandtoken(
+        self,
+        order_id: str,
+        amount: int,
+        currency: str = 'JPY'
+    ) -> Tuple[bool, Dict]:
+        """Async version of GMOClient.entry_tran_brandtoken"""
+        data = {
+            'OrderID': order_id,
+            'Amount': str(amount),
+            'Currency': currency,
+        }
+
+        return await self._make_request('POST', 'EntryTranBrandtoken.idPass', data)
+
+    async def exec_tran_brandtoken(
+        self,
+        access_id: str,
+        access_pass: str,
+        order_id: str,
+        token: Union[ApplePayToken, str]
+    ) -> Tuple[bool, Dict]:
+        """Async version of GMOClient.exec_tran_brandtoken"""
+        token_str = prepare_brand_token(token)
+        if token_str is None:
+            return False, dict(INVALID_TOKEN_ERROR)
+
+        data = {
+            'AccessID': access_id,
+            'AccessPass': access_pass,
+            'OrderID': order_id,
+            'Token': token_str,
+        }
+
+        return await self._make_request('POST', 'ExecTranBrandtoken.idPass', data)
+
+    async def save_member(
+        self,
+        member_id: str,
+        member_name: str = ''
+    ) -> Tuple[bool, Dict]:
+        """Async version of GMOClient.save_member"""
+        data = {
+            'MemberID': member_id,
+            'MemberName': member_name,
+        }
+
+        return await self._make_request('POST', 'SaveMember.idPass', data)
+
+    async def save_card(
+        self,
+        member_id: str,
+        token: Union[ApplePayToken, str],
+        seq_mode: str = '0'
+    ) -> Tuple[bool, Dict]:
+        """Async version of GMOClient.save_card"""
+        token_str = prepare_brand_token(token)
+        if token_str is None:
+            return False, dict(INVALID_TOKEN_ERROR)
+
+        data = {
+            'MemberID': member_id,
+            'Token': token_str,
+            'SeqMode': seq_mode,
+        }
+
+        return await self._make_request('POST', 'SaveCard.idPass', data)
+
+    async def exec_tran_recurring(
+        self,
+        order_id: str,
+        member_id: str,
+        card_id: str,
+        amount: int,
+        currency: str = 'JPY'
+    ) -> Tuple[bool, Dict]:
+        """Async version of GMOClient.exec_tran_recurring"""
+        data = {
+            'OrderID': order_id,
+            'MemberID': member_id,
+            'CardID': card_id,
+            'Amount': str(amount),
+            'Currency': currency,
+        }
+
+        return await self._make_request('POST', 'ExecTran.idPass', data)
+
+    async def alter_tran(
+        self,
+        access_id: str,
+        access_pass: str,
+        job_cd: str = 'VOID'
+    ) -> Tuple[bool, Dict]:
+        """Async version of GMOClient.alter_tran"""
+        data = {
+            'AccessID': access_id,
+            'AccessPass': access_pass,
+            'JobCd': job_cd,
+        }
+
+        return await self._make_request('POST', 'AlterTran.idPass', data)
+
+    async def search_trade(self, order_id: str) -> Tuple[bool, Dict]:
+        """Async version of GMOClient.search_trade"""
+        data = {
+            'OrderID': order_id,
+        }
+
+        return await self._make_request('POST', SEARCH_TRADE, data)
+
 
 def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
+    """
+    Validate merchant session with Apple's servers (see _validate_merchant_with_apple)
+
+    Concurrent validations of the same validation URL and initiativeContext
+    (a reloaded checkout page, several open tabs) share one call to Apple
+    and its result.
+
+    Calls go through the 'apple-merchant-validation' circuit breaker; while it
+    is open this returns error_code VALIDATION_CIRCUIT_OPEN without calling Apple.
+    """
+    with span('apple.validate_merchant') as trace_span:
+        (success, result), shared = _coalesced_call_apple(validation_url)
+        if shared:
+            trace_span.set(coalesced=True)
+            apple_validations_coalesced.inc()
+            result = dict(result)
+        if not success:
+            trace_span.set(error_code=result.get('error_code'))
+    return success, result
+
+
+async def avalidate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
+    """
+    Async version of validate_merchant_with_apple
+
+    Concurrent coroutines validating the same URL share one call; it runs on a
+    worker thread, where it also joins validations made by sync views.
+    """
+    with span('apple.validate_merchant') as trace_span:
+        ((success, result), joined_thread), shared = await _async_validation_flight.do(
+            _validation_key(validation_url),
+            lambda: sync_to_async(_coalesced_call_apple, thread_sensitive=False)(validation_url),
+        )
+        if shared or joined_thread:
+            trace_span.set(coalesced=True)
+            apple_validations_coalesced.inc()
+            result = dict(result)
+        if not success:
+            trace_span.set(error_code=result.get('error_code'))
+    return success, result
+
+
+def _coalesced_call_apple(validation_url: str) -> Tuple[Tuple[bool, Dict], bool]:
+    """_call_apple() shared with concurrent threads validating the same URL; returns (result, shared)"""
+    return _validation_flight.do(_validation_key(validation_url), lambda: _call_apple(validation_url))
+
+
+def _call_apple(validation_url: str) -> Tuple[bool, Dict]:
+    """One merchant validation through the circuit breaker"""
+    circuit = get_circuit(APPLE_VALIDATION_CIRCUIT, service='APPLE')
+    if not circuit.allow():
+        logger.warning("Apple merchant validation circuit open, not calling Apple")
+        return False, circuit.open_error('Apple validation temporarily unavailable', prefix='VALIDATION_')
+    started = time.perf_counter()
+    success, result = _validate_merchant_with_apple(validation_url, circuit.timeouts.timeout())
+    circuit.record(
+        time.perf_counter() - started,
+        failed=not success and is_transport_failure(result, prefix='VALIDATION_'),
+    )
+    observe_gateway_call(apple_validation_duration, started, success, result)
+    return success, result
+
+
+def _initiative_context(validation_url: str) -> Optional[str]:
+    """initiativeContext (the merchant domain) from the validation URL's query, if present"""
+    import re
+    from urllib.parse import urlparse, parse_qs
+
+    query_params = parse_qs(urlparse(validation_url).query)
+    if 'initiativeContext' in query_params:
+        return query_params['initiativeContext'][0]
+    # Fallback: try regex extraction
+    domain_match = re.search(r'initiativeContext=([^&]+)', validation_url)
+    return domain_match.group(1) if domain_match else None
+
+
+def _validation_key(validation_url: str) -> Tuple[str, str]:
+    return validation_url, _initiative_context(validation_url) or 'localhost'
+
+
+def _validate_merchant_with_apple(validation_url: str, timeout: Tuple[float, float]) -> Tuple[bool, Dict]:
     """
     Validate merchant session with Apple's servers using Merchant Identity Certificate.
     
@@ -303,6 +805,7 @@ def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
     
     Args:
         validation_url: The validation URL provided by Apple Pay in the onvalidatemerchant event
+        timeout: (connect, read) timeouts in seconds
         
     Returns:
         Tuple of (success: bool, merchant_session_dict or error_dict)
@@ -326,14 +829,14 @@ def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
     key_file = Path(key_path)
     
     if not cert_file.exists():
-        logger.error(f"Merchant Identity Certificate not found: {cert_path}")
+        logger.error("Merchant Identity Certificate not found: %s", cert_path)
         return False, {
             'error': f'Merchant Identity Certificate file not found: {cert_path}',
             'error_code': 'CERT_FILE_NOT_FOUND'
         }
     
     if not key_file.exists():
-        logger.error(f"Merchant Identity Key not found: {key_path}")
+        logger.error("Merchant Identity Key not found: %s", key_path)
         return False, {
             'error': f'Merchant Identity Key file not found: {key_path}',
             'error_code': 'KEY_FILE_NOT_FOUND'
@@ -353,9 +856,9 @@ def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
                 'error_code': 'MERCHANT_ID_NOT_CONFIGURED'
             }
         
-        logger.info(f"Validating merchant with Apple: {validation_url}")
-        logger.info(f"Using Merchant ID: {merchant_id}")
-        logger.info(f"Certificate: {cert_file}, Key: {key_file}")
+        logger.info("Validating merchant with Apple: %s", validation_url)
+        logger.debug("Using Merchant ID: %s", merchant_id)
+        logger.debug("Certificate: %s, Key: %s", cert_file, key_file)
         
         # Apple Pay merchant validation format (per Apple's official documentation 2023-2024):
         # POST to validation_url with:
@@ -367,21 +870,7 @@ def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
         #    - initiativeContext: Fully qualified domain name
         
         # Extract domain from validation URL or use request domain
-        import re
-        from urllib.parse import urlparse, parse_qs
-        
-        # Try to extract domain from validation URL query parameters
-        parsed_url = urlparse(validation_url)
-        query_params = parse_qs(parsed_url.query)
-        request_domain = None
-        
-        if 'initiativeContext' in query_params:
-            request_domain = query_params['initiativeContext'][0]
-        else:
-            # Fallback: try regex extraction
-            domain_match = re.search(r'initiativeContext=([^&]+)', validation_url)
-            if domain_match:
-                request_domain = domain_match.group(1)
+        request_domain = _initiative_context(validation_url)
         
         # If still no domain, use a default (for localhost testing)
         if not request_domain:
@@ -396,27 +885,27 @@ def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
             'initiativeContext': request_domain,  # Fully qualified domain name
         }
         
-        logger.info(f"Request domain/initiativeContext: {request_domain}")
-        logger.debug(f"Request body: {request_body}")
+        logger.info("Request domain/initiativeContext: %s", request_domain)
+        logger.debug("Request body: %s", request_body)
         
         # Attempt validation with SSL verification first
         # Per Apple's official documentation, the request MUST include the JSON body
         try:
-            response = requests.post(
+            # Long-lived mTLS session: the client certificate is loaded into its
+            # SSL context once and connections to Apple are kept alive
+            response = get_apple_session(str(cert_file), str(key_file)).post(
                 validation_url,
                 json=request_body,  # REQUIRED: JSON body with merchantIdentifier, displayName, initiative, initiativeContext
-                cert=(str(cert_file), str(key_file)),  # REQUIRED: Client certificate authentication
-                timeout=15,  # Increased timeout for Apple's servers
+                timeout=timeout,
                 headers={
                     'Content-Type': 'application/json',
-                    'User-Agent': 'Django-ApplePay-POC/1.0',
                     'Accept': 'application/json'
                 },
                 verify=True,  # Verify Apple's SSL certificate
             )
             response.raise_for_status()
         except requests.exceptions.SSLError as ssl_error:
-            logger.error(f"SSL error during merchant validation: {str(ssl_error)}")
+            logger.error("SSL error during merchant validation: %s", ssl_error)
             # Try with verify=False for debugging (NOT recommended for production)
             logger.warning("Retrying with SSL verification disabled (for debugging only)")
             try:
@@ -424,7 +913,7 @@ def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
                     validation_url,
                     json=request_body,  # Include request body in retry
                     cert=(str(cert_file), str(key_file)),
-                    timeout=15,
+                    timeout=timeout,
                     headers={
                         'Content-Type': 'application/json',
                         'User-Agent': 'Django-ApplePay-POC/1.0',
@@ -434,7 +923,7 @@ def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
                 )
                 response.raise_for_status()
             except Exception as retry_error:
-                logger.error(f"Retry also failed: {str(retry_error)}")
+                logger.error("Retry also failed: %s", retry_error)
                 raise
         except Exception as e:
             # Re-raise other exceptions to be handled by outer try-except
@@ -444,42 +933,42 @@ def validate_merchant_with_apple(validation_url: str) -> Tuple[bool, Dict]:
         merchant_session = response.json()
         
         logger.info("Merchant validation successful with Apple")
-        logger.debug(f"Merchant session received: {merchant_session}")
+        logger.debug("Merchant session received: %s", merchant_session)
         return True, merchant_session
         
     except Timeout:
-        logger.error(f"Apple merchant validation timeout: {validation_url}")
+        logger.error("Apple merchant validation timeout: %s", validation_url)
         return False, {
             'error': 'Apple validation request timeout',
             'error_code': 'VALIDATION_TIMEOUT'
         }
     except ConnectionError as e:
-        logger.error(f"Apple merchant validation connection error: {str(e)}")
+        logger.error("Apple merchant validation connection error: %s", e)
         return False, {
             'error': 'Failed to connect to Apple validation servers',
             'error_code': 'VALIDATION_CONNECTION_ERROR'
         }
     except HTTPError as e:
-        logger.error(f"Apple merchant validation HTTP error: {e.response.status_code} - {e.response.text}")
+        logger.error("Apple merchant validation HTTP error: %s - %s", e.response.status_code, e.response.text)
         return False, {
             'error': f'Apple validation failed: HTTP {e.response.status_code}',
             'error_code': f'VALIDATION_HTTP_{e.response.status_code}',
             'response': e.response.text
         }
     except requests.exceptions.RequestException as e:
-        logger.error(f"Apple merchant validation request error: {str(e)}")
+        logger.error("Apple merchant validation request error: %s", e)
         return False, {
             'error': f'Apple validation request failed: {str(e)}',
             'error_code': 'VALIDATION_REQUEST_ERROR'
         }
     except json.JSONDecodeError as e:
-        logger.error(f"Apple merchant validation JSON decode error: {str(e)}")
+        logger.error("Apple merchant validation JSON decode error: %s", e)
         return False, {
             'error': 'Invalid response from Apple validation servers',
             'error_code': 'VALIDATION_JSON_ERROR'
         }
     except Exception as e:
-        logger.exception(f"Unexpected error in Apple merchant validation: {str(e)}")
+        logger.exception("Unexpected error in Apple merchant validation: %s", e)
         return False, {
             'error': f'Unexpected validation error: {str(e)}',
             'error_code': 'VALIDATION_UNEXPECTED_ERROR'
@@ -0,0 +1,108 @@
+"""
+In-flight call coalescing
+
+SingleFlight makes concurrent callers asking for the same key share one
+execution: the first caller runs the function, later callers block until it
+finishes and receive the same result (or exception).
+
+AsyncSingleFlight does the same for coroutines of one event loop.
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+import asyncio
+import threading
+import weakref
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key across threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn once for all concurrent callers using the same key
+
+        Returns:
+            Tuple of (result, shared) where shared is True for callers that
+            waited on another caller's execution
+
+        Raises:
+            Whatever fn raised, to every caller of that execution
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        """Number of keys currently executing"""
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    Coalesce concurrent awaits with the same key within an event loop
+
+    The shared execution runs as its own task, so a caller that is cancelled
+    (e.g. the client disconnected) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        # event loop -> {key: task}; a loop only touches its own dict, from its own thread
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Task]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Await fn() once for all concurrent callers using the same key
+
+        Returns:
+            Tuple of (result, shared), as SingleFlight.do
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._calls.setdefault(loop, {})
+        task = calls.get(key)
+        shared = task is not None
+        if not shared:
+            task = loop.create_task(fn())
+            calls[key] = task
+            task.add_done_callback(lambda done: calls.pop(key, None) if calls.get(key) is done else None)
+        return await asyncio.shield(task), shared
+
+    def in_flight(self) -> int:
+        """Number of keys currently executing in the running event loop"""
+        return len(self._calls.get(asyncio.get_running_loop(), ()))
@@ -1,3 +1,1786 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib.util
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from requests.exceptions import Timeout
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.views import View
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from .apple_pay_token import ApplePayToken
+from .billing import BillingEngine
+from .cache import TieredCache
+from . import config_validator
+from .config_validator import CERT_EXPIRY_WARNING_DAYS, ConfigValidator
+from .compensation import CompensationWorker, enqueue_compensation, queue_stats
+from .exports import ExportStream, export_filters
+from .circuit_breaker import AdaptiveTimeout, CircuitBreaker, get_circuit, reset_circuits
+from .reconciliation import ReconciliationEngine
+from .rollups import RollupDelta, backfill, summary
+from .retry import RECONCILE, RETRY, STOP, RetryPolicy, retry_stats
+from .log import BackgroundHandler, JSONFormatter, Lazy, SampleFilter
+from .metrics import REGISTRY, Counter, Histogram, Registry
+from .gmo_response import charset_from_content_type, decode_response
+from .gmo_simulator import GMOSimulator
+from .idempotency import MemoryIdempotencyStore, idempotent, reset_idempotency_store
+from .management.commands.bench_gmo_parser import legacy_parse
+from .models import CompensationTask, JobCheckpoint, PaymentRollup, Subscription, Transaction
+from .serializers import OneTimePaymentRequestSerializer
+from .services import AsyncGMOClient, GMOClient, avalidate_merchant_with_apple, validate_merchant_with_apple
+from .tracing import InMemoryExporter, finish_trace, get_exporter, reset_exporter, span, start_trace
+from .transport import (
+    get_apple_session, get_async_gmo_client, gmo_transport_stats, reset_apple_session, reset_gmo_session,
+)
 
-# Create your tests here.
+TOKEN = json.dumps({'paymentData': {'data': 'abc', 'version': 'EC_v1'}, 'paymentMethod': {'network': 'Visa'}})
+
+GMO_SETTINGS = {
+    'GMO_SHOP_ID': 'tshop00000001',
+    'GMO_SHOP_PASS': 'secret',
+    'GMO_API_ENDPOINT': 'https://pt01.mul-pay.jp',
+}
+
+
+@override_settings(**GMO_SETTINGS)
+class OneTimePaymentWritePlanTests(TestCase):
+    """OneTimePaymentView writes one INSERT, one narrow UPDATE and one rollup upsert per checkout"""
+
+    def setUp(self):
+        self.url = reverse('onetime-process')
+        self.payload = {'token': TOKEN, 'amount': '1000', 'currency': 'JPY'}
+
+    def post(self):
+        return self.client.post(self.url, self.payload, content_type='application/json')
+
+    @mock.patch.object(GMOClient, 'exec_tran_brandtoken', return_value=(True, {'Status': 'CAPTURE'}))
+    @mock.patch.object(GMOClient, 'entry_tran_brandtoken', return_value=(True, {'AccessID': 'aid', 'AccessPass': 'apass'}))
+    def test_successful_checkout_uses_three_queries(self, entry, execute):
+        with self.assertNumQueries(3):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 200)
+        transaction = Transaction.objects.get()
+        self.assertEqual(transaction.status, 'completed')
+        self.assertEqual(transaction.gmo_order_id, f"ORDER_{transaction.transaction_id}")
+        self.assertEqual(transaction.gmo_access_id, 'aid')
+        self.assertEqual(transaction.gmo_access_pass, 'apass')
+
+    @mock.patch.object(GMOClient, 'entry_tran_brandtoken', return_value=(False, {'error_code': 'E01', 'error_info': 'E01010001'}))
+    def test_entry_failure_uses_three_queries(self, entry):
+        with self.assertNumQueries(3):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 400)
+        transaction = Transaction.objects.get()
+        self.assertEqual(transaction.status, 'failed')
+        self.assertEqual(transaction.error_code, 'E01')
+
+    @mock.patch.object(GMOClient, 'alter_tran')
+    @mock.patch.object(GMOClient, 'exec_tran_brandtoken', return_value=(False, {'error_code': 'G02', 'error_info': 'G02000000'}))
+    @mock.patch.object(GMOClient, 'entry_tran_brandtoken', return_value=(True, {'AccessID': 'aid', 'AccessPass': 'apass'}))
+    def test_exec_failure_queues_void_without_calling_gateway(self, entry, execute, alter):
+        # INSERT, then the final UPDATE, rollup upsert and task INSERT in one savepoint
+        with self.assertNumQueries(6):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['rollback'], 'queued')
+        alter.assert_not_called()
+        transaction = Transaction.objects.get()
+        self.assertEqual(transaction.status, 'failed')
+        self.assertEqual(transaction.error_code, 'G02')
+        self.assertEqual(transaction.gmo_access_id, 'aid')
+        task = CompensationTask.objects.get()
+        self.assertEqual((task.transaction, task.action, task.status), (transaction, 'void', 'pending'))
+        self.assertEqual((task.gmo_access_id, task.gmo_access_pass), ('aid', 'apass'))
+
+    @override_settings(GMO_SHOP_ID='')
+    def test_missing_config_uses_two_queries(self):
+        with self.assertNumQueries(2):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 503)
+        transaction = Transaction.objects.get()
+        self.assertEqual(transaction.status, 'failed')
+        self.assertEqual(transaction.error_code, 'CONFIG_ERROR')
+
+
+APPLE_CONFIG_VALID = {'valid': True, 'errors': [], 'warnings': []}
+
+
+@override_settings(**GMO_SETTINGS)
+@mock.patch.object(ConfigValidator, 'validate_apple_pay_config', return_value=APPLE_CONFIG_VALID)
+class RecurringSetupPipelineTests(TestCase):
+    """RecurringPaymentSetupView writes once per state change and overlaps SaveMember with the INSERT"""
+
+    def setUp(self):
+        self.url = reverse('recurring-setup')
+        self.payload = {'token': TOKEN, 'amount': '1000', 'currency': 'JPY', 'billing_cycle': 'monthly'}
+
+    def post(self):
+        return self.client.post(self.url, self.payload, content_type='application/json')
+
+    @mock.patch.object(GMOClient, 'exec_tran_recurring', return_value=(True, {'Status': 'CAPTURE'}))
+    @mock.patch.object(GMOClient, 'save_card', return_value=(True, {'CardID': '0'}))
+    @mock.patch.object(GMOClient, 'save_member')
+    def test_successful_setup_uses_two_queries(self, save_member, save_card, charge, apple_config):
+        threads = []
+        save_member.side_effect = lambda **kwargs: threads.append(threading.current_thread().name) or (True, {})
+
+        with self.assertNumQueries(2):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(threads[0].startswith('pipeline'))
+        subscription = Subscription.objects.get()
+        self.assertEqual((subscription.status, subscription.card_id), ('active', '0'))
+        self.assertEqual(subscription.member_id, f"MEMBER_{subscription.subscription_id}")
+        self.assertIsNotNone(subscription.last_billing_date)
+        stages = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        self.assertEqual(sorted(stages), sorted(['config', 'member', 'db_insert', 'card', 'charge', 'db_final', 'total']))
+
+    @mock.patch.object(GMOClient, 'save_card', return_value=(False, {'error_code': 'E01', 'error_info': 'E01240002'}))
+    @mock.patch.object(GMOClient, 'save_member', return_value=(True, {}))
+    def test_card_failure_uses_two_queries(self, save_member, save_card, apple_config):
+        with self.assertNumQueries(2):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 400)
+        subscription = Subscription.objects.get()
+        self.assertEqual(subscription.status, 'cancelled')
+        self.assertEqual(subscription.member_id, f"MEMBER_{subscription.subscription_id}")
+
+    @override_settings(GMO_SHOP_ID='')
+    def test_missing_config_uses_one_query(self, apple_config):
+        with self.assertNumQueries(1):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(Subscription.objects.get().status, 'cancelled')
+
+
+@override_settings(**GMO_SETTINGS)
+class IdempotencyKeyTests(TestCase):
+    """Payment POSTs with a repeated Idempotency-Key replay the first response"""
+
+    def setUp(self):
+        reset_idempotency_store()
+        self.url = reverse('onetime-process')
+        self.payload = {'token': TOKEN, 'amount': '1000', 'currency': 'JPY'}
+
+    def tearDown(self):
+        reset_idempotency_store()
+
+    def post(self, key, payload=None):
+        return self.client.post(
+            self.url, payload or self.payload, content_type='application/json',
+            headers={'Idempotency-Key': key},
+        )
+
+    @mock.patch.object(GMOClient, 'exec_tran_brandtoken', return_value=(True, {'Status': 'CAPTURE'}))
+    @mock.patch.object(GMOClient, 'entry_tran_brandtoken', return_value=(True, {'AccessID': 'aid', 'AccessPass': 'apass'}))
+    def test_retry_replays_stored_response_without_gateway_call(self, entry, execute):
+        first = self.post('key-1')
+        with self.assertNumQueries(0):
+            second = self.post('key-1')
+
+        self.assertEqual(second.status_code, first.status_code)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(entry.call_count, 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    @mock.patch.object(GMOClient, 'exec_tran_brandtoken', return_value=(True, {'Status': 'CAPTURE'}))
+    @mock.patch.object(GMOClient, 'entry_tran_brandtoken', return_value=(True, {'AccessID': 'aid', 'AccessPass': 'apass'}))
+    def test_key_reused_with_different_body_is_rejected(self, entry, execute):
+        self.post('key-2')
+        response = self.post('key-2', {**self.payload, 'amount': '2000'})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['error_code'], 'IDEMPOTENCY_KEY_REUSED')
+        self.assertEqual(entry.call_count, 1)
+
+    @mock.patch.object(AsyncGMOClient, 'exec_tran_brandtoken', new_callable=mock.AsyncMock, return_value=(True, {'Status': 'CAPTURE'}))
+    @mock.patch.object(AsyncGMOClient, 'entry_tran_brandtoken', new_callable=mock.AsyncMock,
+                       return_value=(True, {'AccessID': 'aid', 'AccessPass': 'apass'}))
+    def test_async_view_replays_stored_response(self, entry, execute):
+        self.url = reverse('async-onetime-process')
+        first = self.post('key-4')
+        second = self.post('key-4')
+        reused = self.post('key-4', {**self.payload, 'amount': '2000'})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((second.status_code, second.json()), (200, first.json()))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(reused.status_code, 422)
+        self.assertEqual(entry.await_count, 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_async_concurrent_duplicates_share_one_execution(self):
+        calls = []
+
+        class SlowView(View):
+            @idempotent
+            async def post(self, request):
+                calls.append(1)
+                await asyncio.sleep(0.1)
+                return JsonResponse({'charged': len(calls)})
+
+        view = SlowView.as_view()
+        factory = RequestFactory()
+
+        async def call():
+            request = factory.post('/slow/', {'amount': 1}, content_type='application/json', HTTP_IDEMPOTENCY_KEY='key-5')
+            return await view(request)
+
+        async def burst():
+            return await asyncio.gather(*[call() for _ in range(5)])
+
+        responses = asyncio.run(burst())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([json.loads(response.content) for response in responses], [{'charged': 1}] * 5)
+        self.assertEqual(sum(response.has_header('Idempotent-Replayed') for response in responses), 4)
+
+    def test_concurrent_duplicates_share_one_execution(self):
+        calls = []
+
+        class SlowView(APIView):
+            @idempotent
+            def post(self, request):
+                calls.append(1)
+                time.sleep(0.2)
+                return Response({'charged': len(calls)})
+
+        view = SlowView.as_view()
+        factory = APIRequestFactory()
+        responses = []
+
+        def call():
+            request = factory.post('/slow/', {'amount': 1}, format='json', HTTP_IDEMPOTENCY_KEY='key-3')
+            responses.append(view(request))
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([response.data for response in responses], [{'charged': 1}] * 5)
+
+
+    @override_settings(IDEMPOTENCY_LOCK_SECONDS=30)
+    def test_waiter_runs_handler_when_holder_fails(self):
+        calls, holding = [], threading.Event()
+
+        class FlakyView(APIView):
+            @idempotent
+            def post(self, request):
+                calls.append(1)
+                if len(calls) == 1:
+                    holding.set()
+                    time.sleep(0.2)
+                    return Response({'error': 'gateway down'}, status=503)
+                return Response({'charged': len(calls)})
+
+        view = FlakyView.as_view()
+        factory = APIRequestFactory()
+        responses = {}
+
+        def call(name):
+            request = factory.post('/flaky/', {'amount': 1}, format='json', HTTP_IDEMPOTENCY_KEY='key-6')
+            responses[name] = view(request)
+
+        # Separate single-flights stand in for two worker processes sharing the store
+        with mock.patch('payments.idempotency._flight', mock.Mock(do=lambda key, fn: (fn(), False))):
+            holder = threading.Thread(target=call, args=('holder',))
+            holder.start()
+            holding.wait(5)
+            started = time.monotonic()
+            call('waiter')
+            holder.join()
+
+        self.assertEqual(responses['holder'].status_code, 503)
+        self.assertEqual((responses['waiter'].status_code, responses['waiter'].data), (200, {'charged': 2}))
+        self.assertLess(time.monotonic() - started, 5)
+
+    @override_settings(IDEMPOTENCY_LOCK_SECONDS=30)
+    def test_async_waiter_runs_handler_when_holder_fails(self):
+        calls = []
+
+        class FlakyView(View):
+            @idempotent
+            async def post(self, request):
+                calls.append(1)
+                if len(calls) == 1:
+                    await asyncio.sleep(0.2)
+                    return JsonResponse({'error': 'gateway down'}, status=503)
+                return JsonResponse({'charged': len(calls)})
+
+        view = FlakyView.as_view()
+        factory = RequestFactory()
+
+        async def call():
+            request = factory.post('/flaky/', {'amount': 1}, content_type='application/json', HTTP_IDEMPOTENCY_KEY='key-7')
+            return await view(request)
+
+        async def holder_then_waiter():
+            holder = asyncio.ensure_future(call())
+            await asyncio.sleep(0.05)
+            return await asyncio.gather(holder, call())
+
+        async def without_coalescing(key, fn):
+            return await fn(), False
+
+        with mock.patch('payments.idempotency._aflight', mock.Mock(do=without_coalescing)):
+            started = time.monotonic()
+            holder, waiter = asyncio.run(holder_then_waiter())
+
+        self.assertEqual(holder.status_code, 503)
+        self.assertEqual((waiter.status_code, json.loads(waiter.content)), (200, {'charged': 2}))
+        self.assertLess(time.monotonic() - started, 5)
+
+class MemoryIdempotencyStoreTests(TestCase):
+
+    def test_lru_eviction_and_ttl(self):
+        store = MemoryIdempotencyStore(max_entries=2, ttl=60)
+        store.set('a', {'n': 1})
+        store.set('b', {'n': 2})
+        store.get('a')
+        store.set('c', {'n': 3})
+
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), {'n': 1})
+
+        expired = MemoryIdempotencyStore(ttl=0)
+        expired.set('a', {'n': 1})
+        self.assertIsNone(expired.get('a'))
+
+
+SHARED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-tests'},
+}
+
+
+class TieredCacheTests(TestCase):
+    """Local and shared tiers, TTLs, single-flight recomputation and counters"""
+
+    def setUp(self):
+        REGISTRY.reset()
+
+    def lookups(self, name):
+        return {labels[1]: value for (metric, labels), value in REGISTRY.snapshot().items()
+                if metric == 'payments_cache_requests_total' and labels[0] == name}
+
+    def test_concurrent_misses_compute_once(self):
+        cache = TieredCache('status', ttl=30)
+        calls, release = [], threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return {'all_valid': True}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'all_valid': True}] * 8)
+        cache.get_or_compute('key', compute)
+        self.assertEqual(self.lookups('status'), {'miss': 1, 'coalesced': 7, 'local_hit': 1})
+
+    def test_value_expires_after_ttl(self):
+        cache = TieredCache('status', ttl=30)
+        with mock.patch('payments.cache.time.monotonic', return_value=100.0):
+            self.assertEqual(cache.get_or_compute('key', lambda: 1, ttl=10), 1)
+        with mock.patch('payments.cache.time.monotonic', return_value=109.0):
+            self.assertEqual(cache.get_or_compute('key', lambda: 2, ttl=10), 1)
+        with mock.patch('payments.cache.time.monotonic', return_value=110.0):
+            self.assertEqual(cache.get_or_compute('key', lambda: 2, ttl=10), 2)
+
+    @override_settings(CACHES=SHARED_CACHES, SHARED_CACHE_ALIAS='shared')
+    def test_workers_share_one_computation(self):
+        # Two instances with the same name stand in for two worker processes
+        worker_a, worker_b = TieredCache('certificate', ttl=60), TieredCache('certificate', ttl=60)
+        compute = mock.Mock(return_value={'subject': 'CN=merchant'})
+        self.addCleanup(worker_a.invalidate, 'cert.pem')
+
+        self.assertEqual(worker_a.get_or_compute('cert.pem', compute), {'subject': 'CN=merchant'})
+        self.assertEqual(worker_b.get_or_compute('cert.pem', compute), {'subject': 'CN=merchant'})
+
+        compute.assert_called_once()
+        self.assertEqual(self.lookups('certificate'), {'miss': 1, 'shared_hit': 1})
+
+    @override_settings(CACHES=SHARED_CACHES, SHARED_CACHE_ALIAS='shared', CACHE_LOCK_SECONDS=2)
+    def test_waits_for_the_worker_holding_the_lock(self):
+        cache = TieredCache('status', ttl=60)
+        shared_key = cache._shared_key('key')
+        self.addCleanup(cache.invalidate, 'key')
+        cache.shared.add(f'{shared_key}:lock', 1, 2)
+        threading.Timer(0.1, cache.shared.set, (shared_key, 'from another worker', 60)).start()
+
+        self.assertEqual(cache.get_or_compute('key', lambda: 'computed here'), 'from another worker')
+
+    @mock.patch.object(ConfigValidator, 'validate_all', wraps=ConfigValidator.validate_all)
+    def test_config_status_polls_share_one_validation(self, validate_all):
+        ConfigValidator.clear_cache()
+        self.addCleanup(ConfigValidator.clear_cache)
+
+        first = self.client.get(reverse('config-status')).json()
+        second = self.client.get(reverse('config-status')).json()
+
+        self.assertEqual(first, second)
+        validate_all.assert_called_once()
+        with override_settings(GMO_SHOP_ID='tshop00000002'):
+            self.client.get(reverse('config-status'))
+        self.assertEqual(validate_all.call_count, 2)
+
+
+def write_merchant_certificate(directory, not_before, not_after):
+    """Write a self-signed certificate and its key to directory, returning (cert_path, key_path)"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'merchant.com.example.test')])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(not_before).not_valid_after(not_after)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, 'merchant_id.pem'), os.path.join(directory, 'merchant_id.key')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+@mock.patch.object(
+    ConfigValidator, '_validate_apple_pay_config_uncached', wraps=ConfigValidator._validate_apple_pay_config_uncached,
+)
+class ApplePayConfigCacheTests(TestCase):
+    """validate_apple_pay_config() is memoized until settings, files or the validity period change"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        now = timezone.now().replace(microsecond=0)
+        self.not_after = now + timedelta(days=40)
+        self.cert_path, self.key_path = write_merchant_certificate(
+            directory.name, now - timedelta(days=1), self.not_after,
+        )
+        overrides = override_settings(
+            APPLE_MERCHANT_ID='merchant.com.example.test',
+            APPLE_MERCHANT_IDENTITY_CERT_PATH=self.cert_path,
+            APPLE_MERCHANT_IDENTITY_KEY_PATH=self.key_path,
+            CONFIG_VALIDATION_RECHECK_SECONDS=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        ConfigValidator.clear_cache()
+        self.addCleanup(ConfigValidator.clear_cache)
+
+    def test_result_is_memoized(self, uncached):
+        first = ConfigValidator.validate_apple_pay_config()
+
+        self.assertTrue(first['valid'], first['errors'])
+        self.assertIs(ConfigValidator.validate_apple_pay_config(), first)
+        uncached.assert_called_once()
+        ConfigValidator.validate_apple_pay_config(use_cache=False)
+        self.assertEqual(uncached.call_count, 2)
+
+    def test_settings_change_revalidates(self, uncached):
+        ConfigValidator.validate_apple_pay_config()
+
+        with override_settings(APPLE_MERCHANT_ID='com.example.test'):
+            result = ConfigValidator.validate_apple_pay_config()
+
+        self.assertEqual(uncached.call_count, 2)
+        self.assertEqual(result['configured']['merchant_id'], 'com.example.test')
+        self.assertTrue(result['warnings'])
+
+    def test_file_change_revalidates(self, uncached):
+        ConfigValidator.validate_apple_pay_config()
+        stat = os.stat(self.cert_path)
+        os.utime(self.cert_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        ConfigValidator.validate_apple_pay_config()
+        self.assertEqual(uncached.call_count, 2)
+
+        os.remove(self.key_path)
+        result = ConfigValidator.validate_apple_pay_config()
+        self.assertEqual(uncached.call_count, 3)
+        self.assertFalse(result['valid'])
+
+    def test_file_signature_rechecked_after_interval(self, uncached):
+        with override_settings(CONFIG_VALIDATION_RECHECK_SECONDS=60):
+            ConfigValidator.validate_apple_pay_config()
+            with mock.patch('payments.config_validator._file_signature') as signature:
+                ConfigValidator.validate_apple_pay_config()
+        signature.assert_not_called()
+        uncached.assert_called_once()
+
+    def test_cache_expires_at_the_warning_window(self, uncached):
+        ConfigValidator.validate_apple_pay_config()
+        warning_starts = (self.not_after - timedelta(days=CERT_EXPIRY_WARNING_DAYS)).timestamp()
+
+        self.assertEqual(config_validator._apple_config_cache['expires_at'], warning_starts)
+        with mock.patch('payments.config_validator.time.time', return_value=warning_starts - 1):
+            ConfigValidator.validate_apple_pay_config()
+        uncached.assert_called_once()
+
+        with mock.patch('payments.config_validator.time.time', return_value=warning_starts):
+            ConfigValidator.validate_apple_pay_config()
+        self.assertEqual(uncached.call_count, 2)
+
+    def test_clear_cache_forces_revalidation(self, uncached):
+        ConfigValidator.validate_apple_pay_config()
+        ConfigValidator.clear_cache()
+
+        ConfigValidator.validate_apple_pay_config()
+        self.assertEqual(uncached.call_count, 2)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite connection settings')
+class SQLiteConnectionSettingsTests(TestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_on_connect(self):
+        self.assertEqual(self.pragma('busy_timeout'), settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('temp_store'), 2)  # MEMORY
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+class GMOSimulatorTests(TestCase):
+    """GMOClient and the payment views against the local GMO PG simulator"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.simulator = GMOSimulator().start()
+        cls.settings_override = override_settings(**{**GMO_SETTINGS, 'GMO_API_ENDPOINT': cls.simulator.url})
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.simulator.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        reset_circuits()
+        retry_stats.reset()
+
+    def checkout(self, client, order_id):
+        success, entry = client.entry_tran_brandtoken(order_id=order_id, amount=1000)
+        self.assertTrue(success, entry)
+        return client.exec_tran_brandtoken(
+            access_id=entry['AccessID'], access_pass=entry['AccessPass'], order_id=order_id, token=TOKEN
+        )
+
+    def failed_checkout(self, order_id):
+        """A charged order whose checkout was recorded as failed (e.g. the response was lost)"""
+        client = GMOClient()
+        success, entry = client.entry_tran_brandtoken(order_id=order_id, amount=1000)
+        self.assertTrue(client.exec_tran_brandtoken(
+            access_id=entry['AccessID'], access_pass=entry['AccessPass'], order_id=order_id, token=TOKEN
+        )[0])
+        return Transaction.objects.create(
+            amount=1000, status='failed', gmo_order_id=order_id,
+            gmo_access_id=entry['AccessID'], gmo_access_pass=entry['AccessPass'],
+        )
+
+    def test_entry_and_exec_round_trip(self):
+        client = GMOClient()
+        success, entry = client.entry_tran_brandtoken(order_id='ORDER_1', amount=1000)
+        self.assertTrue(success)
+        success, result = client.exec_tran_brandtoken(
+            access_id=entry['AccessID'], access_pass=entry['AccessPass'], order_id='ORDER_1', token=TOKEN
+        )
+
+        self.assertTrue(success)
+        self.assertEqual(result['Status'], 'CAPTURE')
+        self.assertEqual(result['OrderID'], 'ORDER_1')
+
+    def test_pool_reuse_is_exposed_as_metrics(self):
+        reset_gmo_session()
+        self.addCleanup(reset_gmo_session)
+        GMOClient().entry_tran_brandtoken(order_id='ORDER_POOL_1', amount=1000)
+        GMOClient().entry_tran_brandtoken(order_id='ORDER_POOL_2', amount=1000)
+
+        stats = gmo_transport_stats()
+        self.assertEqual((stats['requests'], stats['connections_opened'], stats['connections_reused']), (2, 1, 1))
+        host = next(iter(stats['hosts']))
+        exposition = REGISTRY.exposition()
+        self.assertIn(f'payments_http_pool_connections_reused_total{{service="gmo",host="{host}"}} 1', exposition)
+        self.assertIn(f'payments_http_pool_connections_opened_total{{service="gmo",host="{host}"}} 1', exposition)
+
+    def test_async_client_round_trip(self):
+        async def checkout():
+            client = AsyncGMOClient()
+            try:
+                success, entry = await client.entry_tran_brandtoken(order_id='ORDER_ASYNC_1', amount=1000)
+                self.assertTrue(success, entry)
+                executed = await client.exec_tran_brandtoken(
+                    access_id=entry['AccessID'], access_pass=entry['AccessPass'], order_id='ORDER_ASYNC_1', token=TOKEN
+                )
+                duplicate = await client.entry_tran_brandtoken(order_id='ORDER_ASYNC_1', amount=1000)
+                return executed, duplicate
+            finally:
+                await get_async_gmo_client().aclose()
+
+        (success, result), (duplicate_ok, duplicate) = asyncio.run(checkout())
+
+        self.assertTrue(success, result)
+        self.assertEqual((result['Status'], result['OrderID']), ('CAPTURE', 'ORDER_ASYNC_1'))
+        self.assertFalse(duplicate_ok)
+        self.assertEqual(duplicate['error_code'], 'E01')
+
+    def test_async_views_against_simulator(self):
+        on_event_loop = []
+
+        def validate():
+            try:
+                asyncio.get_running_loop()
+                on_event_loop.append(True)
+            except RuntimeError:
+                on_event_loop.append(False)
+            return APPLE_CONFIG_VALID
+
+        payload = {'token': TOKEN, 'amount': '1000', 'currency': 'JPY'}
+        with mock.patch.object(ConfigValidator, 'validate_apple_pay_config', side_effect=validate):
+            checkout = self.client.post(reverse('async-onetime-process'), payload, content_type='application/json')
+            setup = self.client.post(reverse('async-recurring-setup'), {**payload, 'billing_cycle': 'monthly'},
+                                     content_type='application/json')
+
+        self.assertEqual(checkout.status_code, 200, checkout.content)
+        self.assertEqual(Transaction.objects.get().status, 'completed')
+        self.assertEqual(setup.status_code, 200, setup.content)
+        subscription = Subscription.objects.get()
+        self.assertEqual((subscription.status, subscription.card_id), ('active', setup.json()['card_id']))
+        # Certificate checks run on a worker thread, not on the event loop
+        self.assertEqual(on_event_loop, [False])
+
+    def test_recurring_flow_and_duplicate_order(self):
+        client = GMOClient()
+        self.assertTrue(client.save_member(member_id='MEMBER_1')[0])
+        success, card = client.save_card(member_id='MEMBER_1', token=TOKEN, seq_mode='1')
+        self.assertTrue(success)
+
+        charge = dict(order_id='ORDER_R1', member_id='MEMBER_1', card_id=card['CardID'], amount=1000)
+        self.assertTrue(client.exec_tran_recurring(**charge)[0])
+        success, error = client.exec_tran_recurring(**charge)
+
+        self.assertFalse(success)
+        self.assertEqual(error['error_info'], 'E01040010')
+
+    def test_injected_exec_failure_queues_rollback_of_checkout(self):
+        self.simulator.inject('ExecTranBrandtoken.idPass', 'G02', '42G020000')
+        voids = self.simulator.calls['AlterTran.idPass']
+
+        response = self.client.post(
+            reverse('onetime-process'),
+            {'token': TOKEN, 'amount': '1000', 'currency': 'JPY'},
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['rollback'], 'queued')
+        self.assertEqual(self.simulator.calls['AlterTran.idPass'], voids)
+        self.assertEqual(Transaction.objects.get().status, 'failed')
+
+        self.assertEqual(CompensationWorker().run_once(), {'claimed': 1, 'confirmed': 1, 'retrying': 0})
+        self.assertEqual(self.simulator.calls['AlterTran.idPass'], voids + 1)
+        self.assertEqual(Transaction.objects.get().status, 'cancelled')
+        self.assertEqual(CompensationTask.objects.get().status, 'done')
+
+    def test_checkout_and_rollback_are_recorded_in_metrics(self):
+        REGISTRY.reset()
+        payload = {'token': TOKEN, 'amount': '1000', 'currency': 'JPY'}
+        self.assertEqual(self.client.post(reverse('onetime-process'), payload, content_type='application/json').status_code, 200)
+        self.simulator.inject('ExecTranBrandtoken.idPass', 'G02', '42G020000')
+        self.client.post(reverse('onetime-process'), payload, content_type='application/json')
+        CompensationWorker().run_once()
+
+        values = REGISTRY.snapshot()
+        count = lambda name, *labels: values.get((name, labels), [0])[-1]  # noqa: E731
+        self.assertEqual(count('gmo_request_duration_seconds', 'EntryTranBrandtoken.idPass', 'none'), 2)
+        self.assertEqual(count('gmo_request_duration_seconds', 'ExecTranBrandtoken.idPass', 'G02'), 1)
+        self.assertEqual(count('payments_request_duration_seconds', 'onetime-process', '200'), 1)
+        self.assertEqual(count('payments_request_duration_seconds', 'onetime-process', '400'), 1)
+        # Per checkout the transaction and the rollup upsert, plus the compensation task
+        self.assertEqual(count('payments_db_write_duration_seconds', 'onetime-process', 'insert'), 5)
+        for outcome in ('completed', 'failed', 'rolled_back'):
+            self.assertEqual(values[('payments_outcomes_total', ('onetime', outcome))], 1)
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('payments_outcomes_total{flow="onetime",outcome="rolled_back"} 1', body)
+        self.assertIn('payments_compensation_queue_depth 0', body)
+
+    @override_settings(TRACE_EXPORTER='memory', TRACE_SAMPLE_RATE=1.0)
+    @mock.patch.object(ConfigValidator, 'validate_apple_pay_config', return_value=APPLE_CONFIG_VALID)
+    def test_recurring_setup_trace_spans_view_db_and_gateway(self, apple_config):
+        reset_exporter()
+        self.addCleanup(reset_exporter)
+
+        response = self.client.post(
+            reverse('recurring-setup'),
+            {'token': TOKEN, 'amount': '1000', 'currency': 'JPY', 'billing_cycle': 'monthly'},
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        spans = get_exporter().spans
+        root = spans[-1]
+        self.assertEqual((root.name, root.parent_id, root.attributes['status']), ('POST recurring-setup', None, 200))
+        self.assertEqual({s.trace.trace_id for s in spans}, {root.trace.trace_id})
+        children = [s for s in spans if s is not root]
+        self.assertEqual({s.parent_id for s in children}, {root.span_id})
+        gateway = {s.attributes['endpoint']: s for s in children if s.name == 'gmo.request'}
+        # SaveMember ran on a pipeline thread and still joined the request's trace
+        self.assertEqual(set(gateway), {'SaveMember.idPass', 'SaveCard.idPass', 'ExecTran.idPass'})
+        self.assertGreater(gateway['SaveCard.idPass'].attributes['response_size'], 0)
+        self.assertEqual(
+            [(s.name, s.attributes['table']) for s in children if s.name.startswith('db.')],
+            [('db.insert', 'payments_subscription'), ('db.update', 'payments_subscription')],
+        )
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_endpoint_requires_token_when_configured(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    def test_compensation_is_retried_until_confirmed(self):
+        transaction = self.failed_checkout('ORDER_COMP_1')
+        task = enqueue_compensation(transaction)
+        self.simulator.drop('AlterTran.idPass', processed=False)
+        worker = CompensationWorker(base_delay=10, max_delay=60)
+
+        self.assertEqual(worker.run_once(), {'claimed': 1, 'confirmed': 0, 'retrying': 1})
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('pending', 1))
+        self.assertIn('CONNECTION_ERROR', task.last_error)
+        self.assertGreater(task.next_attempt_at, timezone.now())
+        self.assertEqual(worker.run_once()['claimed'], 0)
+        self.assertEqual(queue_stats()['depth'], 1)
+
+        CompensationTask.objects.filter(pk=task.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(worker.run_once()['confirmed'], 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('done', 2))
+        self.assertEqual(Transaction.objects.get().status, 'cancelled')
+        self.assertEqual(queue_stats(), {'depth': 0, 'oldest_age_seconds': 0.0, 'max_attempts': 0})
+
+    def test_compensation_confirmed_by_search_trade(self):
+        transaction = self.failed_checkout('ORDER_COMP_2')
+        client = GMOClient()
+        self.assertTrue(client.alter_tran(transaction.gmo_access_id, transaction.gmo_access_pass)[0])
+        enqueue_compensation(transaction)
+        # The void already happened, so GMO PG rejects the second one
+        self.simulator.inject('AlterTran.idPass', 'E01', 'E01050004')
+
+        self.assertEqual(CompensationWorker().run_once()['confirmed'], 1)
+        self.assertEqual(Transaction.objects.get().status, 'cancelled')
+
+    def test_lost_exec_response_is_reconciled_not_repeated(self):
+        calls = self.simulator.calls['ExecTranBrandtoken.idPass']
+        self.simulator.drop('ExecTranBrandtoken.idPass', processed=True)
+
+        success, result = self.checkout(GMOClient(), 'ORDER_DROP_1')
+
+        self.assertTrue(success)
+        self.assertEqual(result['Status'], 'CAPTURE')
+        self.assertEqual(self.simulator.calls['ExecTranBrandtoken.idPass'], calls + 1)
+        stats = retry_stats.snapshot()['ExecTranBrandtoken.idPass']
+        self.assertEqual((stats['reconciliations'], stats['recovered'], stats['retries']), (1, 1, 0))
+
+    def test_lost_exec_request_is_retried(self):
+        calls = self.simulator.calls['ExecTranBrandtoken.idPass']
+        self.simulator.drop('ExecTranBrandtoken.idPass', processed=False)
+
+        success, result = self.checkout(GMOClient(), 'ORDER_DROP_2')
+
+        self.assertTrue(success)
+        self.assertEqual(result['Status'], 'CAPTURE')
+        self.assertEqual(self.simulator.calls['ExecTranBrandtoken.idPass'], calls + 2)
+        self.assertEqual(retry_stats.snapshot()['ExecTranBrandtoken.idPass']['retries'], 1)
+
+    def test_lost_entry_response_recovers_access_credentials(self):
+        self.simulator.drop('EntryTranBrandtoken.idPass', processed=True)
+
+        success, result = self.checkout(GMOClient(), 'ORDER_DROP_3')
+
+        self.assertTrue(success)
+        self.assertEqual(result['Status'], 'CAPTURE')
+
+    def test_save_member_retry_and_save_card_not_retried(self):
+        client = GMOClient()
+        self.simulator.drop('SaveMember.idPass', processed=True)
+        self.assertEqual(client.save_member(member_id='MEMBER_DROP'), (True, {'MemberID': 'MEMBER_DROP'}))
+
+        calls = self.simulator.calls['SaveCard.idPass']
+        self.simulator.drop('SaveCard.idPass', processed=True)
+        success, error = client.save_card(member_id='MEMBER_DROP', token=TOKEN)
+
+        self.assertFalse(success)
+        self.assertEqual(error['error_code'], 'CONNECTION_ERROR')
+        self.assertEqual(self.simulator.calls['SaveCard.idPass'], calls + 1)
+
+    def stuck_checkout(self, order_id, minutes=30):
+        """A 'processing' transaction left behind by a worker that died mid-checkout"""
+        transaction = Transaction.objects.create(amount=1000, status='processing', gmo_order_id=order_id)
+        Transaction.objects.filter(pk=transaction.pk).update(created_at=timezone.now() - timedelta(minutes=minutes))
+        return transaction
+
+    def test_stale_processing_transactions_are_reconciled(self):
+        client = GMOClient()
+        charged = self.stuck_checkout('ORDER_STUCK_1')
+        self.assertTrue(self.checkout(client, 'ORDER_STUCK_1')[0])
+        entered = self.stuck_checkout('ORDER_STUCK_2')
+        self.assertTrue(client.entry_tran_brandtoken(order_id='ORDER_STUCK_2', amount=1000)[0])
+        voided = self.stuck_checkout('ORDER_STUCK_3')
+        self.checkout(client, 'ORDER_STUCK_3')
+        trade = client.search_trade('ORDER_STUCK_3')[1]
+        self.assertTrue(client.alter_tran(trade['AccessID'], trade['AccessPass'])[0])
+        missing = self.stuck_checkout('ORDER_STUCK_4')
+        in_flight = self.stuck_checkout('ORDER_STUCK_5', minutes=1)
+
+        stats = ReconciliationEngine(workers=4, chunk_size=2).run()
+
+        self.assertEqual(
+            {key: stats[key] for key in ('selected', 'completed', 'cancelled', 'failed', 'unresolved')},
+            {'selected': 4, 'completed': 1, 'cancelled': 1, 'failed': 2, 'unresolved': 0},
+        )
+        statuses = dict(Transaction.objects.values_list('gmo_order_id', 'status'))
+        self.assertEqual(statuses, {
+            charged.gmo_order_id: 'completed', entered.gmo_order_id: 'failed', voided.gmo_order_id: 'cancelled',
+            missing.gmo_order_id: 'failed', in_flight.gmo_order_id: 'processing',
+        })
+        self.assertTrue(Transaction.objects.get(pk=charged.pk).gmo_access_id)
+        self.assertEqual(Transaction.objects.get(pk=missing.pk).error_message, 'Order not found at GMO PG')
+        self.assertFalse(JobCheckpoint.objects.exists())
+
+    def test_reconciliation_resumes_from_checkpoint(self):
+        for n in range(5):
+            self.stuck_checkout(f'ORDER_RESUME_{n}', minutes=30 - n)
+        # The first lookup fails: that row stays 'processing' for the next run
+        self.simulator.inject('SearchTrade.idPass', 'E01', 'E01010001')
+
+        first = ReconciliationEngine(chunk_size=2, limit=2).run()
+        self.assertEqual((first['selected'], first['failed'], first['unresolved']), (2, 1, 1))
+        self.assertEqual(JobCheckpoint.objects.get().position['transaction_id'],
+                         str(Transaction.objects.get(gmo_order_id='ORDER_RESUME_1').pk))
+
+        calls = self.simulator.calls['SearchTrade.idPass']
+        second = ReconciliationEngine(chunk_size=2).run()
+        self.assertEqual((second['selected'], second['failed']), (3, 3))
+        self.assertEqual(self.simulator.calls['SearchTrade.idPass'], calls + 3)
+        self.assertFalse(JobCheckpoint.objects.exists())
+
+        # The run reached the end, so the next one starts over
+        self.assertEqual(ReconciliationEngine().run()['failed'], 1)
+        self.assertFalse(Transaction.objects.filter(status='processing').exists())
+
+class GMOResponseTests(TestCase):
+    def test_ampersand_and_line_formats(self):
+        for body in (b'AccessID=abc&AccessPass=def', b'AccessID=abc\r\nAccessPass=def\r\n'):
+            result = decode_response(body)
+            self.assertEqual(result.fields, {'AccessID': 'abc', 'AccessPass': 'def'})
+            self.assertTrue(result.is_success)
+            self.assertFalse(result.is_error)
+
+    def test_multiple_errors_are_split(self):
+        result = decode_response(b'ErrCode=E01|E01&ErrInfo=E01010001|E01040010')
+
+        self.assertTrue(result.is_error)
+        self.assertEqual(result.error_codes, ['E01', 'E01'])
+        self.assertEqual(result.error_infos, ['E01010001', 'E01040010'])
+        self.assertEqual(result.error_info, 'E01010001|E01040010')
+
+    def test_shift_jis_body(self):
+        body = 'ClientField1=テスト&Status=CAPTURE'.encode('cp932')
+        charset = charset_from_content_type('text/plain; charset=Windows-31J')
+
+        self.assertEqual(charset, 'cp932')
+        self.assertEqual(decode_response(body, charset).get('ClientField1'), 'テスト')
+        self.assertEqual(charset_from_content_type('text/plain'), 'cp932')
+        self.assertEqual(decode_response(body, 'no-such-codec').get('Status'), 'CAPTURE')
+
+    def test_fuzz_random_bytes_never_raise(self):
+        rng = random.Random(1234)
+        alphabet = b'=&|\r\n ErCodInf0123\x82\xa0\xff'
+        for _ in range(2000):
+            body = bytes(rng.choice(alphabet) for _ in range(rng.randrange(64)))
+            result = decode_response(body)
+            self.assertIsInstance(result.fields, dict)
+            self.assertEqual(result.is_error, bool(result.error_codes or result.error_infos)
+                             or result.get('Status') == 'FAILURE')
+
+    def test_fuzz_round_trip_matches_legacy_parser(self):
+        rng = random.Random(5678)
+        chars = 'abcXYZ0189_-.|:/ '
+        for _ in range(500):
+            fields = {}
+            for _ in range(rng.randrange(1, 8)):
+                key = rng.choice(['ErrCode', 'ErrInfo', 'AccessID', 'Status', 'OrderID'])
+                fields[key] = ''.join(rng.choice(chars) for _ in range(rng.randrange(12))).strip()
+            text = '&'.join(f"{key}={value}" for key, value in fields.items())
+
+            result = decode_response(text.encode('ascii'))
+            legacy, legacy_code, legacy_info = legacy_parse(text.replace('&', '\n'))
+
+            self.assertEqual(result.fields, fields)
+            self.assertEqual(result.fields, legacy)
+            self.assertEqual(result.error_code, legacy_code or '')
+            self.assertEqual(result.error_info, legacy_info or '')
+
+
+@override_settings(**GMO_SETTINGS)
+class ApplePayTokenTests(TestCase):
+    def test_serializer_parses_token_once(self):
+        raw = TOKEN.replace(',', ', ')
+        serializer = OneTimePaymentRequestSerializer(data={'token': raw, 'amount': '1000'})
+
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        token = serializer.validated_data['token']
+        self.assertIsInstance(token, ApplePayToken)
+        self.assertEqual(token.raw, raw)
+        self.assertEqual(token.payment_method['network'], 'Visa')
+
+    def test_rejects_non_object_json(self):
+        for raw in ('"0123456789abc"', '[1, 2, 3, 4, 5]', '{"paymentData":'):
+            serializer = OneTimePaymentRequestSerializer(data={'token': raw, 'amount': '1000'})
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('token', serializer.errors)
+
+    def test_gateway_client_forwards_original_string(self):
+        token = ApplePayToken.parse(TOKEN.replace(',', ', '))
+        client = GMOClient()
+        with mock.patch.object(client, '_make_request', return_value=(True, {})) as make_request:
+            client.exec_tran_brandtoken('access', 'pass', 'ORDER_1', token)
+            client.save_card('MEMBER_1', token, seq_mode='1')
+
+        for call in make_request.call_args_list:
+            self.assertEqual(call.args[2]['Token'], token.raw)
+
+    def test_save_card_rejects_invalid_token(self):
+        client = GMOClient()
+        with mock.patch.object(client, '_make_request') as make_request:
+            success, error = client.save_card('MEMBER_1', 'not json at all')
+
+        self.assertFalse(success)
+        self.assertEqual(error['error_code'], 'INVALID_TOKEN_FORMAT')
+        make_request.assert_not_called()
+
+
+class LoggingPipelineTests(TestCase):
+    """Background handler, JSON records, lazy fields and sampling"""
+
+    def make_logger(self, handler, level=logging.INFO):
+        logger = logging.getLogger(f'payments.tests.{self._testMethodName}')
+        logger.propagate = False
+        logger.setLevel(level)
+        logger.handlers = [handler]
+        self.addCleanup(setattr, logger, 'handlers', [])
+        return logger
+
+    def test_json_records_written_by_listener_thread(self):
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream=stream)
+        handler.setFormatter(JSONFormatter())
+        self.addCleanup(handler.close)
+        threads = []
+        logger = self.make_logger(handler)
+
+        logger.info("GMO PG API Success: %s", 'ExecTran.idPass',
+                    extra={'endpoint': 'ExecTran.idPass', 'who': Lazy(lambda: threads.append(threading.current_thread()) or 'x')})
+        handler.flush()
+
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry['message'], 'GMO PG API Success: ExecTran.idPass')
+        self.assertEqual((entry['level'], entry['endpoint'], entry['who']), ('INFO', 'ExecTran.idPass', 'x'))
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_filtered_record_is_never_formatted(self):
+        handler = BackgroundHandler(stream=io.StringIO())
+        self.addCleanup(handler.close)
+        logger = self.make_logger(handler, level=logging.WARNING)
+        expensive = mock.Mock(return_value='value')
+
+        logger.info("Merchant session received with keys: %s", Lazy(expensive))
+        handler.flush()
+
+        expensive.assert_not_called()
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        release = threading.Event()
+        stream = mock.Mock(write=lambda text: release.wait(5))
+        handler = BackgroundHandler(stream=stream, maxsize=1)
+        self.addCleanup(handler.close)
+        self.addCleanup(release.set)
+        logger = self.make_logger(handler)
+
+        started = time.monotonic()
+        for n in range(20):
+            logger.warning("record %s", n)
+
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertGreaterEqual(handler.dropped, 18)
+
+    @skipUnless(hasattr(os, 'fork'), 'needs os.fork()')
+    def test_forked_process_starts_its_own_listener(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'app.log')
+            handler = BackgroundHandler(stream=None, filename=path)
+            self.addCleanup(handler.close)
+            logger = self.make_logger(handler)
+            logger.warning("from parent")
+            handler.flush()
+
+            pid = os.fork()
+            if pid == 0:
+                # Child (a gunicorn worker of a preloaded master): must write its own records
+                code = 1
+                try:
+                    logger.warning("from child")
+                    handler.close()
+                    code = 0
+                finally:
+                    os._exit(code)
+            _, wait_status = os.waitpid(pid, 0)
+
+            self.assertEqual(os.waitstatus_to_exitcode(wait_status), 0)
+            self.assertTrue(handler.listener._thread.is_alive())
+            with open(path) as f:
+                self.assertEqual(f.read().splitlines(), ['from parent', 'from child'])
+
+    def test_close_does_not_hang_on_a_full_queue(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        handler = BackgroundHandler(stream=mock.Mock(write=lambda text: release.wait(30)), maxsize=1)
+        handler.listener.stop_timeout = 0.2
+        logger = self.make_logger(handler)
+        for n in range(5):
+            logger.warning("record %s", n)
+
+        started = time.monotonic()
+        handler.close()
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_sampling_keeps_one_in_n_info_records_per_call_site(self):
+        sample = SampleFilter(rate=0.25)
+
+        def record(level, sample_flag=True):
+            entry = logging.LogRecord('payments', level, 'services.py', 129, 'msg', (), None)
+            entry.sample = sample_flag
+            return entry
+
+        self.assertEqual([sample.filter(record(logging.INFO)) for _ in range(8)], [True, False, False, False] * 2)
+        self.assertTrue(sample.filter(record(logging.WARNING)))
+        self.assertTrue(sample.filter(record(logging.INFO, sample_flag=False)))
+
+
+@override_settings(EXPORT_TOKEN='export-secret')
+class ExportTests(TestCase):
+    """Keyset-paginated CSV/NDJSON exports"""
+
+    def setUp(self):
+        moment = timezone.now().replace(microsecond=0) - timedelta(days=2)
+        rows = [
+            Transaction(amount='1000.50', currency='USD', status='completed', gmo_order_id='ORDER_X0'),
+            Transaction(amount=2000, currency='JPY', status='failed', gmo_order_id='ORDER_X1',
+                        error_code='G02', error_message='Declined, "insufficient funds"\nretry later'),
+            Transaction(amount=3000, currency='JPY', status='completed', gmo_order_id='ORDER_X2'),
+            Transaction(amount=4000, currency='JPY', status='completed', gmo_order_id='ORDER_X3'),
+            Transaction(amount=5000, currency='JPY', status='completed', gmo_order_id='ORDER_X4'),
+        ]
+        Transaction.objects.bulk_create(rows)
+        # Equal created_at values across page boundaries exercise the primary key tie-break
+        Transaction.objects.update(created_at=moment)
+        Transaction.objects.filter(gmo_order_id='ORDER_X4').update(created_at=moment + timedelta(days=1))
+        self.moment = moment
+        self.expected = sorted(rows[:4], key=lambda row: row.pk) + [rows[4]]
+
+    def test_csv_pages_through_ties_in_keyset_order(self):
+        stream = ExportStream('transactions', 'csv', {}, page_size=2, chunk_size=2)
+        rows = list(csv.DictReader(io.StringIO(b''.join(stream).decode())))
+
+        self.assertEqual(stream.rows, 5)
+        self.assertEqual([row['transaction_id'] for row in rows], [str(row.pk) for row in self.expected])
+        failed = next(row for row in rows if row['status'] == 'failed')
+        self.assertEqual(failed['error_message'], 'Declined, "insufficient funds"\nretry later')
+        first = next(row for row in rows if row['currency'] == 'USD')
+        self.assertEqual((first['amount'], first['error_code']), ('1000.50', ''))
+        self.assertEqual(first['created_at'], self.moment.isoformat())
+        self.assertNotIn('gmo_access_pass', rows[0])
+
+    def test_filters(self):
+        def order_ids(params):
+            content = b''.join(ExportStream('transactions', 'ndjson', export_filters(params), page_size=2))
+            return [json.loads(line)['gmo_order_id'] for line in content.decode().splitlines()]
+
+        self.assertEqual(order_ids({'status': 'failed'}), ['ORDER_X1'])
+        self.assertEqual(order_ids({'currency': 'usd'}), ['ORDER_X0'])
+        self.assertEqual(order_ids({'created_from': (self.moment + timedelta(hours=1)).isoformat()}), ['ORDER_X4'])
+        self.assertEqual(len(order_ids({'status': 'completed,failed', 'created_to': timezone.localdate(self.moment).isoformat()})), 0)
+        with self.assertRaises(ValueError):
+            export_filters({'created_from': 'yesterday'})
+
+    def test_endpoint_streams_ndjson_to_authorized_callers(self):
+        url = reverse('export-transactions')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+        response = self.client.get(url, {'format': 'ndjson', 'status': 'failed'}, HTTP_AUTHORIZATION='Bearer export-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(r['gmo_order_id'], r['amount'], r['error_code']) for r in records], [('ORDER_X1', '2000.00', 'G02')])
+
+        bad = self.client.get(url, {'format': 'xml'}, HTTP_AUTHORIZATION='Bearer export-secret')
+        self.assertEqual(bad.status_code, 400)
+
+        # Staff users signed in to the admin need no token
+        self.client.force_login(get_user_model().objects.create_user('finance', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'subscriptions.csv')
+            Subscription.objects.create(member_id='M1', card_id='0', amount=980, billing_cycle='monthly')
+            call_command('export_payments', 'subscriptions', '--output', path, stderr=io.StringIO())
+            with open(path, newline='') as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual([(row['amount'], row['billing_cycle'], row['last_billing_date']) for row in rows],
+                         [('980.00', 'monthly', '')])
+        self.assertNotIn('card_id', rows[0])
+
+
+@override_settings(EXPORT_TOKEN='export-secret', **GMO_SETTINGS)
+class RollupTests(TestCase):
+    """Hourly/daily rollups updated on finalize, rebuilt by backfill and read per bucket"""
+
+    def rollups(self, granularity='day'):
+        return sorted(PaymentRollup.objects.filter(granularity=granularity).values_list(
+            'flow', 'currency', 'status', 'error_code', 'count', 'amount',
+        ))
+
+    @mock.patch.object(GMOClient, 'exec_tran_brandtoken', return_value=(True, {'Status': 'CAPTURE'}))
+    @mock.patch.object(GMOClient, 'entry_tran_brandtoken', return_value=(True, {'AccessID': 'aid', 'AccessPass': 'apass'}))
+    def test_checkouts_are_counted_in_their_buckets(self, entry, execute):
+        url = reverse('onetime-process')
+        for amount in ('1000', '500'):
+            self.client.post(url, {'token': TOKEN, 'amount': amount, 'currency': 'JPY'}, content_type='application/json')
+        entry.return_value = (False, {'error_code': 'E01', 'error_info': 'E01010001'})
+        self.client.post(url, {'token': TOKEN, 'amount': '300', 'currency': 'JPY'}, content_type='application/json')
+
+        expected = [
+            ('onetime', 'JPY', 'completed', '', 2, Decimal('1500.00')),
+            ('onetime', 'JPY', 'failed', 'E01', 1, Decimal('300.00')),
+        ]
+        self.assertEqual(self.rollups('day'), expected)
+        self.assertEqual(self.rollups('hour'), expected)
+
+        # Rebuilding from the transactions gives the same counters
+        PaymentRollup.objects.update(count=0, amount=0)
+        today = timezone.localdate()
+        self.assertEqual(backfill(today, today)['payments'], 3)
+        self.assertEqual(self.rollups('day'), expected)
+
+    def test_moved_payment_changes_buckets_but_not_totals(self):
+        payment = Transaction.objects.create(amount=800, currency='JPY', status='failed', error_code='G02')
+        RollupDelta().add_payment(payment).apply()
+        RollupDelta().move_payment(payment, 'cancelled').apply()
+
+        self.assertEqual(self.rollups(), [
+            ('onetime', 'JPY', 'cancelled', 'G02', 1, Decimal('800.00')),
+            ('onetime', 'JPY', 'failed', 'G02', 0, Decimal('0.00')),
+        ])
+        start = timezone.now() - timedelta(days=1)
+        [bucket] = summary('day', start, start + timedelta(days=2))
+        self.assertEqual((bucket['count'], bucket['cancelled'], bucket['failed']), (1, 1, 0))
+        self.assertEqual((bucket['volume'], bucket['error_codes']), ('0', {'G02': 1}))
+
+    @mock.patch.object(GMOClient, 'exec_tran_recurring', return_value=(True, {'Status': 'CAPTURE'}))
+    def test_endpoint_serves_recurring_charges(self, charge):
+        subscription = Subscription.objects.create(member_id='M1', card_id='0', amount=980, billing_cycle='monthly')
+        self.client.post(reverse('recurring-charge'), {'subscription_id': str(subscription.subscription_id), 'amount': '980'},
+                         content_type='application/json')
+        charge.return_value = (False, {'error_code': 'E01', 'error_info': 'E01040010'})
+        self.client.post(reverse('recurring-charge'), {'subscription_id': str(subscription.subscription_id), 'amount': '980'},
+                         content_type='application/json')
+
+        url = reverse('payment-rollups')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        response = self.client.get(url, {'granularity': 'hour', 'flow': 'recurring_charge'},
+                                   HTTP_AUTHORIZATION='Bearer export-secret')
+        self.assertEqual(response.status_code, 200)
+        [bucket] = response.json()['buckets']
+        self.assertEqual(
+            {key: bucket[key] for key in ('currency', 'count', 'completed', 'failed', 'success_rate', 'volume', 'error_codes')},
+            {'currency': 'JPY', 'count': 2, 'completed': 1, 'failed': 1, 'success_rate': 0.5, 'volume': '980.00',
+             'error_codes': {'E01': 1}},
+        )
+
+        for params in ({'granularity': 'week'}, {'start': 'yesterday'}, {'granularity': 'hour', 'start': '2020-01-01'}):
+            self.assertEqual(self.client.get(url, params, HTTP_AUTHORIZATION='Bearer export-secret').status_code, 400)
+
+
+@override_settings(**GMO_SETTINGS)
+class BillingEngineTests(TestCase):
+    """BillingEngine charges due subscriptions in keyset chunks and advances their billing dates"""
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.due = self.now - timedelta(days=1)
+
+    def subscription(self, due=None, **fields):
+        return Subscription.objects.create(**{
+            'member_id': 'M1', 'card_id': '0', 'amount': 980, 'billing_cycle': 'monthly',
+            'next_billing_date': due or self.due, **fields,
+        })
+
+    @mock.patch.object(GMOClient, 'exec_tran_recurring', return_value=(True, {'Status': 'CAPTURE'}))
+    def test_charged_subscription_is_advanced(self, charge):
+        subscription = self.subscription()
+
+        stats = BillingEngine(workers=2, now=self.now).run()
+
+        self.assertEqual((stats['selected'], stats['charged']), (1, 1))
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.next_billing_date, self.due + timedelta(days=30))
+        self.assertIsNotNone(subscription.last_billing_date)
+        self.assertEqual(PaymentRollup.objects.get(granularity='day').count, 1)
+        # No longer due: a second run charges nothing
+        self.assertEqual(BillingEngine(workers=2, now=self.now).run()['selected'], 0)
+        self.assertEqual(charge.call_count, 1)
+
+    @mock.patch.object(GMOClient, 'exec_tran_recurring', return_value=(True, {'Status': 'CAPTURE'}))
+    def test_chunks_page_through_equal_due_dates(self, charge):
+        subscriptions = [self.subscription() for _ in range(4)] + [self.subscription(due=self.due + timedelta(hours=1))]
+        Subscription.objects.create(member_id='M9', card_id='0', amount=980, billing_cycle='monthly',
+                                    next_billing_date=self.now + timedelta(days=1))
+        expected = sorted(subscriptions[:4], key=lambda row: row.pk) + subscriptions[4:]
+
+        chunks = list(BillingEngine(chunk_size=2, now=self.now).due_chunks())
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([row.pk for chunk in chunks for row in chunk], [row.pk for row in expected])
+
+    @mock.patch.object(GMOClient, 'search_trade', return_value=(True, {'Status': 'CAPTURE'}))
+    @mock.patch.object(GMOClient, 'exec_tran_recurring')
+    def test_charged_and_failed_subscriptions_are_written_per_chunk(self, charge, search_trade):
+        charged, declined, duplicate = self.subscription(), self.subscription(), self.subscription()
+        responses = {
+            declined.subscription_id.hex: (False, {'error_code': 'G02', 'error_info': '42G020000'}),
+            # Order ID already used: charged by an earlier, interrupted run
+            duplicate.subscription_id.hex: (False, {'error_code': 'E01', 'error_info': 'E01040010'}),
+        }
+        charge.side_effect = lambda order_id, **kwargs: responses.get(order_id.split('_')[1], (True, {'Status': 'CAPTURE'}))
+
+        with mock.patch.object(QuerySet, 'bulk_update', autospec=True, side_effect=QuerySet.bulk_update) as bulk_update:
+            stats = BillingEngine(workers=2, chunk_size=10, now=self.now).run()
+
+        self.assertEqual((stats['charged'], stats['already_charged'], stats['failed']), (1, 1, 1))
+        # One bulk UPDATE for the chunk, with the charged and already charged subscriptions only
+        [(_, updated, fields)] = [call.args for call in bulk_update.call_args_list]
+        self.assertEqual({row.pk for row in updated}, {charged.pk, duplicate.pk})
+        self.assertEqual(fields, ['next_billing_date', 'last_billing_date', 'updated_at'])
+        dates = dict(Subscription.objects.values_list('pk', 'next_billing_date'))
+        self.assertEqual(dates[charged.pk], self.due + timedelta(days=30))
+        self.assertEqual(dates[duplicate.pk], self.due + timedelta(days=30))
+        self.assertEqual(dates[declined.pk], self.due)
+        self.assertEqual(sorted(PaymentRollup.objects.filter(granularity='day').values_list('status', 'error_code', 'count')),
+                         [('completed', '', 1), ('failed', 'G02', 1)])
+
+    @mock.patch.object(GMOClient, 'search_trade')
+    @mock.patch.object(GMOClient, 'exec_tran_recurring')
+    def test_declined_order_is_not_counted_as_charged_on_retry(self, charge, search_trade):
+        subscription = self.subscription()
+        order_id = f'BILL_{subscription.subscription_id.hex}_{int(self.due.timestamp())}'
+
+        charge.return_value = (False, {'error_code': 'G02', 'error_info': '42G020000'})
+        self.assertEqual(BillingEngine(now=self.now).run()['failed'], 1)
+
+        # The declined attempt registered the order ID, so the next run gets a duplicate
+        charge.return_value = (False, {'error_code': 'E01', 'error_info': 'E01040010'})
+        search_trade.return_value = (True, {'Status': 'UNPROCESSED'})
+        stats = BillingEngine(now=self.now).run()
+
+        self.assertEqual((stats['already_charged'], stats['failed']), (0, 1))
+        search_trade.assert_called_once_with(order_id)
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.next_billing_date, self.due)
+        self.assertIsNone(subscription.last_billing_date)
+
+        search_trade.return_value = (False, {'error_code': 'E01', 'error_infos': ['E01110002']})
+        self.assertEqual(BillingEngine(now=self.now).run()['failed'], 1)
+
+        search_trade.return_value = (True, {'Status': 'SALES'})
+        self.assertEqual(BillingEngine(now=self.now).run()['already_charged'], 1)
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.next_billing_date, self.due + timedelta(days=30))
+
+    @mock.patch.object(GMOClient, 'exec_tran_recurring', return_value=(False, {'error_code': 'G02', 'error_info': '42G020000'}))
+    def test_interrupted_run_resumes_from_checkpoint(self, charge):
+        subscriptions = sorted([self.subscription() for _ in range(4)], key=lambda row: row.pk)
+
+        # Declined charges stay due; the checkpoint keeps the next run from retrying them
+        first = BillingEngine(chunk_size=2, limit=2, now=self.now).run()
+        self.assertEqual((first['selected'], first['failed']), (2, 2))
+        self.assertEqual(BillingEngine(now=self.now).load_cursor()[1], subscriptions[1].pk)
+
+        charge.reset_mock()
+        second = BillingEngine(chunk_size=2, now=self.now).run()
+        self.assertEqual(second['selected'], 2)
+        charged = sorted(call.kwargs['order_id'].split('_')[1] for call in charge.call_args_list)
+        self.assertEqual(charged, sorted(row.pk.hex for row in subscriptions[2:]))
+        self.assertFalse(JobCheckpoint.objects.filter(name='bill_subscriptions').exists())
+
+        # --restart ignores a checkpoint and starts from the earliest due date
+        BillingEngine(now=self.now).save_cursor((self.due, subscriptions[3].pk))
+        self.assertEqual(BillingEngine(now=self.now, restart=True).run()['selected'], 4)
+
+
+class MetricsRegistryTests(TestCase):
+    """Per-thread aggregation, text exposition and the multi-process merge"""
+
+    def setUp(self):
+        self.registry = Registry()
+        self.latency = Histogram('latency_seconds', 'Latency', ('endpoint',), buckets=(0.1, 1.0), registry=self.registry)
+        self.outcomes = Counter('outcomes_total', 'Outcomes', ('outcome',), registry=self.registry)
+
+    def test_exposition_format(self):
+        for value in (0.05, 0.5, 5.0):
+            self.latency.observe(value, 'ExecTran.idPass')
+        self.outcomes.inc('completed', amount=2)
+
+        self.assertEqual(self.registry.exposition().splitlines(), [
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{endpoint="ExecTran.idPass",le="0.1"} 1',
+            'latency_seconds_bucket{endpoint="ExecTran.idPass",le="1"} 2',
+            'latency_seconds_bucket{endpoint="ExecTran.idPass",le="+Inf"} 3',
+            'latency_seconds_sum{endpoint="ExecTran.idPass"} 5.55',
+            'latency_seconds_count{endpoint="ExecTran.idPass"} 3',
+            '# HELP outcomes_total Outcomes',
+            '# TYPE outcomes_total counter',
+            'outcomes_total{outcome="completed"} 2',
+        ])
+
+    def test_shards_of_finished_threads_are_kept(self):
+        def record():
+            for _ in range(1000):
+                self.outcomes.inc('completed')
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        self.outcomes.inc('completed')
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.registry.snapshot(), {('outcomes_total', ('completed',)): 4001})
+        self.assertEqual(len(self.registry._shards), 1)
+        self.outcomes.inc('completed')
+        self.assertEqual(self.registry.snapshot()[('outcomes_total', ('completed',))], 4002)
+
+    def test_scrape_merges_worker_process_files(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.latency.observe(0.5, 'ExecTran.idPass')
+            self.outcomes.inc('failed')
+            self.registry.write_snapshot()
+            with open(os.path.join(directory, 'metrics-1.json'), 'w') as f:
+                json.dump([['outcomes_total', ['failed'], 2.0],
+                           ['latency_seconds', ['ExecTran.idPass'], [1, 0, 0, 0.05, 1]]], f)
+
+            totals = self.registry.collect()
+
+        self.assertEqual(totals[('outcomes_total', ('failed',))], 3)
+        self.assertEqual(totals[('latency_seconds', ('ExecTran.idPass',))], [1, 1, 0, 0.55, 2])
+
+    @skipUnless(hasattr(os, 'fork'), 'needs os.fork()')
+    @override_settings(METRICS_FLUSH_SECONDS=0.05)
+    def test_forked_worker_flushes_its_own_totals(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            # The preloaded master records metrics (and starts its flusher) before forking
+            self.outcomes.inc('failed', amount=3)
+            self.assertTrue(self.registry._flusher.is_alive())
+
+            pid = os.fork()
+            if pid == 0:
+                # Child (a gunicorn worker): must start from zero and write its own file
+                code = 1
+                try:
+                    self.outcomes.inc('completed')
+                    if self.registry.snapshot() == {('outcomes_total', ('completed',)): 1}:
+                        deadline = time.monotonic() + 5
+                        while time.monotonic() < deadline and not os.path.exists(
+                                os.path.join(directory, f'metrics-{os.getpid()}.json')):
+                            time.sleep(0.01)
+                        code = 0
+                finally:
+                    os._exit(code)
+            _, wait_status = os.waitpid(pid, 0)
+
+            self.assertEqual(os.waitstatus_to_exitcode(wait_status), 0)
+            with open(os.path.join(directory, f'metrics-{pid}.json')) as f:
+                self.assertEqual(json.load(f), [['outcomes_total', ['completed'], 1]])
+            self.assertEqual(self.registry.snapshot(), {('outcomes_total', ('failed',)): 3})
+
+    @skipUnless(hasattr(os, 'fork'), 'needs os.fork()')
+    def test_exited_worker_files_are_skipped_and_removed(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.outcomes.inc('failed')
+            pid = os.fork()
+            if pid == 0:
+                # Child (a worker that is later recycled): leaves its totals behind
+                try:
+                    self.outcomes.inc('failed', amount=5)
+                    self.registry.write_snapshot()
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            dead_file = os.path.join(directory, f'metrics-{pid}.json')
+            self.assertTrue(os.path.exists(dead_file))
+
+            self.assertEqual(self.registry.collect()[('outcomes_total', ('failed',))], 1)
+
+            spec = importlib.util.spec_from_file_location('gunicorn_conf', settings.BASE_DIR / 'gunicorn.conf.py')
+            gunicorn_conf = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(gunicorn_conf)
+            with mock.patch.dict(os.environ, {'METRICS_DIR': directory}):
+                gunicorn_conf.child_exit(mock.Mock(), mock.Mock(pid=pid))
+            self.assertFalse(os.path.exists(dead_file))
+
+
+VALIDATION_URL = 'https://apple-pay-gateway.apple.com/paymentservices/startSession'
+
+
+@mock.patch.object(ConfigValidator, 'validate_apple_pay_config', return_value=APPLE_CONFIG_VALID)
+@mock.patch('payments.services._validate_merchant_with_apple')
+class MerchantValidationCoalescingTests(TestCase):
+    """Concurrent validations of one (validation URL, initiativeContext) share a call to Apple"""
+
+    def setUp(self):
+        reset_circuits()
+
+    @staticmethod
+    def slow_apple(calls, delay=0.2):
+        def validate(url, timeout):
+            calls.append(url)
+            time.sleep(delay)
+            return True, {'merchantSessionIdentifier': 'SSH1', 'nonce': 'n'}
+        return validate
+
+    def test_threads_share_one_call(self, apple, apple_config):
+        calls = []
+        apple.side_effect = self.slow_apple(calls)
+        other_domain = f'{VALIDATION_URL}?initiativeContext=shop.example.com'
+        results = []
+
+        threads = [threading.Thread(target=lambda url=url: results.append(validate_merchant_with_apple(url)))
+                   for url in [VALIDATION_URL] * 5 + [other_domain]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(calls), [VALIDATION_URL, other_domain])
+        self.assertEqual([success for success, _ in results], [True] * 6)
+        self.assertEqual(len({id(session) for _, session in results}), 6)
+
+    def test_coroutines_share_one_call(self, apple, apple_config):
+        calls = []
+        apple.side_effect = self.slow_apple(calls)
+
+        async def burst():
+            return await asyncio.gather(*[avalidate_merchant_with_apple(VALIDATION_URL) for _ in range(5)])
+
+        results = asyncio.run(burst())
+
+        self.assertEqual(calls, [VALIDATION_URL])
+        self.assertEqual({session['merchantSessionIdentifier'] for _, session in results}, {'SSH1'})
+
+    async def test_async_view_returns_the_shared_session(self, apple, apple_config):
+        apple.side_effect = self.slow_apple([], delay=0)
+
+        response = await self.async_client.post(
+            reverse('async-validate-merchant'), {'validation_url': VALIDATION_URL}, content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['merchantSession']['merchantSessionIdentifier'], 'SSH1')
+
+
+@mock.patch('payments.transport._build_apple_session', side_effect=lambda cert, key: mock.Mock())
+class AppleSessionTests(TestCase):
+    """The mTLS session is reused until the certificate or key changes on disk"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cert_path = os.path.join(directory.name, 'merchant_id.pem')
+        self.key_path = os.path.join(directory.name, 'merchant_id.key')
+        for path in (self.cert_path, self.key_path):
+            with open(path, 'w') as f:
+                f.write('PEM')
+        reset_apple_session()
+        self.addCleanup(reset_apple_session)
+
+    def touch(self, path):
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_session_reused_while_files_unchanged(self, build):
+        first = get_apple_session(self.cert_path, self.key_path)
+
+        self.assertIs(get_apple_session(self.cert_path, self.key_path), first)
+        build.assert_called_once_with(self.cert_path, self.key_path)
+
+    def test_session_rebuilt_when_certificate_or_key_changes(self, build):
+        first = get_apple_session(self.cert_path, self.key_path)
+
+        self.touch(self.cert_path)
+        second = get_apple_session(self.cert_path, self.key_path)
+        self.assertIsNot(second, first)
+        first.close.assert_called_once()
+
+        self.touch(self.key_path)
+        third = get_apple_session(self.cert_path, self.key_path)
+        self.assertIsNot(third, second)
+        second.close.assert_called_once()
+
+        self.assertIs(get_apple_session(self.cert_path, self.key_path), third)
+        self.assertEqual(build.call_count, 3)
+
+    def test_session_rebuilt_for_another_certificate_path(self, build):
+        first = get_apple_session(self.cert_path, self.key_path)
+        renewed = os.path.join(os.path.dirname(self.cert_path), 'merchant_id_2025.pem')
+        with open(renewed, 'w') as f:
+            f.write('PEM')
+
+        second = get_apple_session(renewed, self.key_path)
+
+        self.assertIsNot(second, first)
+        build.assert_called_with(renewed, self.key_path)
+        first.close.assert_called_once()
+
+
+@override_settings(TRACE_EXPORTER='memory', TRACE_SAMPLE_RATE=0.0, TRACE_SLOW_MS=50)
+class TracingTests(TestCase):
+    """Span nesting, context propagation and the export decision"""
+
+    def setUp(self):
+        reset_exporter()
+        self.addCleanup(reset_exporter)
+        self.exporter = get_exporter()
+
+    def test_only_sampled_or_slow_traces_are_exported(self):
+        with start_trace('POST onetime-process') as fast:
+            with span('gmo.request', endpoint='EntryTranBrandtoken.idPass'):
+                pass
+        finish_trace(fast)
+        self.assertEqual(self.exporter.spans, [])
+
+        with start_trace('POST onetime-process') as slow:
+            time.sleep(0.06)
+        finish_trace(slow)
+        self.assertEqual([s.name for s in self.exporter.spans], ['POST onetime-process'])
+
+    def test_sampled_traceparent_continues_the_callers_trace(self):
+        trace_id, parent_id = '4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'
+        with start_trace('POST onetime-process', f'00-{trace_id}-{parent_id}-01') as root:
+            pass
+        finish_trace(root)
+
+        self.assertEqual((root.trace.trace_id, root.parent_id), (trace_id, parent_id))
+        self.assertEqual(self.exporter.spans, [root])
+
+    def test_spans_follow_asyncio_tasks(self):
+        async def call(endpoint):
+            with span('gmo.request', endpoint=endpoint) as child:
+                await asyncio.sleep(0)
+                with span('db.insert'):
+                    pass
+            return child
+
+        async def request():
+            with start_trace('POST async-recurring-setup') as root:
+                children = await asyncio.gather(call('SaveMember.idPass'), call('SaveCard.idPass'))
+            return root, children
+
+        root, children = asyncio.run(request())
+
+        self.assertEqual([c.parent_id for c in children], [root.span_id] * 2)
+        inner = [s for s in root.trace.spans if s.name == 'db.insert']
+        self.assertEqual(sorted(s.parent_id for s in inner), sorted(c.span_id for c in children))
+        self.assertIs(span('gmo.request').trace, None)
+
+    def test_exporter_is_pluggable(self):
+        with override_settings(TRACE_EXPORTER='payments.tracing.InMemoryExporter'):
+            reset_exporter()
+            self.assertIsInstance(get_exporter(), InMemoryExporter)
+        with override_settings(TRACE_EXPORTER=''):
+            reset_exporter()
+            self.assertIsNone(get_exporter())
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker('test', failure_threshold=3, reset_seconds=10, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures_and_probes_once(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.now = 20
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_success_resets_failure_count(self):
+        for _ in range(5):
+            self.breaker.record_failure()
+            self.breaker.record_failure()
+            self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_adaptive_read_timeout(self):
+        timeouts = AdaptiveTimeout(connect=2, read_min=1, read_max=30, multiplier=3, min_samples=10)
+        self.assertEqual(timeouts.timeout(), (2, 30))
+
+        for _ in range(10):
+            timeouts.observe(0.1)
+        self.assertEqual(timeouts.read, 1)
+        for _ in range(10):
+            timeouts.observe(4.0)
+        self.assertEqual(timeouts.read, 12.0)
+
+
+@override_settings(**GMO_SETTINGS, CIRCUIT_BREAKER_FAILURE_THRESHOLD=2, CIRCUIT_BREAKER_RESET_SECONDS=30)
+class GatewayCircuitTests(TestCase):
+    def setUp(self):
+        reset_circuits()
+        self.addCleanup(reset_circuits)
+
+    @mock.patch('payments.services.get_gmo_session')
+    def test_open_circuit_fails_fast_with_503(self, get_session):
+        get_session.return_value.post.side_effect = Timeout()
+        payload = {'token': TOKEN, 'amount': '1000', 'currency': 'JPY'}
+
+        statuses = [
+            self.client.post(reverse('onetime-process'), payload, content_type='application/json')
+            for _ in range(3)
+        ]
+
+        self.assertEqual([r.status_code for r in statuses], [400, 400, 503])
+        self.assertEqual(statuses[2].json()['error_code'], 'CIRCUIT_OPEN')
+        self.assertEqual(statuses[2]['Retry-After'], '30')
+        urls = [c.args[0] for c in get_session.return_value.post.call_args_list]
+        # Each timed-out EntryTran is reconciled with one SearchTrade; the third checkout calls nothing
+        self.assertEqual([url.rsplit('/', 1)[1] for url in urls], ['EntryTranBrandtoken.idPass', 'SearchTrade.idPass'] * 2)
+        connect, read = get_session.return_value.post.call_args_list[0].kwargs['timeout']
+        self.assertEqual(connect, settings.GMO_CONNECT_TIMEOUT)
+        # Capped by the retry deadline (also 30 s), which has barely started
+        self.assertAlmostEqual(read, settings.GMO_READ_TIMEOUT, delta=1)
+
+
+    @mock.patch.object(ConfigValidator, 'validate_apple_pay_config', return_value=APPLE_CONFIG_VALID)
+    def test_async_views_answer_503_when_circuit_is_open(self, apple_config):
+        for endpoint in ('EntryTranBrandtoken.idPass', 'SaveMember.idPass'):
+            for _ in range(2):
+                get_circuit(endpoint).breaker.record_failure()
+        payload = {'token': TOKEN, 'amount': '1000', 'currency': 'JPY'}
+
+        checkout = self.client.post(reverse('async-onetime-process'), payload, content_type='application/json')
+        setup = self.client.post(reverse('async-recurring-setup'), {**payload, 'billing_cycle': 'monthly'},
+                                 content_type='application/json')
+
+        for response in (checkout, setup):
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()['error_code'], 'CIRCUIT_OPEN')
+            self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(Transaction.objects.get().status, 'failed')
+        self.assertEqual(Subscription.objects.get().status, 'cancelled')
+
+
+class RetryPolicyTests(TestCase):
+    def test_actions(self):
+        policy = RetryPolicy()
+        timeout = {'error_code': 'TIMEOUT'}
+
+        self.assertEqual(policy.action('SaveCard.idPass', {'error_code': 'CONNECT_ERROR'}, retried=False), RETRY)
+        self.assertEqual(policy.action('SaveCard.idPass', timeout, retried=False), STOP)
+        self.assertEqual(policy.action('SaveMember.idPass', timeout, retried=False), RETRY)
+        self.assertEqual(policy.action('ExecTran.idPass', timeout, retried=False), RECONCILE)
+        self.assertEqual(policy.action('ExecTran.idPass', {'error_code': 'E92'}, retried=False), RETRY)
+        busy = {'error_code': 'E92|E01', 'error_codes': ['E92', 'E01'], 'error_infos': ['E92000001', 'E01010001']}
+        self.assertEqual(policy.action('ExecTran.idPass', busy, retried=False), RETRY)
+        self.assertEqual(policy.action('ExecTran.idPass', {'error_code': 'E01|E92'}, retried=False), RETRY)
+        self.assertEqual(policy.action('ExecTran.idPass', {'error_code': 'E920'}, retried=False), STOP)
+        duplicate = {'error_code': 'E01', 'error_infos': ['E01040010']}
+        self.assertEqual(policy.action('ExecTran.idPass', duplicate, retried=False), STOP)
+        self.assertEqual(policy.action('ExecTran.idPass', duplicate, retried=True), RECONCILE)
+
+    def test_backoff_is_jittered_and_capped(self):
+        policy = RetryPolicy(base_delay=0.1, max_delay=0.3, rng=random.Random(7))
+        delays = [policy.backoff(attempt) for attempt in (1, 2, 3, 4, 5) for _ in range(50)]
+
+        self.assertTrue(all(0 <= delay <= 0.3 for delay in delays))
+        self.assertEqual(len(set(delays)), len(delays))
+        self.assertTrue(all(delay <= 0.1 for delay in delays[:50]))
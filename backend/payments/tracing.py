@@ -0,0 +1,241 @@
+"""
+Request-scoped tracing
+
+TracingMiddleware opens a root span for each request to a payments view.
+Inside it, span() opens child spans: GMO PG calls (endpoint, error_code,
+response size), Apple merchant validation and database writes (see
+trace_db_writes). The current span is kept in a ContextVar, so it follows
+the request into asyncio tasks, sync_to_async threads and run_in_background().
+
+Recording a span costs a few microseconds, so every request is recorded;
+the decision to export is taken when the request ends. A trace is exported
+when it was sampled (TRACE_SAMPLE_RATE, or an incoming W3C `traceparent`
+header with the sampled flag) or when the request took TRACE_SLOW_MS or
+longer, so single slow checkouts are always kept.
+
+Outside a traced request span() returns a no-op span, and with TRACE_EXPORTER
+unset nothing is recorded at all.
+
+Exporters receive the finished spans of one trace:
+
+    FileExporter      JSON lines appended to TRACE_FILE by a background thread
+    InMemoryExporter  kept in memory (tests)
+"""
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .log import BackgroundHandler, Lazy
+
+TRACEPARENT_HEADER = 'traceparent'
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+class Trace:
+    """Spans of one request, plus whether the trace was sampled up front"""
+    __slots__ = ('trace_id', 'sampled', 'spans')
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List['Span'] = []
+
+
+class Span:
+    """A timed operation; use as a context manager"""
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', '_token')
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str], attributes: Dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = self.end_ns = 0
+
+    def set(self, **attributes) -> 'Span':
+        self.attributes.update(attributes)
+        return self
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def __enter__(self) -> 'Span':
+        self.start_ns = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.trace.spans.append(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Returned by span() outside a traced request"""
+    trace = None
+
+    def set(self, **attributes) -> '_NoopSpan':
+        return self
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: ContextVar[Optional[Span]] = ContextVar('payments_span', default=None)
+
+
+def current_span():
+    """The innermost open span, or NOOP_SPAN"""
+    return _current.get() or NOOP_SPAN
+
+
+def span(name: str, **attributes):
+    """Child span of the current span (NOOP_SPAN if there is none)"""
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes) -> Span:
+    """
+    Root span of a new trace
+
+    A valid W3C traceparent continues the caller's trace; its sampled flag
+    forces export. Otherwise the trace is sampled with TRACE_SAMPLE_RATE.
+    """
+    match = _TRACEPARENT.match(traceparent or '')
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        sampled = bool(int(flags, 16) & 1)
+    else:
+        trace_id, parent_id = '%032x' % random.getrandbits(128), None
+        sampled = random.random() < getattr(settings, 'TRACE_SAMPLE_RATE', 0.01)
+    return Span(Trace(trace_id, sampled), name, parent_id, attributes)
+
+
+def finish_trace(root: Span):
+    """Export the trace of a closed root span if it was sampled or slow"""
+    exporter = get_exporter()
+    if exporter is None:
+        return
+    if root.trace.sampled or root.duration_ms >= getattr(settings, 'TRACE_SLOW_MS', 2000):
+        exporter.export(root.trace.spans)
+
+
+_WRITE_STATEMENT = re.compile(r'^(INSERT INTO|UPDATE|DELETE FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def trace_db_writes(execute, sql, params, many, context):
+    """connection.execute_wrappers entry opening a span per INSERT/UPDATE/DELETE (e.g. Transaction.save())"""
+    parent = _current.get()
+    if parent is None:
+        return execute(sql, params, many, context)
+    match = _WRITE_STATEMENT.match(sql)
+    if match is None:
+        return execute(sql, params, many, context)
+    operation = match.group(1).split()[0].lower()
+    with Span(parent.trace, f'db.{operation}', parent.span_id, {'table': match.group(2)}):
+        return execute(sql, params, many, context)
+
+
+def install_db_tracer(sender, connection, **kwargs):
+    """connection_created receiver: trace writes on every new database connection"""
+    if trace_db_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(trace_db_writes)
+
+
+class InMemoryExporter:
+    """Keep exported spans in memory"""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        with self._lock:
+            self.spans.extend(spans)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+def _json_lines(spans: List[Span]) -> str:
+    return '\n'.join(json.dumps(s.to_dict(), default=str) for s in spans)
+
+
+class FileExporter:
+    """
+    Append spans to a file as JSON lines
+
+    Encoding and writing happen on the background thread of a
+    payments.log.BackgroundHandler; a full queue drops the trace.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.handler = BackgroundHandler(stream=None, filename=path)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def export(self, spans: List[Span]):
+        self.handler.handle(logging.makeLogRecord({'msg': Lazy(_json_lines, list(spans)), 'levelno': logging.INFO}))
+
+
+EXPORTERS = {'file': FileExporter, 'memory': InMemoryExporter}
+
+_exporter = None
+_exporter_loaded = False
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """The process-wide exporter configured by TRACE_EXPORTER (None when tracing is off)"""
+    global _exporter, _exporter_loaded
+    if not _exporter_loaded:
+        with _exporter_lock:
+            if not _exporter_loaded:
+                name = getattr(settings, 'TRACE_EXPORTER', '')
+                if name == 'file':
+                    path = getattr(settings, 'TRACE_FILE', 'logs/traces.jsonl')
+                    _exporter = FileExporter(os.path.join(settings.BASE_DIR, path))
+                elif name:
+                    _exporter = (EXPORTERS.get(name) or import_string(name))()
+                _exporter_loaded = True
+    return _exporter
+
+
+def reset_exporter() -> None:
+    """Drop the configured exporter (the next request rebuilds it from settings)"""
+    global _exporter, _exporter_loaded
+    with _exporter_lock:
+        _exporter, _exporter_loaded = None, False
@@ -0,0 +1,333 @@
+"""
+Shared HTTP transport for outbound payment gateway calls
+
+A single process-wide requests.Session is shared by every GMOClient so that
+consecutive GMO calls (EntryTran -> ExecTran, SaveMember -> SaveCard -> ExecTran)
+reuse kept-alive TCP+TLS connections instead of handshaking each time.
+
+AsyncGMOClient uses an httpx.AsyncClient with the same pool limits, one per
+event loop.
+
+Apple merchant validation gets its own long-lived session whose SSL context
+holds the Merchant Identity Certificate, so the PEM files are loaded once
+instead of on every onvalidatemerchant event.
+
+Connection reuse of both sessions is exposed on the metrics endpoint as
+payments_http_pool_* samples per service and host. They describe the pools of
+the process serving the scrape (they are not merged across METRICS_DIR).
+"""
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from typing import Dict, Optional, Tuple
+from urllib3.util.ssl_ import create_urllib3_context
+import asyncio
+import logging
+import os
+import ssl
+import threading
+import weakref
+import certifi
+import httpx
+import requests
+from .metrics import GaugeCallback
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Django-ApplePay-POC/1.0'
+
+_gmo_session: Optional[requests.Session] = None
+_gmo_session_lock = threading.Lock()
+
+
+def _build_gmo_session() -> requests.Session:
+    """
+    Build a keep-alive session with a bounded connection pool
+
+    Pool sizing comes from settings:
+        GMO_HTTP_POOL_CONNECTIONS: number of per-host pools kept alive
+        GMO_HTTP_POOL_MAXSIZE: max connections kept per host
+        GMO_HTTP_POOL_BLOCK: block (instead of opening extra throwaway
+            connections) when all connections to a host are busy
+    """
+    pool_connections = getattr(settings, 'GMO_HTTP_POOL_CONNECTIONS', 4)
+    pool_maxsize = getattr(settings, 'GMO_HTTP_POOL_MAXSIZE', 20)
+    pool_block = getattr(settings, 'GMO_HTTP_POOL_BLOCK', False)
+
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        max_retries=0,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'User-Agent': USER_AGENT,
+        'Connection': 'keep-alive',
+    })
+
+    logger.info(
+        "GMO HTTP pool created (pool_connections=%s, pool_maxsize=%s, pool_block=%s)",
+        pool_connections, pool_maxsize, pool_block,
+    )
+    return session
+
+
+def get_gmo_session() -> requests.Session:
+    """
+    Get the process-wide session used for GMO PG API calls
+
+    The session is created lazily on first use. The underlying urllib3 pools
+    are thread-safe, so the same session is shared across worker threads.
+    """
+    global _gmo_session
+    session = _gmo_session
+    if session is None:
+        with _gmo_session_lock:
+            if _gmo_session is None:
+                _gmo_session = _build_gmo_session()
+            session = _gmo_session
+    return session
+
+
+def reset_gmo_session() -> None:
+    """
+    Close the shared GMO session and drop its pooled connections
+
+    The next call to get_gmo_session() builds a fresh session, picking up
+    any changed pool settings.
+    """
+    global _gmo_session
+    with _gmo_session_lock:
+        if _gmo_session is not None:
+            _gmo_session.close()
+        _gmo_session = None
+
+
+_async_gmo_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_gmo_client() -> httpx.AsyncClient:
+    """
+    Get the pooled httpx client for GMO PG calls on the running event loop
+
+    httpx connections are bound to the event loop that opened them, so one
+    client is kept per loop (an ASGI server process normally runs a single
+    loop). Pool limits follow GMO_ASYNC_POOL_MAXSIZE and
+    GMO_ASYNC_POOL_KEEPALIVE.
+
+    Must be called from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_gmo_clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=getattr(settings, 'GMO_ASYNC_POOL_MAXSIZE', 200),
+            max_keepalive_connections=getattr(settings, 'GMO_ASYNC_POOL_KEEPALIVE', 50),
+        )
+        client = httpx.AsyncClient(
+            limits=limits,
+            headers={'User-Agent': USER_AGENT},
+        )
+        _async_gmo_clients[loop] = client
+        logger.info(
+            "GMO async HTTP pool created (max_connections=%s, max_keepalive=%s)",
+            limits.max_connections, limits.max_keepalive_connections,
+        )
+    return client
+
+
+class ClientCertAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that connects with a prebuilt SSL context
+
+    The context already carries the client certificate and the CA bundle, so
+    neither is re-read from disk when the pool opens a new connection.
+    """
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if verify is True:
+            # The CA bundle is loaded into ssl_context once; stop urllib3
+            # from re-loading it for every new connection
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+
+
+_apple_session: Optional[requests.Session] = None
+_apple_session_key: Optional[Tuple] = None
+_apple_session_lock = threading.Lock()
+
+
+def _cert_signature(cert_path: str, key_path: str) -> Tuple:
+    """Identify the on-disk certificate pair by path and modification time"""
+    return (
+        cert_path,
+        os.stat(cert_path).st_mtime_ns,
+        key_path,
+        os.stat(key_path).st_mtime_ns,
+    )
+
+
+def _build_apple_session(cert_path: str, key_path: str) -> requests.Session:
+    """Build a keep-alive session authenticating with the Merchant Identity Certificate"""
+    context = create_urllib3_context()
+    context.load_verify_locations(cafile=certifi.where())
+    context.load_cert_chain(certfile=cert_path, keyfile=key_path)
+
+    adapter = ClientCertAdapter(
+        context,
+        pool_connections=getattr(settings, 'APPLE_HTTP_POOL_CONNECTIONS', 4),
+        pool_maxsize=getattr(settings, 'APPLE_HTTP_POOL_MAXSIZE', 10),
+        max_retries=0,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.headers.update({
+        'User-Agent': USER_AGENT,
+        'Connection': 'keep-alive',
+    })
+
+    logger.info("Apple merchant validation session created (cert: %s)", cert_path)
+    return session
+
+
+def get_apple_session(cert_path: str, key_path: str) -> requests.Session:
+    """
+    Get the session used for Apple Pay merchant validation
+
+    The SSL context and connection pool are built once from the Merchant
+    Identity Certificate and reused. They are rebuilt only when the certificate
+    or key path changes or either file's modification time changes (e.g. after
+    a certificate renewal).
+
+    Args:
+        cert_path: Path to the Merchant Identity Certificate (PEM)
+        key_path: Path to the Merchant Identity private key (PEM)
+
+    Raises:
+        OSError: if either file cannot be stat'ed
+        ssl.SSLError: if the certificate or key cannot be loaded
+    """
+    global _apple_session, _apple_session_key
+    signature = _cert_signature(cert_path, key_path)
+
+    session = _apple_session
+    if session is not None and _apple_session_key == signature:
+        return session
+
+    with _apple_session_lock:
+        if _apple_session is None or _apple_session_key != signature:
+            if _apple_session is not None:
+                logger.info("Merchant Identity Certificate changed on disk, reloading SSL context")
+                _apple_session.close()
+            _apple_session = _build_apple_session(cert_path, key_path)
+            _apple_session_key = signature
+        return _apple_session
+
+
+def reset_apple_session() -> None:
+    """Close the Apple merchant validation session and drop its SSL context"""
+    global _apple_session, _apple_session_key
+    with _apple_session_lock:
+        if _apple_session is not None:
+            _apple_session.close()
+        _apple_session = None
+        _apple_session_key = None
+
+
+def _pool_stats(session: Optional[requests.Session]) -> Dict:
+    """Collect connection reuse counters from the urllib3 pools of a session"""
+    hosts = {}
+    totals = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0, 'idle_connections': 0}
+
+    if session is None:
+        return {'hosts': hosts, **totals}
+
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+
+            requests_made = pool.num_requests
+            opened = pool.num_connections
+            # The pool queue is pre-filled with None placeholders; only real
+            # connections count as idle (approximate, read without the lock)
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+
+            hosts[host] = {
+                'requests': requests_made,
+                'connections_opened': opened,
+                'connections_reused': max(requests_made - opened, 0),
+                'idle_connections': idle,
+            }
+            totals['requests'] += requests_made
+            totals['connections_opened'] += opened
+            totals['connections_reused'] += max(requests_made - opened, 0)
+            totals['idle_connections'] += idle
+
+    return {'hosts': hosts, **totals}
+
+
+def gmo_transport_stats() -> Dict:
+    """
+    Connection reuse counters for the shared GMO session
+
+    Returns:
+        dict with per-host and total 'requests', 'connections_opened',
+        'connections_reused' and 'idle_connections'. A healthy keep-alive
+        pool shows connections_reused close to requests.
+
+    Note:
+        Counters live on the urllib3 pools, so they reset when a pool is
+        evicted (more hosts than GMO_HTTP_POOL_CONNECTIONS) or the session
+        is reset.
+    """
+    return _pool_stats(_gmo_session)
+
+
+def apple_transport_stats() -> Dict:
+    """Connection reuse counters for the Apple merchant validation session"""
+    return _pool_stats(_apple_session)
+
+
+def _pool_samples(stat: str) -> Dict[Tuple[str, str], float]:
+    samples = {}
+    for service, stats in (('gmo', gmo_transport_stats()), ('apple', apple_transport_stats())):
+        for host, counters in stats['hosts'].items():
+            samples[(service, host)] = counters[stat]
+    return samples
+
+
+# Scrape-time samples of the pool counters above
+for _stat, _metric, _type, _documentation in (
+    ('requests', 'payments_http_pool_requests_total', 'counter', 'Requests sent through the pooled session'),
+    ('connections_opened', 'payments_http_pool_connections_opened_total', 'counter', 'Connections opened by the pool'),
+    ('connections_reused', 'payments_http_pool_connections_reused_total', 'counter',
+     'Requests sent on a kept-alive connection'),
+    ('idle_connections', 'payments_http_pool_idle_connections', 'gauge', 'Kept-alive connections waiting in the pool'),
+):
+    GaugeCallback(_metric, _documentation, lambda stat=_stat: _pool_samples(stat), ('service', 'host'), type=_type)
@@ -1,13 +1,22 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('config/status/', views.ConfigStatusView.as_view(), name='config-status'),
+    path('compensations/status/', views.CompensationStatusView.as_view(), name='compensation-status'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('exports/transactions/', views.ExportView.as_view(export='transactions'), name='export-transactions'),
+    path('exports/subscriptions/', views.ExportView.as_view(export='subscriptions'), name='export-subscriptions'),
+    path('rollups/', views.RollupView.as_view(), name='payment-rollups'),
     path('merchant-session/', views.MerchantSessionView.as_view(), name='merchant-session'),
     path('validate-merchant/', views.ValidateMerchantView.as_view(), name='validate-merchant'),
     path('onetime/session/', views.OneTimePaymentSessionView.as_view(), name='onetime-session'),
     path('onetime/process/', views.OneTimePaymentView.as_view(), name='onetime-process'),
     path('recurring/setup/', views.RecurringPaymentSetupView.as_view(), name='recurring-setup'),
     path('recurring/charge/', views.RecurringPaymentChargeView.as_view(), name='recurring-charge'),
+    # Async variants (non-blocking gateway calls when served under ASGI)
+    path('async/onetime/process/', async_views.AsyncOneTimePaymentView.as_view(), name='async-onetime-process'),
+    path('async/recurring/setup/', async_views.AsyncRecurringPaymentSetupView.as_view(), name='async-recurring-setup'),
+    path('async/validate-merchant/', async_views.AsyncValidateMerchantView.as_view(), name='async-validate-merchant'),
 ]
 
@@ -2,12 +2,16 @@ import json
 import uuid
 from datetime import datetime, timedelta
 from django.conf import settings
+from django.db import transaction as db_transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.views import View
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from .models import Transaction, Subscription
+from .models import Subscription
 from .serializers import (
     TransactionSerializer,
     SubscriptionSerializer,
@@ -17,6 +21,41 @@ from .serializers import (
 )
 from .services import GMOClient, validate_merchant_with_apple
 from .config_validator import ConfigValidator
+from .persistence import PaymentRecorder, SubscriptionRecorder
+from .pipeline import StageTimer, run_in_background
+from .idempotency import idempotent, order_id_for, IDEMPOTENCY_HEADER
+from .circuit_breaker import is_circuit_open
+from .log import Lazy
+from .compensation import fail_with_compensation, queue_stats
+from .metrics import METRICS_CONTENT_TYPE, REGISTRY, payment_outcomes
+from .exports import CONTENT_TYPES, ExportStream, export_filters, parse_moment
+from .rollups import GRANULARITIES, MAX_BUCKETS, RollupDelta, default_range, summary
+
+
+def reporting_authorized(request) -> bool:
+    """Staff users (admin session) and callers sending EXPORT_TOKEN as a Bearer token"""
+    token = getattr(settings, 'EXPORT_TOKEN', '')
+    return request.user.is_staff or bool(
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+
+
+def gateway_failure(data, error, default_status=status.HTTP_400_BAD_REQUEST, respond=Response):
+    """
+    Response for a failed gateway call
+
+    A call refused by an open circuit breaker answers 503 with its error_code
+    and Retry-After, so clients back off instead of retrying into the outage.
+    The async views pass respond=JsonResponse.
+    """
+    if is_circuit_open(error):
+        response = respond(
+            {**data, 'error': error.get('error', data.get('error')), 'error_code': error['error_code']},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+        response['Retry-After'] = str(error.get('retry_after', 1))
+        return response
+    return respond(data, status=default_status)
 
 
 class ConfigStatusView(APIView):
@@ -27,8 +66,8 @@ class ConfigStatusView(APIView):
     permission_classes = [AllowAny]
     
     def get(self, request):
-        """Get configuration validation status"""
-        validation = ConfigValidator.validate_all()
+        """Get configuration validation status (cached for CONFIG_STATUS_CACHE_SECONDS)"""
+        validation = ConfigValidator.cached_status()
         
         return Response({
             'all_valid': validation['all_valid'],
@@ -55,6 +94,98 @@ class ConfigStatusView(APIView):
         })
 
 
+class CompensationStatusView(APIView):
+    """
+    Depth and age of the pending void/refund queue
+    A growing depth or age means the process_compensations worker is down or GMO PG keeps refusing
+    """
+    permission_classes = [AllowAny]
+    
+    def get(self, request):
+        """Get compensation queue metrics"""
+        return Response(queue_stats())
+
+
+class MetricsView(View):
+    """
+    Prometheus scrape endpoint (text format 0.0.4)
+    If METRICS_TOKEN is set, the scraper must send it as a Bearer token
+    """
+    
+    def get(self, request):
+        """Render all payment metrics (every worker's, when METRICS_DIR is set)"""
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401)
+        return HttpResponse(REGISTRY.exposition(), content_type=METRICS_CONTENT_TYPE)
+
+
+class ExportView(View):
+    """
+    Stream all transactions or subscriptions matching the filters as CSV or NDJSON
+    Open to staff users (admin session) and to callers sending EXPORT_TOKEN as a Bearer token
+    Query parameters: format (csv, ndjson), status, currency, created_from, created_to
+    """
+    export = ''
+    
+    def get(self, request):
+        """Stream the export; memory use does not depend on the number of rows"""
+        if not reporting_authorized(request):
+            return HttpResponse(status=401)
+        
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in CONTENT_TYPES:
+            return JsonResponse({'error': f"format must be one of: {', '.join(CONTENT_TYPES)}"}, status=400)
+        try:
+            lookups = export_filters(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        response = StreamingHttpResponse(ExportStream(self.export, fmt, lookups), content_type=CONTENT_TYPES[fmt])
+        filename = f"{self.export}-{timezone.now():%Y%m%d-%H%M%S}.{fmt}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class RollupView(View):
+    """
+    Payment counts, success rate, volume and error codes per hour or day, from the rollups
+    Open to the same callers as the exports
+    Query parameters: granularity (hour, day), start, end, flow, currency
+    """
+    
+    def get(self, request):
+        """Read the buckets in [start, end); cost depends on the number of buckets, not of payments"""
+        if not reporting_authorized(request):
+            return HttpResponse(status=401)
+        
+        granularity = request.GET.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return JsonResponse({'error': f"granularity must be one of: {', '.join(GRANULARITIES)}"}, status=400)
+        start, end = default_range(granularity)
+        try:
+            if request.GET.get('start'):
+                start = parse_moment('start', request.GET['start'])
+            if request.GET.get('end'):
+                end = parse_moment('end', request.GET['end'])
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if end <= start:
+            return JsonResponse({'error': 'end must be after start'}, status=400)
+        if (end - start) / GRANULARITIES[granularity] > MAX_BUCKETS:
+            return JsonResponse({'error': f'range spans more than {MAX_BUCKETS} {granularity} buckets'}, status=400)
+        
+        return JsonResponse({
+            'granularity': granularity,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'buckets': summary(
+                granularity, start, end,
+                flow=request.GET.get('flow') or None, currency=request.GET.get('currency') or None,
+            ),
+        })
+
+
 class MerchantSessionView(APIView):
     """
     Generate merchant session for Apple Pay validation
@@ -139,8 +270,8 @@ class ValidateMerchantView(APIView):
             parsed_origin = urlparse(origin)
             request_domain = parsed_origin.hostname or request_domain
         
-        logger.info(f"Merchant validation request from domain: {request_domain}")
-        logger.info(f"Validation URL: {validation_url}")
+        logger.info("Merchant validation request from domain: %s", request_domain)
+        logger.info("Validation URL: %s", validation_url)
         
         # Check if certificate files exist - FAIL FAST if not configured
         if not cert_path or not key_path:
@@ -162,8 +293,8 @@ class ValidateMerchantView(APIView):
 
         if not cert_file.exists() or not key_file.exists():
             logger.error(
-                f"❌ Certificate files not found. Cert: {cert_path} (exists: {cert_file.exists()}), "
-                f"Key: {key_path} (exists: {key_file.exists()})"
+                "❌ Certificate files not found. Cert: %s (exists: %s), Key: %s (exists: %s)",
+                cert_path, cert_file.exists(), key_path, key_file.exists(),
             )
             return Response(
                 {
@@ -182,15 +313,15 @@ class ValidateMerchantView(APIView):
 
         # Use REAL merchant validation with Apple
         logger.info("✅ Using REAL merchant validation with Apple servers")
-        logger.info(f"Certificate file: {cert_file}")
-        logger.info(f"Key file: {key_file}")
-        logger.info(f"Merchant ID: {merchant_id}")
+        logger.debug("Certificate file: %s", cert_file)
+        logger.debug("Key file: %s", key_file)
+        logger.debug("Merchant ID: %s", merchant_id)
 
         success, result = validate_merchant_with_apple(validation_url)
 
         if success:
             logger.info("✅✅✅ Merchant validation SUCCESSFUL with Apple")
-            logger.info(f"Merchant session received with keys: {list(result.keys()) if isinstance(result, dict) else 'N/A'}")
+            logger.info("Merchant session received with keys: %s", Lazy(lambda: list(result) if isinstance(result, dict) else 'N/A'))
             # Return real merchant session from Apple
             return Response({
                 'merchantSession': result,
@@ -200,10 +331,10 @@ class ValidateMerchantView(APIView):
             # Validation failed, return error with details
             error_msg = result.get('error', 'Unknown error')
             error_code = result.get('error_code', 'VALIDATION_ERROR')
-            logger.error(f"❌ Merchant validation failed: {error_code} - {error_msg}")
-            logger.error(f"Full error details: {result}")
+            logger.error("❌ Merchant validation failed: %s - %s", error_code, error_msg)
+            logger.error("Full error details: %s", result)
 
-            return Response(
+            return gateway_failure(
                 {
                     'error': error_msg,
                     'error_code': error_code,
@@ -217,7 +348,8 @@ class ValidateMerchantView(APIView):
                         'Ensure server supports TLS 1.2+ with required cipher suites',
                     ]
                 },
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                result,
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
 
@@ -271,6 +403,7 @@ class OneTimePaymentView(APIView):
     """
     permission_classes = [AllowAny]
     
+    @idempotent
     def post(self, request):
         serializer = OneTimePaymentRequestSerializer(data=request.data)
         
@@ -287,24 +420,27 @@ class OneTimePaymentView(APIView):
         # Convert amount to integer (GMO PG expects integer, e.g., 1000 for 1000 JPY)
         amount_int = int(float(amount) * 100) if currency in ['USD', 'EUR'] else int(amount)
         
-        # Create transaction record
-        transaction = Transaction.objects.create(
+        # Transaction is held in memory and written only at checkpoints
+        # (one INSERT before the gateway calls, one UPDATE with the final state)
+        recorder = PaymentRecorder.new(
             amount=amount,
             currency=currency,
             status='processing'
         )
+        transaction_id = recorder.transaction_id
         
         # Validate GMO credentials before processing
         gmo_config = ConfigValidator.validate_gmo_credentials()
         if not gmo_config['valid']:
-            transaction.status = 'failed'
-            transaction.error_code = 'CONFIG_ERROR'
-            transaction.error_message = 'GMO Payment Gateway not configured: ' + ', '.join(gmo_config['errors'])
-            transaction.save()
+            recorder.finalize(
+                'failed',
+                error_code='CONFIG_ERROR',
+                error_message='GMO Payment Gateway not configured: ' + ', '.join(gmo_config['errors']),
+            )
             
             return Response(
                 {
-                    'transaction_id': str(transaction.transaction_id),
+                    'transaction_id': str(transaction_id),
                     'status': 'failed',
                     'error': 'Payment gateway not configured',
                     'errors': gmo_config['errors'],
@@ -314,7 +450,11 @@ class OneTimePaymentView(APIView):
             )
         
         gmo_client = GMOClient()
-        order_id = f"ORDER_{transaction.transaction_id}"
+        order_id = f"ORDER_{transaction_id}"
+        
+        # Checkpoint: persist with the order ID before calling the gateway,
+        # so an interrupted checkout can be reconciled by gmo_order_id
+        recorder.set(gmo_order_id=order_id).insert()
         
         # Step 1: Entry transaction
         success, entry_response = gmo_client.entry_tran_brandtoken(
@@ -324,36 +464,32 @@ class OneTimePaymentView(APIView):
         )
         
         if not success:
-            transaction.status = 'failed'
-            transaction.error_code = entry_response.get('error_code', 'ENTRY_ERROR')
-            transaction.error_message = entry_response.get('error_info', 'Transaction entry failed')
-            transaction.save()
+            recorder.finalize(
+                'failed',
+                error_code=entry_response.get('error_code', 'ENTRY_ERROR'),
+                error_message=entry_response.get('error_info', 'Transaction entry failed'),
+            )
             
-            return Response({
-                'transaction_id': str(transaction.transaction_id),
+            return gateway_failure({
+                'transaction_id': str(transaction_id),
                 'status': 'failed',
                 'error': entry_response.get('error_info', 'Transaction entry failed'),
-            }, status=status.HTTP_400_BAD_REQUEST)
+            }, entry_response)
         
         access_id = entry_response.get('AccessID')
         access_pass = entry_response.get('AccessPass')
         
         if not access_id or not access_pass:
-            transaction.status = 'failed'
-            transaction.error_message = 'Failed to get AccessID/AccessPass'
-            transaction.save()
+            recorder.finalize('failed', error_message='Failed to get AccessID/AccessPass')
             
             return Response({
-                'transaction_id': str(transaction.transaction_id),
+                'transaction_id': str(transaction_id),
                 'status': 'failed',
                 'error': 'Failed to initialize transaction',
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        # Update transaction with GMO data
-        transaction.gmo_access_id = access_id
-        transaction.gmo_access_pass = access_pass
-        transaction.gmo_order_id = order_id
-        transaction.save()
+        # Keep GMO access data in memory; written with the final state
+        recorder.set(gmo_access_id=access_id, gmo_access_pass=access_pass)
         
         # Step 2: Execute transaction with Apple Pay token
         success, exec_response = gmo_client.exec_tran_brandtoken(
@@ -364,45 +500,31 @@ class OneTimePaymentView(APIView):
         )
 
         if success and 'Status' in exec_response:
-            transaction.status = 'completed'
-            transaction.save()
+            recorder.finalize('completed')
 
             return Response({
-                'transaction_id': str(transaction.transaction_id),
+                'transaction_id': str(transaction_id),
                 'status': 'completed',
                 'amount': str(amount),
                 'currency': currency,
                 'gmo_order_id': order_id,
             }, status=status.HTTP_200_OK)
         else:
-            # ExecTran failed - rollback the transaction using AlterTran
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"ExecTran failed for transaction {transaction.transaction_id}, attempting rollback")
-
-            # Attempt to void/cancel the transaction
-            rollback_success, rollback_response = gmo_client.alter_tran(
-                access_id=access_id,
-                access_pass=access_pass,
-                job_cd='VOID'
+            # ExecTran failed - the order must be voided at GMO PG. Queue the
+            # void for the compensation worker instead of waiting on AlterTran
+            fail_with_compensation(
+                recorder,
+                'void',
+                error_code=exec_response.get('error_code', 'EXEC_ERROR'),
+                error_message=exec_response.get('error_info', 'Transaction execution failed'),
             )
 
-            if rollback_success:
-                logger.info(f"Transaction {transaction.transaction_id} successfully rolled back (voided)")
-                transaction.status = 'cancelled'
-            else:
-                logger.error(f"Failed to rollback transaction {transaction.transaction_id}: {rollback_response}")
-                transaction.status = 'failed'
-
-            transaction.error_code = exec_response.get('error_code', 'EXEC_ERROR')
-            transaction.error_message = exec_response.get('error_info', 'Transaction execution failed')
-            transaction.save()
-
             return Response({
-                'transaction_id': str(transaction.transaction_id),
-                'status': transaction.status,
+                'transaction_id': str(transaction_id),
+                'status': 'failed',
                 'error': exec_response.get('error_info', 'Transaction execution failed'),
-                'rolled_back': rollback_success,
+                'rolled_back': False,
+                'rollback': 'queued',
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -412,6 +534,7 @@ class RecurringPaymentSetupView(APIView):
     """
     permission_classes = [AllowAny]
     
+    @idempotent
     def post(self, request):
         serializer = RecurringPaymentSetupSerializer(data=request.data)
         
@@ -429,14 +552,6 @@ class RecurringPaymentSetupView(APIView):
         # Convert amount to integer
         amount_int = int(float(amount) * 100) if currency in ['USD', 'EUR'] else int(amount)
         
-        # Create subscription record
-        subscription = Subscription.objects.create(
-            amount=amount,
-            currency=currency,
-            billing_cycle=billing_cycle,
-            status='active'
-        )
-        
         # Calculate next billing date based on cycle
         next_billing = timezone.now()
         if billing_cycle.lower() == 'monthly':
@@ -444,117 +559,127 @@ class RecurringPaymentSetupView(APIView):
         elif billing_cycle.lower() == 'yearly':
             next_billing += timedelta(days=365)
         
-        subscription.next_billing_date = next_billing
-        subscription.save()
+        # Subscription is held in memory and written once per state change:
+        # one INSERT (alongside SaveMember) and one UPDATE with the outcome
+        timer = StageTimer()
+        recorder = SubscriptionRecorder.new(
+            amount=amount,
+            currency=currency,
+            billing_cycle=billing_cycle,
+            status='active',
+            next_billing_date=next_billing,
+        )
+        subscription_id = recorder.subscription_id
         
         # Validate GMO credentials before processing
-        gmo_config = ConfigValidator.validate_gmo_credentials()
-        apple_config = ConfigValidator.validate_apple_pay_config()
+        with timer.stage('config'):
+            gmo_config = ConfigValidator.validate_gmo_credentials()
+            apple_config = ConfigValidator.validate_apple_pay_config()
         
         if not gmo_config['valid']:
-            subscription.status = 'cancelled'
-            subscription.save()
+            recorder.finalize('cancelled')
             
-            return Response(
+            return timer.apply(Response(
                 {
                     'error': 'GMO Payment Gateway not configured',
                     'errors': gmo_config['errors'],
                     'setup_guide': 'See GMO_PG_APPLEPAY_SETUP.md for setup instructions',
                 },
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
+            ))
         
         if not apple_config['valid']:
-            subscription.status = 'cancelled'
-            subscription.save()
+            recorder.finalize('cancelled')
             
-            return Response(
+            return timer.apply(Response(
                 {
                     'error': 'Apple Pay not configured',
                     'errors': apple_config['errors'],
                     'setup_guide': 'See GMO_PG_APPLEPAY_SETUP.md for setup instructions',
                 },
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
+            ))
         
         gmo_client = GMOClient()
-        member_id = f"MEMBER_{subscription.subscription_id}"
-        
-        # Step 1: Save member
-        success, member_response = gmo_client.save_member(
+        member_id = f"MEMBER_{subscription_id}"
+        order_id = order_id_for(subscription_id.hex, request.headers.get(IDEMPOTENCY_HEADER))
+        
+        # Step 1: Save member. It does not need the subscription row, so it runs
+        # in the background while the row is inserted (with the member ID, so an
+        # interrupted setup can be matched to its GMO member)
+        member_call = run_in_background(
+            timer.timed('member', gmo_client.save_member),
             member_id=member_id,
-            member_name=f"Subscription {subscription.subscription_id}"
+            member_name=f"Subscription {subscription_id}"
         )
+        with timer.stage('db_insert'):
+            recorder.set(member_id=member_id).insert()
+        success, member_response = member_call.result()
         
         if not success:
-            subscription.status = 'cancelled'
-            subscription.save()
+            with timer.stage('db_final'):
+                recorder.finalize('cancelled')
             
-            return Response({
+            return timer.apply(gateway_failure({
                 'error': member_response.get('error_info', 'Failed to register member'),
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        subscription.member_id = member_id
-        subscription.save()
+            }, member_response))
         
         # Step 2: Save card (payment method)
-        success, card_response = gmo_client.save_card(
-            member_id=member_id,
-            token=token,
-            seq_mode='1'  # 1 for recurring
-        )
+        with timer.stage('card'):
+            success, card_response = gmo_client.save_card(
+                member_id=member_id,
+                token=token,
+                seq_mode='1'  # 1 for recurring
+            )
         
         if not success:
-            subscription.status = 'cancelled'
-            subscription.save()
+            with timer.stage('db_final'):
+                recorder.finalize('cancelled')
             
-            return Response({
+            return timer.apply(Response({
                 'error': card_response.get('error_info', 'Failed to save payment method'),
-            }, status=status.HTTP_400_BAD_REQUEST)
+            }, status=status.HTTP_400_BAD_REQUEST))
         
         card_id = card_response.get('CardID')
         if not card_id:
-            subscription.status = 'cancelled'
-            subscription.save()
+            with timer.stage('db_final'):
+                recorder.finalize('cancelled')
             
-            return Response({
+            return timer.apply(Response({
                 'error': 'Failed to get Card ID',
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        subscription.card_id = card_id
-        subscription.save()
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR))
         
         # Step 3: Process initial charge
-        order_id = f"ORDER_{subscription.subscription_id}_{int(timezone.now().timestamp())}"
-        success, charge_response = gmo_client.exec_tran_recurring(
-            order_id=order_id,
-            member_id=member_id,
-            card_id=card_id,
-            amount=amount_int,
-            currency=currency
-        )
+        with timer.stage('charge'):
+            success, charge_response = gmo_client.exec_tran_recurring(
+                order_id=order_id,
+                member_id=member_id,
+                card_id=card_id,
+                amount=amount_int,
+                currency=currency
+            )
         
         if success and 'Status' in charge_response:
-            subscription.last_billing_date = timezone.now()
-            subscription.save()
+            with timer.stage('db_final'):
+                recorder.finalize('active', card_id=card_id, last_billing_date=timezone.now())
             
-            return Response({
-                'subscription_id': str(subscription.subscription_id),
+            return timer.apply(Response({
+                'subscription_id': str(subscription_id),
                 'status': 'active',
                 'member_id': member_id,
                 'card_id': card_id,
                 'amount': str(amount),
                 'currency': currency,
                 'billing_cycle': billing_cycle,
-                'next_billing_date': subscription.next_billing_date.isoformat(),
-            }, status=status.HTTP_200_OK)
+                'next_billing_date': next_billing.isoformat(),
+            }, status=status.HTTP_200_OK))
         else:
-            subscription.status = 'cancelled'
-            subscription.save()
+            with timer.stage('db_final'):
+                recorder.finalize('cancelled', card_id=card_id)
             
-            return Response({
+            return timer.apply(Response({
                 'error': charge_response.get('error_info', 'Failed to process initial charge'),
-            }, status=status.HTTP_400_BAD_REQUEST)
+            }, status=status.HTTP_400_BAD_REQUEST))
 
 
 class RecurringPaymentChargeView(APIView):
@@ -563,6 +688,7 @@ class RecurringPaymentChargeView(APIView):
     """
     permission_classes = [AllowAny]
     
+    @idempotent
     def post(self, request):
         serializer = RecurringPaymentChargeSerializer(data=request.data)
         
@@ -593,7 +719,7 @@ class RecurringPaymentChargeView(APIView):
         amount_int = int(float(amount) * 100) if currency in ['USD', 'EUR'] else int(amount)
         
         gmo_client = GMOClient()
-        order_id = f"ORDER_{subscription.subscription_id}_{int(timezone.now().timestamp())}"
+        order_id = order_id_for(subscription.subscription_id.hex, request.headers.get(IDEMPOTENCY_HEADER))
         
         success, charge_response = gmo_client.exec_tran_recurring(
             order_id=order_id,
@@ -612,7 +738,10 @@ class RecurringPaymentChargeView(APIView):
             elif subscription.billing_cycle.lower() == 'yearly':
                 subscription.next_billing_date = timezone.now() + timedelta(days=365)
             
-            subscription.save()
+            with db_transaction.atomic():
+                subscription.save(update_fields=['last_billing_date', 'next_billing_date', 'updated_at'])
+                RollupDelta().add_charge(currency, 'completed', '', amount).apply()
+            payment_outcomes.inc('recurring_charge', 'completed')
             
             return Response({
                 'subscription_id': str(subscription.subscription_id),
@@ -623,6 +752,8 @@ class RecurringPaymentChargeView(APIView):
                 'next_billing_date': subscription.next_billing_date.isoformat(),
             }, status=status.HTTP_200_OK)
         else:
-            return Response({
+            RollupDelta().add_charge(currency, 'failed', charge_response.get('error_code'), amount).apply()
+            payment_outcomes.inc('recurring_charge', 'failed')
+            return gateway_failure({
                 'error': charge_response.get('error_info', 'Failed to process recurring charge'),
-            }, status=status.HTTP_400_BAD_REQUEST)
+            }, charge_response)